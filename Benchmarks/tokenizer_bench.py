@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: tokenization cost per agent turn with the long env system prompt.
+
+Replays the conversations stored in Data/test.jsonl turn by turn (system + user,
+then + assistant + tool result, ...) and compares
+  - baseline : apply_chat_template + tokenize the full conversation every turn
+  - service  : TokenizerService.encode_messages (prefix-memoized, incremental)
+
+Usage (from the repo root):
+    python -m Benchmarks.tokenizer_bench --tokenizer /path/to/tokenizer [--records 200] [--repeat 3]
+    python Benchmarks/tokenizer_bench.py --tokenizer /path/to/tokenizer [--records 200] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+Project_Root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Project_Root))   # 直接以脚本运行时也能导入仓库内的包
+
+from Client.tokenizer_service import TokenizerService
+from Utils.blob_store import BlobStore, rehydrate_record
+
+
+def load_conversations(path: Path, limit: int) -> List[List[Dict[str, str]]]:
+    conversations = []
+    blobs = BlobStore.for_records(path)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if len(conversations) >= limit:
+                break
+            if line.strip():
+                conversations.append(rehydrate_record(json.loads(line), blobs)["prompt"])
+    return conversations
+
+
+def turns(conversation: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """每次请求模型时的上下文：system + user，之后每轮追加 assistant + 工具结果"""
+    return [conversation[:i] for i in range(2, len(conversation) + 1, 2)]
+
+
+def bench(label: str, make_encode, conversations, repeat: int) -> float:
+    """make_encode() 每次重复返回一个新的 encode 函数，缓存从空开始，计入首轮 tokenize 的成本"""
+    n_turns = sum(len(turns(c)) for c in conversations)
+    best = float("inf")
+    for _ in range(repeat):
+        encode = make_encode()
+        start = time.perf_counter()
+        for conversation in conversations:
+            for context in turns(conversation):
+                encode(context)
+        best = min(best, time.perf_counter() - start)
+    per_turn = best / n_turns * 1e3
+    print(f"{label:10s} {n_turns:6d} turns  total {best:8.3f}s  per turn {per_turn:8.3f} ms")
+    return per_turn
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Tokenization cost per turn")
+    parser.add_argument("--tokenizer", default=os.getenv("LOCAL_TOKENIZER_PATH"), help="Tokenizer path or hub id")
+    parser.add_argument("--data", default=str(Project_Root / "Data" / "test.jsonl"))
+    parser.add_argument("--records", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not args.tokenizer:
+        parser.error("--tokenizer (or LOCAL_TOKENIZER_PATH) is required")
+
+    conversations = load_conversations(Path(args.data), args.records)
+    service = TokenizerService(args.tokenizer)
+    tokenizer = service.tokenizer
+
+    def baseline(messages):
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return tokenizer(text).input_ids
+
+    # 正确性：两条路径结果必须一致
+    for conversation in conversations:
+        for context in turns(conversation):
+            assert service.encode_messages(context) == baseline(context), "token ids mismatch"
+
+    base = bench("baseline", lambda: baseline, conversations, args.repeat)
+    services = []
+
+    def make_service():
+        services.append(TokenizerService(args.tokenizer))
+        return services[-1].encode_messages
+
+    svc = bench("service", make_service, conversations, args.repeat)
+    print(f"speedup    {base / svc:.2f}x   {services[-1].stats()}")
+
+
+if __name__ == "__main__":
+    main()
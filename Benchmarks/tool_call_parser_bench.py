@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: tool-call extraction over recorded assistant replies.
+
+Compares the previous regex-based MCPAgent.extract_toll_call_json (kept below
+verbatim as `legacy_extract`) with the single-pass scanner in
+Client/stream_parser.extract_tool_call, on every assistant message of
+Model_output_r*/history/*/*.jsonl (falls back to Data/test.jsonl), and on a
+synthetic long "reasoning" reply with many unclosed braces.
+
+Usage (from the repo root):
+    python -m Benchmarks.tool_call_parser_bench [--limit 50000] [--show 5]
+    python Benchmarks/tool_call_parser_bench.py [--limit 50000] [--show 5]
+"""
+
+import argparse
+import glob
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+Project_Root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Project_Root))   # 直接以脚本运行时也能导入仓库内的包
+
+from Client.stream_parser import extract_tool_call
+from Utils.blob_store import BlobStore, rehydrate_record
+
+
+def legacy_extract(text):
+    if not text or not isinstance(text, str):
+        return None
+    dict_pattern = r'\{\s*["\']?server["\']?\s*:\s*["\']?([^"\',}]+)["\']?\s*,\s*["\']?tool["\']?\s*:\s*["\']?([^"\',}]+)["\']?\s*,\s*["\']?tool_params["\']?\s*:\s*(\{.*?\})\s*\}'
+    for match in re.findall(dict_pattern, text, re.IGNORECASE | re.DOTALL):
+        try:
+            server = match[0].strip().strip('"\'')
+            tool = match[1].strip().strip('"\'')
+            tool_params_str = match[2].strip()
+            if server.lower() == "servername":
+                continue
+            try:
+                tool_params = json.loads(tool_params_str)
+            except json.JSONDecodeError:
+                simple_params = {}
+                simple_pattern = r'["\']?([^"\',\s]+)["\']?\s*:\s*["\']?([^"\',}]+)["\']?'
+                for k, v in re.findall(simple_pattern, tool_params_str):
+                    simple_params[k.strip().strip('"\'')] = v.strip().strip('"\'')
+                nested_pattern = r'["\']?([^"\',\s]+)["\']?\s*:\s*(\{[^}]*\})'
+                for k, v in re.findall(nested_pattern, tool_params_str):
+                    try:
+                        simple_params[k.strip().strip('"\'')] = json.loads(v)
+                    except json.JSONDecodeError:
+                        simple_params[k.strip().strip('"\'')] = v.strip()
+                tool_params = simple_params
+            return {"server": server, "tool": tool, "tool_params": tool_params}
+        except Exception:
+            continue
+    return None
+
+
+def load_replies(limit: int) -> List[str]:
+    files = sorted(glob.glob(str(Project_Root / "Model_output_r*" / "history" / "*" / "*.jsonl")))
+    if not files:
+        files = [str(Project_Root / "Data" / "test.jsonl")]
+    replies: List[str] = []
+    for path in files:
+        blobs = BlobStore.for_records(path)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = rehydrate_record(json.loads(line), blobs)
+                messages = record.get("history") or (record.get("prompt", []) + [
+                    {"role": "assistant", "content": record.get("chosen", "")},
+                    {"role": "assistant", "content": record.get("rejected", "")},
+                ])
+                if not isinstance(messages, list):   # 失败记录的 history 为 "[Error] ..." 字符串
+                    continue
+                for m in messages:
+                    if isinstance(m, dict) and m.get("role") == "assistant" and isinstance(m.get("content"), str):
+                        replies.append(m["content"])
+                        if len(replies) >= limit:
+                            return replies
+    return replies
+
+
+def timed(func, replies):
+    start = time.perf_counter()
+    results = [func(r) for r in replies]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tool-call extraction benchmark")
+    parser.add_argument("--limit", type=int, default=50000, help="Max assistant replies to load")
+    parser.add_argument("--show", type=int, default=3, help="Print this many disagreements")
+    parser.add_argument("--stress-size", type=int, default=5000, help="Unclosed call fragments in the synthetic reply")
+    args = parser.parse_args()
+
+    replies = load_replies(args.limit)
+    total_chars = sum(len(r) for r in replies)
+    print(f"{len(replies)} assistant replies, {total_chars / 1e6:.1f}M chars")
+
+    t_legacy, legacy = timed(legacy_extract, replies)
+    t_scan, scanned = timed(extract_tool_call, replies)
+    print(f"legacy regex  {t_legacy:8.3f}s  ({len(replies) / t_legacy:,.0f} replies/s)")
+    print(f"scanner       {t_scan:8.3f}s  ({len(replies) / t_scan:,.0f} replies/s)   speedup {t_legacy / t_scan:.2f}x")
+
+    same = sum(a == b for a, b in zip(legacy, scanned))
+    only_legacy = [(r, a, b) for r, a, b in zip(replies, legacy, scanned) if a is not None and b is None]
+    only_scan = [(r, a, b) for r, a, b in zip(replies, legacy, scanned) if a is None and b is not None]
+    differ = [(r, a, b) for r, a, b in zip(replies, legacy, scanned) if a is not None and b is not None and a != b]
+    print(f"agree {same}  legacy-only {len(only_legacy)}  scanner-only {len(only_scan)}  different {len(differ)}")
+    for label, cases in (("legacy-only", only_legacy), ("scanner-only", only_scan), ("different", differ)):
+        for reply, a, b in cases[:args.show]:
+            print(f"--- {label}\n{reply[:400]!r}\n  legacy : {a}\n  scanner: {b}")
+
+    # 长推理输出中大量未闭合的调用片段：正则对每个起点都惰性扫描到文本末尾才失败，整体为平方级
+    stress = 'Thinking: {"server": "A", "tool": "b", "tool_params": {' * args.stress_size + "} done."
+    for name, func in (("legacy regex", legacy_extract), ("scanner", extract_tool_call)):
+        start = time.perf_counter()
+        result = func(stress)
+        print(f"stress {name:13s} {time.perf_counter() - start:8.3f}s  -> {result}")
+
+
+if __name__ == "__main__":
+    main()
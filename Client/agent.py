@@ -1,22 +1,43 @@
 # client/agent.py
 import json, os
+import asyncio
+import random
 from typing import Dict, List, Tuple, Any
 from contextlib import AsyncExitStack
 from Environment.environment import environment
-from openai import OpenAI
 from Client.client import MCPClient
+from Client.catalog import render_system_prompt
+from Client.llm_client import get_async_llm, throttle_llm
+from Client.stream_parser import EarlyStopDetector, extract_tool_call
 from Client.model_manager import get_model_manager
 from Client.config import ModelConfig
-from Utils.utils import formatted_mcp_servers, debug_print
-import time
+from Utils.utils import debug_print
+from Utils.retry import RetryPolicy
+import openai
 import re
 from pathlib import Path
 
 MAX_STEPS = 6        # 防御 prompt-loop；最多允许调用 6 次 tool
 MAX_CALL_RETRY = 3       # 最多尝试次数
 BASE_BACKOFF   = 1.0     # 初始退避秒数（每次翻倍）
+TOOL_CALL_TIMEOUT = 60   # 单次 tool 调用超时秒数
+MAX_LLM_RETRY = 3        # LLM 请求最多尝试次数
+LLM_DEADLINE = 1800      # 单次 LLM 请求（含重试）的总截止秒数
 Project_Root = Path(__file__).resolve().parent.parent
 
+
+def is_retryable_llm_error(exc: BaseException) -> bool:
+    """连接错误、超时、限流与 5xx 可重试；其余 4xx（参数错误、鉴权失败等）直接失败"""
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    return isinstance(exc, (openai.APIConnectionError, asyncio.TimeoutError))
+
+
+TOOL_CALL_RETRY = RetryPolicy("tool_call", max_attempts=MAX_CALL_RETRY, base_backoff=BASE_BACKOFF,
+                              attempt_timeout=TOOL_CALL_TIMEOUT)
+LLM_CALL_RETRY = RetryPolicy("llm_call", max_attempts=MAX_LLM_RETRY, base_backoff=2.0, max_backoff=60.0,
+                             deadline=LLM_DEADLINE, retry_if=is_retryable_llm_error)
+
 class MCPAgent:
     """
     封装多个 MCPClient，并负责与 LLM 对话。
@@ -25,7 +46,7 @@ class MCPAgent:
             reply = await agent.process_query("天气怎么样?")
     """
 
-    def __init__(self, server_paths=["Servers/Communication/EmailServer.py"], sys_prompt_path="sys_prompt_env.txt", model_manager=None):
+    def __init__(self, server_paths=["Servers/Communication/EmailServer.py"], sys_prompt_path="sys_prompt_env.txt", model_manager=None, server_pool=None, transport="stdio", seed=None):
         # 检查是否使用本地模型
         self.use_local_model = ModelConfig.is_local_model()
         
@@ -34,20 +55,24 @@ class MCPAgent:
             self.model_manager = model_manager or get_model_manager()
             self.llm = None
         else:
-            # 使用API模型
-            api_key, base_url, model = ModelConfig.get_api_config()
-            self.llm = OpenAI(
-                api_key=api_key,
-                base_url=base_url,
-            )
+            # 使用API模型：配置只读取一次，客户端在调用时从进程级连接池获取
+            self.api_key, self.base_url, self.model = ModelConfig.get_api_config()
+            # 非空时以流式方式请求，检测到完整工具调用 / 拒绝后立即断开
+            self.early_stop = ModelConfig.get_early_stop()
+            self.llm = None
             self.model_manager = None
             
         self.sys_prompt_path=sys_prompt_path
-        self.environment = environment()
+        # seed 非空时环境信息的抽样可复现（见 history_generator.query_seed）
+        self.environment = environment(rng=random.Random(seed) if seed is not None else None)
         self.exit_stack: AsyncExitStack | None = None
         self.mcp_clients: Dict[str, MCPClient] = {}
         self.history: List[dict] = []
         self.server_paths = server_paths
+        # 可选的 MCPServerPool：提供时复用常驻 server，否则每次新建子进程
+        self.server_pool = server_pool
+        # 未使用 server 池时 MCPClient 的 transport："stdio" 或 "inprocess"
+        self.transport = transport
 
     # ---------- async context manager ----------
     async def __aenter__(self) -> "MCPAgent":
@@ -56,18 +81,20 @@ class MCPAgent:
 
         # 启动所有 server
         server_desc = []
+        fingerprints = []
         for path in self.server_paths:
-            client = MCPClient(path)
-            client = await self.exit_stack.enter_async_context(client)  # type: ignore
+            if self.server_pool is not None:
+                client = await self.exit_stack.enter_async_context(self.server_pool.lease(path))
+            else:
+                client = MCPClient(path, transport=self.transport)
+                client = await self.exit_stack.enter_async_context(client)  # type: ignore
             self.mcp_clients[client.server_description["server_name"]] = client
             server_desc.append(client.server_description)
+            fingerprints.append(client.catalog_fingerprint)
 
-        # 构造 system prompt
-        with open(Project_Root / "Prompts" / self.sys_prompt_path) as f:
-            system_prompt = f.read()
-
-        system_prompt = system_prompt.format(
-            Available_Servers=formatted_mcp_servers(server_desc)
+        # 构造 system prompt（相同 prompt 文件 + server 组合直接命中 LRU 缓存）
+        system_prompt = render_system_prompt(
+            Project_Root / "Prompts" / self.sys_prompt_path, server_desc, fingerprints
         )
 
         debug_print(info=system_prompt, level=1)
@@ -80,7 +107,7 @@ class MCPAgent:
 
     async def safe_call_tool(self, client, tool: str, params: Dict[str, Any]) -> str:
         """
-        Wrapper around client.call_tool that retries on exception.
+        Wrapper around client.call_tool that retries on exception (TOOL_CALL_RETRY).
 
         Returns
         -------
@@ -92,82 +119,21 @@ class MCPAgent:
         Exception
             Re-raises the last exception after exhausting retries.
         """
-        for attempt in range(1, MAX_CALL_RETRY + 1):
-            try:
-                return await client.call_tool(tool, params)
-            except Exception as exc:                       # 捕获所有异常
-                if attempt == MAX_CALL_RETRY:              # 已到极限仍失败
-                    raise                                  # 把最后一次异常抛出
-                backoff = BASE_BACKOFF * (2 ** (attempt - 1))
-                debug_print(info=f"[warn] call_tool failed (attempt {attempt}/{MAX_CALL_RETRY}): {exc!r}. "+
-                    f"Retrying in {backoff:.1f}s …", level=4)
-                time.sleep(backoff)
+        return await TOOL_CALL_RETRY.run(client.call_tool, tool, params)
 
     def extract_toll_call_json(self, text: str) -> dict | None:
         """
-        Best-effort to parse *one* JSON object from an LLM reply.
+        Best-effort to parse *one* tool call from an LLM reply (single linear pass,
+        see Client.stream_parser.extract_tool_call).
 
         • Handles ```json ... ``` fenced blocks
         • Handles <tool_call> tags with MCP tool-call message
-        • Ignores extra prose before / after
-        • If server field is "ServerName", continues matching until finding valuable answer
+        • Ignores extra prose before / after, including braces inside JSON strings
+        • Supports nested dicts in tool_params
+        • If server field is "ServerName", continues scanning until finding valuable answer
         • Returns the parsed Python dict, or None on failure
         """
-        if not text or not isinstance(text, str):
-            return None
-        
-        # 忽略大小写和空格，支持各种格式变化，包括嵌套字典
-        dict_pattern = r'\{\s*["\']?server["\']?\s*:\s*["\']?([^"\',}]+)["\']?\s*,\s*["\']?tool["\']?\s*:\s*["\']?([^"\',}]+)["\']?\s*,\s*["\']?tool_params["\']?\s*:\s*(\{.*?\})\s*\}'
-        
-        # 使用findall找到所有匹配的JSON对象
-        all_matches = re.findall(dict_pattern, text, re.IGNORECASE | re.DOTALL)
-        
-        for match in all_matches:
-            try:
-                server = match[0].strip().strip('"\'')
-                tool = match[1].strip().strip('"\'')
-                tool_params_str = match[2].strip()
-                
-                # 如果server字段是"ServerName"，说明这是思考片段，继续匹配下一个
-                if server.lower() == "servername":
-                    continue
-                
-                # 尝试解析tool_params，支持嵌套字典
-                tool_params = {}
-                try:
-                    tool_params = json.loads(tool_params_str)
-                except json.JSONDecodeError:
-                    # 如果JSON解析失败，尝试手动解析
-                    # 首先尝试匹配简单的键值对（字符串值）
-                    simple_params = {}
-                    simple_pattern = r'["\']?([^"\',\s]+)["\']?\s*:\s*["\']?([^"\',}]+)["\']?'
-                    simple_matches = re.findall(simple_pattern, tool_params_str)
-                    for k, v in simple_matches:
-                        simple_params[k.strip().strip('"\'')] = v.strip().strip('"\'')
-                    
-                    # 然后尝试匹配嵌套字典
-                    nested_pattern = r'["\']?([^"\',\s]+)["\']?\s*:\s*(\{[^}]*\})'
-                    nested_matches = re.findall(nested_pattern, tool_params_str)
-                    for k, v in nested_matches:
-                        try:
-                            nested_dict = json.loads(v)
-                            simple_params[k.strip().strip('"\'')] = nested_dict
-                        except json.JSONDecodeError:
-                            # 如果嵌套字典解析失败，作为字符串处理
-                            simple_params[k.strip().strip('"\'')] = v.strip()
-                    
-                    tool_params = simple_params
-                
-                result = {
-                    "server": server,
-                    "tool": tool,
-                    "tool_params": tool_params
-                }
-                return result
-            except Exception:
-                continue
-                    
-        return None
+        return extract_tool_call(text)
 
     async def _get_llm_response(self, messages: List[Dict[str, str]]) -> str:
         """获取LLM回复，支持本地模型和API模型"""
@@ -175,13 +141,34 @@ class MCPAgent:
             # 使用本地模型
             return await self.model_manager.generate_response(messages)
         else:
-            # 使用API模型
-            api_key, base_url, model = ModelConfig.get_api_config()
-            resp = self.llm.chat.completions.create(
-                model=model, messages=messages
-            )
+            # 使用API模型：共享的异步客户端，等待期间不阻塞 event loop
+            llm = get_async_llm(self.api_key, self.base_url)
+            if self.early_stop:
+                return await LLM_CALL_RETRY.run(self._stream_llm_response, llm, messages)
+            resp = await LLM_CALL_RETRY.run(self._complete_llm_response, llm, messages)
             return resp.choices[0].message.content.strip()
 
+    async def _complete_llm_response(self, llm, messages: List[Dict[str, str]]):
+        await throttle_llm()
+        return await llm.chat.completions.create(model=self.model, messages=messages)
+
+    async def _stream_llm_response(self, llm, messages: List[Dict[str, str]]) -> str:
+        """流式读取 API 模型的回复，交给 EarlyStopDetector，命中后关闭连接并截断到该 JSON 末尾"""
+        detector = EarlyStopDetector(self.early_stop)
+        await throttle_llm()
+        stream = await llm.chat.completions.create(model=self.model, messages=messages, stream=True)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta and detector.feed(delta):
+                    break
+        finally:
+            await stream.close()
+        text = detector.text[:detector.end] if detector.done else detector.text
+        return text.strip()
+
     async def process_query(self, query: str) -> Tuple[List[Dict[str, str]], List[str]]:
         """
         Handle a user query that may require multiple MCP-tool invocations.
@@ -0,0 +1,132 @@
+# client/catalog.py
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from Utils.utils import formatted_mcp_servers
+
+Project_Root = Path(__file__).resolve().parent.parent
+CATALOG_FILE = Path(os.getenv("MCP_CATALOG_FILE") or Project_Root / ".cache" / "tool_catalog.json")
+PROMPT_CACHE_SIZE = 512   # 已渲染 system prompt 的 LRU 容量
+
+
+def _file_sha1(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def description_fingerprint(description: Dict[str, Any]) -> str:
+    """server 描述的内容指纹，用作渲染缓存的 key"""
+    payload = json.dumps(description, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ToolCatalog:
+    """
+    持久化的 server 工具目录缓存：server 脚本路径 -> list_tools 结果。
+    先用 (mtime, size) 快速判断是否新鲜，不一致时再比较内容 sha1，
+    脚本被修改后条目自动失效，下一次连接会重新 list_tools 并回写。
+    """
+
+    def __init__(self, path: Path = CATALOG_FILE):
+        self.path = Path(path)
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def get(self, server_script_path: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """返回 (server_description, fingerprint)；缺失或脚本已变更时返回 None"""
+        key = str(Path(server_script_path).resolve())
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return None
+            if entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                if entry["sha1"] != _file_sha1(key):
+                    return None
+                # 内容未变（如 git checkout 改了 mtime），刷新时间戳
+                entry["mtime_ns"], entry["size"] = st.st_mtime_ns, st.st_size
+                self._save()
+            return entry["description"], entry["fingerprint"]
+
+    def put(self, server_script_path: str, description: Dict[str, Any]) -> str:
+        """写入一个 server 的描述并返回其指纹"""
+        key = str(Path(server_script_path).resolve())
+        st = os.stat(key)
+        fingerprint = description_fingerprint(description)
+        with self._lock:
+            self._load()[key] = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "sha1": _file_sha1(key),
+                "fingerprint": fingerprint,
+                "description": description,
+            }
+            self._save()
+        return fingerprint
+
+
+_catalog: Optional[ToolCatalog] = None
+
+
+def get_tool_catalog() -> ToolCatalog:
+    """获取全局工具目录缓存实例"""
+    global _catalog
+    if _catalog is None:
+        _catalog = ToolCatalog()
+    return _catalog
+
+
+# ---------- rendered system prompts ----------
+_prompt_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_prompt_lock = threading.Lock()
+
+
+def render_system_prompt(prompt_file: Path, server_descriptions: Sequence[Dict[str, Any]],
+                         fingerprints: Sequence[str]) -> str:
+    """
+    渲染 system prompt（模板 + formatted_mcp_servers），按
+    (prompt 文件, 文件 mtime, server 指纹集合) 做 LRU 缓存。
+    """
+    prompt_file = Path(prompt_file)
+    key = (str(prompt_file), os.stat(prompt_file).st_mtime_ns, tuple(fingerprints))
+    with _prompt_lock:
+        prompt = _prompt_cache.get(key)
+        if prompt is not None:
+            _prompt_cache.move_to_end(key)
+            return prompt
+
+    with open(prompt_file) as f:
+        template = f.read()
+    prompt = template.format(Available_Servers=formatted_mcp_servers(list(server_descriptions)))
+
+    with _prompt_lock:
+        _prompt_cache[key] = prompt
+        while len(_prompt_cache) > PROMPT_CACHE_SIZE:
+            _prompt_cache.popitem(last=False)
+    return prompt
@@ -2,9 +2,57 @@
 from __future__ import annotations
 from typing import Optional, Dict, Any
 from contextlib import AsyncExitStack
+from pathlib import Path
+import importlib.util
+import threading
+import asyncio
+import time
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
+
+from Client.catalog import get_tool_catalog, description_fingerprint
+from Utils.metrics import LatencyHistogram
+from Utils.retry import run_with_timeout
+
+TRANSPORTS = ("stdio", "inprocess")
+READY_TIMEOUT = 30.0        # 秒；server 完成 initialize (+ list_tools) 握手的上限
+READY_POLL_INTERVAL = 0.05  # 秒；list_tools 尚未就绪时的轮询间隔
+
+# 每个 server 从启动到握手完成的耗时，用于定位导入缓慢的 server
+STARTUP_LATENCY = LatencyHistogram("MCP server startup latency")
+
+# 进程内 transport：按脚本绝对路径缓存已导入的 FastMCP 实例
+_inprocess_servers: Dict[str, Any] = {}
+_inprocess_lock = threading.Lock()
+
+
+def load_inprocess_server(server_script_path: str):
+    """导入 server 脚本并返回其中的 FastMCP 实例（同一脚本只导入一次）"""
+    from mcp.server.fastmcp import FastMCP
+
+    key = str(Path(server_script_path).resolve())
+    with _inprocess_lock:
+        server = _inprocess_servers.get(key)
+        if server is not None:
+            return server
+
+        module_name = "_mcp_inprocess_" + Path(key).stem
+        spec = importlib.util.spec_from_file_location(module_name, key)
+        if spec is None or spec.loader is None:
+            raise ImportError(f"Cannot import server script: {server_script_path}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)  # __name__ != "__main__"，不会执行 mcp.run()
+
+        server = getattr(module, "mcp", None)
+        if not isinstance(server, FastMCP):
+            server = next((v for v in vars(module).values() if isinstance(v, FastMCP)), None)
+        if server is None:
+            raise ValueError(f"No FastMCP instance found in {server_script_path}")
+
+        _inprocess_servers[key] = server
+        return server
 
 
 class MCPClient:
@@ -12,10 +60,21 @@ class MCPClient:
     单个 MCP server 的生命周期封装：
     async with MCPClient(path) as client:  # 自动连接/关闭
         await client.call_tool(...)
+
+    transport="stdio"     : 在子进程中启动 server，经 stdio JSON-RPC 通信（默认，保真）
+    transport="inprocess" : 直接导入 server 脚本中的 FastMCP 实例，经内存 stream 通信，
+                            省去进程启动与管道序列化，适用于纯 Python 的模拟 server
     """
 
-    def __init__(self, server_script_path: str):
+    def __init__(self, server_script_path: str, transport: str = "stdio", ready_timeout: float = READY_TIMEOUT,
+                 use_catalog: bool = True):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unsupported transport: {transport}")
         self.server_script_path = server_script_path
+        self.transport = transport
+        self.ready_timeout = ready_timeout
+        self.use_catalog = use_catalog
+        self.catalog_fingerprint: Optional[str] = None
         self.exit_stack: Optional[AsyncExitStack] = None
         self.session: Optional[ClientSession] = None
         self.server_description: Dict[str, Any] = {}
@@ -24,7 +83,12 @@ class MCPClient:
     async def __aenter__(self) -> "MCPClient":
         self.exit_stack = AsyncExitStack()
         await self.exit_stack.__aenter__()
-        await self._connect()
+        try:
+            await self._connect()
+        except BaseException as exc:
+            # 连接/握手失败时立即回收子进程与 stream
+            await self.exit_stack.__aexit__(type(exc), exc, exc.__traceback__)
+            raise
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -45,7 +109,56 @@ class MCPClient:
             raise ValueError("Server script must be .py or .js")
 
         server_name = self.server_script_path.split("/")[-1][:-3]
+        if self.transport == "inprocess" and not is_python:
+            raise ValueError("In-process transport only supports .py servers")
 
+        # 工具目录命中缓存时跳过 list_tools（initialize 的应答已说明 server 就绪）
+        catalog = get_tool_catalog() if self.use_catalog else None
+        cached = catalog.get(self.server_script_path) if catalog is not None else None
+
+        # 1) + 2) 建立连接并完成就绪握手；server 一就绪即返回，超时或进程退出立即失败
+        start = time.monotonic()
+        resp = await run_with_timeout(self._handshake, is_python, cached is None, timeout=self.ready_timeout)
+        STARTUP_LATENCY.observe(self.server_script_path, time.monotonic() - start)
+
+        if cached is not None:
+            self.server_description, self.catalog_fingerprint = cached
+            return
+
+        # 3) 保存 server 描述，供上层生成系统提示，并写入工具目录缓存
+        self.server_description = {
+            "server_name": server_name,
+            "tools": [
+                {
+                    "name": t.name,
+                    "description": t.description,
+                    "input_schema": t.inputSchema,
+                }
+                for t in resp.tools
+            ],
+        }
+        if catalog is not None:
+            self.catalog_fingerprint = catalog.put(self.server_script_path, self.server_description)
+        else:
+            self.catalog_fingerprint = description_fingerprint(self.server_description)
+
+    async def _handshake(self, is_python: bool, list_tools: bool = True):
+        """建立 session（含 initialize），再轮询 list_tools 直到 server 返回工具列表"""
+        if self.transport == "inprocess":
+            await self._connect_inprocess()
+        else:
+            await self._connect_stdio(is_python)
+        if not list_tools:
+            return None
+
+        while True:
+            try:
+                return await self.session.list_tools()
+            except McpError:
+                # server 已应答但尚未就绪；stream 关闭等其他异常说明进程已退出，直接失败
+                await asyncio.sleep(READY_POLL_INTERVAL)
+
+    async def _connect_stdio(self, is_python: bool):
         params = StdioServerParameters(
             command="python" if is_python else "node",
             args=[self.server_script_path],
@@ -63,16 +176,12 @@ class MCPClient:
         )
         await self.session.initialize()
 
-        # 3) 保存 server 描述，供上层生成系统提示
-        resp = await self.session.list_tools()
-        self.server_description = {
-            "server_name": server_name,
-            "tools": [
-                {
-                    "name": t.name,
-                    "description": t.description,
-                    "input_schema": t.inputSchema,
-                }
-                for t in resp.tools
-            ],
-        }
+    async def _connect_inprocess(self):
+        from mcp.shared.memory import create_connected_server_and_client_session
+
+        server = load_inprocess_server(self.server_script_path)
+
+        # 内存 stream 对接 server 的底层 Server 对象；返回的 session 已完成 initialize
+        self.session = await self.exit_stack.enter_async_context(
+            create_connected_server_and_client_session(getattr(server, "_mcp_server", server))
+        )
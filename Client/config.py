@@ -64,6 +64,58 @@ class ModelConfig:
             os.getenv("MODEL")
         )
     
+    @staticmethod
+    def get_max_batch_size() -> int:
+        """获取本地推理单批最大会话数"""
+        return int(os.getenv("MAX_BATCH_SIZE") or 8)
+    
+    @staticmethod
+    def get_max_batch_wait() -> float:
+        """获取凑批的最长等待时间（秒）"""
+        return float(os.getenv("MAX_BATCH_WAIT_MS") or 20) / 1000
+    
+    @staticmethod
+    def get_max_new_tokens() -> int:
+        """获取本地推理单次生成的最大 token 数"""
+        return int(os.getenv("MAX_NEW_TOKENS") or 4096)
+    
+    @staticmethod
+    def get_prefix_cache_max_tokens() -> int:
+        """获取每个设备上前缀 KV 缓存的 token 上限（0 表示关闭）"""
+        return int(os.getenv("PREFIX_CACHE_MAX_TOKENS") or 16384)
+
+    @staticmethod
+    def get_early_stop() -> frozenset:
+        """获取流式生成的提前结束条件（tool_call / refusal，逗号分隔；默认空，即关闭流式与提前结束）"""
+        value = os.getenv("EARLY_STOP", "").strip().lower()
+        if value in ("", "off", "none", "false"):
+            return frozenset()
+        kinds = frozenset(k.strip() for k in value.split(",") if k.strip())
+        unknown = kinds - {"tool_call", "refusal"}
+        if unknown:
+            raise ValueError(f"Unknown EARLY_STOP kinds: {sorted(unknown)}")
+        return kinds
+
+    @staticmethod
+    def get_llm_max_connections() -> int:
+        """获取共享 LLM 客户端的最大连接数"""
+        return int(os.getenv("LLM_MAX_CONNECTIONS") or 100)
+    
+    @staticmethod
+    def get_llm_max_rpm() -> float:
+        """获取本进程每分钟最多发出的 LLM 请求数（0 表示不限，由 pipeline 按 provider 预算分配）"""
+        return float(os.getenv("LLM_MAX_RPM") or 0)
+    
+    @staticmethod
+    def get_llm_timeout() -> float:
+        """获取单次 LLM 请求的超时秒数"""
+        return float(os.getenv("LLM_TIMEOUT") or 600)
+    
+    @staticmethod
+    def get_llm_connect_timeout() -> float:
+        """获取建立 LLM 连接的超时秒数"""
+        return float(os.getenv("LLM_CONNECT_TIMEOUT") or 10)
+    
     @staticmethod
     def validate_config():
         """验证配置"""
@@ -0,0 +1,80 @@
+# client/llm_client.py
+from __future__ import annotations
+import asyncio
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from Client.config import ModelConfig
+
+# 进程级共享的异步 LLM 客户端：按 (api_key, base_url) 复用同一个连接池
+_clients: Dict[Tuple[Optional[str], Optional[str]], Tuple[asyncio.AbstractEventLoop, AsyncOpenAI]] = {}
+_limiters: Dict[asyncio.AbstractEventLoop, "RateLimiter"] = {}
+
+
+class RateLimiter:
+    """每分钟至多 rpm 个请求，请求之间均匀间隔（不攒突发额度）"""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm
+        self._next = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def throttle_llm():
+    """LLM_MAX_RPM 设置时，等到本进程下一个请求配额；每次尝试（含重试）各占一个配额"""
+    rpm = ModelConfig.get_llm_max_rpm()
+    if rpm <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = RateLimiter(rpm)
+    await limiter.acquire()
+
+
+def get_async_llm(api_key: Optional[str], base_url: Optional[str]) -> AsyncOpenAI:
+    """
+    返回当前 event loop 上共享的 AsyncOpenAI 客户端。
+    底层 httpx.AsyncClient 开启 keep-alive，连接数上限与超时由 ModelConfig 控制；
+    httpx 连接绑定在 event loop 上，loop 变化（如多次 asyncio.run）时重建客户端。
+    """
+    loop = asyncio.get_running_loop()
+    key = (api_key, base_url)
+    entry = _clients.get(key)
+    if entry is not None and entry[0] is loop:
+        return entry[1]
+
+    max_connections = ModelConfig.get_llm_max_connections()
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=httpx.Timeout(
+            ModelConfig.get_llm_timeout(),
+            connect=ModelConfig.get_llm_connect_timeout(),
+        ),
+    )
+    # 重试统一由 Client.agent.LLM_CALL_RETRY 负责，关闭 SDK 内置重试以免叠加
+    client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    _clients[key] = (loop, client)
+    return client
+
+
+async def aclose_llm_clients():
+    """关闭当前 event loop 上创建的所有共享客户端"""
+    loop = asyncio.get_running_loop()
+    _limiters.pop(loop, None)
+    for key, (owner, client) in list(_clients.items()):
+        if owner is loop:
+            del _clients[key]
+            await client.close()
@@ -1,42 +1,83 @@
+import gc
 import os
+import asyncio
 import torch
 import threading
 from typing import List, Dict, Any, Optional
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoModelForCausalLM, DynamicCache, StoppingCriteria, StoppingCriteriaList
 import queue
 import time
 import json
 from Client.config import ModelConfig
+from Client.prefix_cache import PrefixCache, to_legacy, select_positions
+from Client.stream_parser import EarlyStopDetector
+from Client.tokenizer_service import TokenizerService, get_tokenizer_service
+from Utils.metrics import LatencyHistogram
 
-def selective_decode(tokenizer, ids,
-                     keep_special_tokens=["<|im_start|>", "<|im_end|>", "<|start_header_id|>", "<|end_header_id|>", "<|eot_id|>", "<start_of_turn>", "<end_of_turn>","<|begin_of_text|>"]):
-    # 想保留的特殊标记 -> id 集合
-    keep_ids = {tokenizer.convert_tokens_to_ids(t) for t in keep_special_tokens}
+LENGTH_BUCKET_RATIO = 1.25   # 同一批内最长 prompt 不超过最短的 1.25 倍 + 64 token，控制 padding 浪费
+LENGTH_BUCKET_SLACK = 64
 
-    bos_id = tokenizer.bos_token_id
-    eos_id = tokenizer.eos_token_id
-    all_special_ids = set(tokenizer.all_special_ids)
-
-    filtered = []
-    for i in ids:
-        # 对于BOS，只有在保留名单中才保留
-        if bos_id is not None and i == bos_id and i not in keep_ids:
-            continue
-        # 对于EOS，只有在保留名单中才保留
-        if eos_id is not None and i == eos_id and i not in keep_ids:
-            continue
-        # 若是其他特殊标记，则只有在"保留名单"里才保留
-        if i in all_special_ids and i not in keep_ids:
-            continue
-        filtered.append(i)
+class InferenceRequest:
+    """一次本地推理请求；结果通过 call_soon_threadsafe 写回调用方 event loop 上的 Future"""
+    
+    __slots__ = ("messages", "loop", "future", "enqueued_at", "started_at")
+    
+    def __init__(self, messages: List[Dict[str, str]], loop: asyncio.AbstractEventLoop):
+        self.messages = messages
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+    
+    def set_result(self, response: str):
+        self.loop.call_soon_threadsafe(self._resolve, response, None)
+    
+    def set_exception(self, exc: BaseException):
+        self.loop.call_soon_threadsafe(self._resolve, None, exc)
+    
+    def _resolve(self, response, exc):
+        if self.future.done():  # 调用方已取消
+            return
+        if exc is not None:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(response)
 
+class EarlyStopCriteria(StoppingCriteria):
+    """
+    逐步增量解码每一行新生成的 token 并交给 EarlyStopDetector；
+    某行出现完整的工具调用 / 拒绝 JSON 时只结束该行，其余行继续生成。
+    """
+    
+    def __init__(self, tokenizer_service: TokenizerService, prompt_len: int, batch_size: int, kinds):
+        self.tokenizer_service = tokenizer_service
+        self.prompt_len = prompt_len
+        self.detectors = [EarlyStopDetector(kinds) for _ in range(batch_size)]
+        self.ids: List[List[int]] = [[] for _ in range(batch_size)]
+        # 增量解码的 (prefix_offset, read_offset)：只重解码最近几个 token，避免多字节字符被截断
+        self.offsets = [[0, 0] for _ in range(batch_size)]
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        seen = self.prompt_len + len(self.ids[0])
+        new_tokens = input_ids[:, seen:].tolist()
+        done = []
+        for row, tokens in enumerate(new_tokens):
+            ids = self.ids[row]
+            ids.extend(tokens)
+            detector = self.detectors[row]
+            if not detector.done:
+                detector.feed(self._delta(row, ids))
+            done.append(detector.done)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
     
-    # 不再跳过特殊符号；也不要清理空格
-    return tokenizer.decode(
-        filtered,
-        skip_special_tokens=False,
-        clean_up_tokenization_spaces=False
-    )
+    def _delta(self, row: int, ids: List[int]) -> str:
+        prefix_offset, read_offset = self.offsets[row]
+        prefix_text = self.tokenizer_service.decode(ids[prefix_offset:read_offset])
+        new_text = self.tokenizer_service.decode(ids[prefix_offset:])
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+        self.offsets[row] = [read_offset, len(ids)]
+        return new_text[len(prefix_text):]
 
 class ModelManager:
     """
@@ -49,6 +90,7 @@ class ModelManager:
         
         self.model_path = ModelConfig.get_model_path()
         self.tokenizer_path = ModelConfig.get_tokenizer_path()
+        self.tokenizer_service: Optional[TokenizerService] = None
         
         # 如果没有指定GPU数量，使用torch获取
         if num_gpus is None:
@@ -64,14 +106,26 @@ class ModelManager:
         self.model_locks = []
         self.request_queues = []
         self.worker_threads = []
+        self.eos_token_ids = []
+        self.prefix_caches: List[PrefixCache] = []
+        self.max_batch_size = ModelConfig.get_max_batch_size()
+        self.max_batch_wait = ModelConfig.get_max_batch_wait()
+        self.max_new_tokens = ModelConfig.get_max_new_tokens()
+        self.early_stop = ModelConfig.get_early_stop()
+        self.early_stops: Dict[str, int] = {}
+        # 每个请求的排队等待时间与计算时间（按 "queue_wait" / "compute" 分别统计）
+        self.latency = LatencyHistogram("Local inference latency")
+        self.batch_sizes: Dict[int, int] = {}
+        self._metrics_lock = threading.Lock()
         
         # 初始化模型副本
         self._load_models()
         self._start_workers()
     
     def _load_models(self):
-        """在多个GPU上加载模型副本"""
-        print(f"Loading {self.num_gpus} model copies on {self.num_gpus} GPUs...")
+        """在多个GPU上加载模型副本（无 GPU 时在 CPU 上加载一份，便于用小模型测试）"""
+        use_cuda = torch.cuda.is_available()
+        print(f"Loading {self.num_gpus} model copies on {self.num_gpus} {'GPUs' if use_cuda else 'CPU device'}...")
         
         # 在模型加载前禁用所有可能的优化
         import torch._dynamo as dynamo
@@ -80,21 +134,19 @@ class ModelManager:
         # 禁用 torch.compile
         torch._dynamo.config.disable = True
         
+        # 所有设备共享一个 tokenizer（左侧 padding，模板渲染与 tokenize 结果按会话前缀缓存）
+        self.tokenizer_service = get_tokenizer_service(self.tokenizer_path)
+        tokenizer = self.tokenizer_service.tokenizer
+        
         for gpu_id in range(self.num_gpus):
-            print(f"Loading model on GPU {gpu_id}...")
-            
             # 设置设备
-            device = f"cuda:{gpu_id}"
-            
-            # 加载tokenizer
-            tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_path, trust_remote_code=True)
-            if tokenizer.pad_token is None:
-                tokenizer.pad_token = tokenizer.eos_token
+            device = f"cuda:{gpu_id}" if use_cuda else "cpu"
+            print(f"Loading model on {device}...")
             
             # 加载模型
             model = AutoModelForCausalLM.from_pretrained(
                 self.model_path,
-                torch_dtype=torch.float16,
+                torch_dtype=torch.float16 if use_cuda else torch.float32,
                 device_map=device,
                 trust_remote_code=True,
                 attn_implementation="eager",  # 避免 FX 符号追踪问题
@@ -103,8 +155,16 @@ class ModelManager:
                 _fast_init=False,  # 禁用快速初始化
             )
             
+            # 生成在任一 EOS 处停止；批量输出需按此截断各行的尾部 padding
+            eos_ids = model.generation_config.eos_token_id
+            eos_ids = set(eos_ids if isinstance(eos_ids, (list, tuple)) else [eos_ids])
+            eos_ids.add(tokenizer.eos_token_id)
+            eos_ids.discard(None)
+            
             self.models.append(model)
             self.tokenizers.append(tokenizer)
+            self.eos_token_ids.append(eos_ids)
+            self.prefix_caches.append(PrefixCache(ModelConfig.get_prefix_cache_max_tokens()))
             self.model_locks.append(threading.Lock())
             
             # 为每个模型创建请求队列和工作线程
@@ -118,7 +178,7 @@ class ModelManager:
             )
             self.worker_threads.append(worker_thread)
             
-            print(f"Model loaded on GPU {gpu_id}")
+            print(f"Model loaded on {device}")
     
     def _start_workers(self):
         """启动工作线程"""
@@ -127,61 +187,172 @@ class ModelManager:
             print(f"Worker thread {i} started")
     
     def _model_worker(self, gpu_id: int, request_queue: queue.Queue):
-        """模型工作线程，处理推理请求"""
-        while True:
-            try:
-                # 获取请求
-                request = request_queue.get()
-                if request is None:  # 停止信号
+        """模型工作线程：持续从队列凑批，按长度分组后批量推理"""
+        stop = False
+        while not stop:
+            # 阻塞等待第一条请求
+            request = request_queue.get()
+            if request is None:  # 停止信号
+                break
+            
+            # 在 max_batch_wait 内继续收集，直到凑满 max_batch_size
+            batch = [request]
+            deadline = time.monotonic() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = request_queue.get(timeout=remaining) if remaining > 0 else request_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
                     break
-                
-                messages, response_queue = request
-                
-                # 执行推理
-                response = self._inference_on_gpu(gpu_id, messages)
-                
-                # 返回结果
-                response_queue.put(response)
-                
+                batch.append(request)
+            
+            self._process_batch(gpu_id, batch)
+    
+    def _process_batch(self, gpu_id: int, batch: List[InferenceRequest]):
+        """
+        把一批请求按命中的缓存前缀分组、组内再按新增 token 长度分组推理，
+        并把结果交还各自的等待方。
+        """
+        cache = self.prefix_caches[gpu_id]
+        by_prefix: Dict[Any, list] = {}
+        for request in batch:
+            if request.future.cancelled():
+                continue
+            try:
+                ids = self.tokenizer_service.encode_messages(request.messages)
+                sys_len = 0
+                key, prefix_kv = None, None
+                if cache.enabled:
+                    sys_len = self._system_prefix_len(request.messages, ids)
+                    hit = cache.lookup(ids)
+                    if hit is not None:
+                        key, prefix_kv = hit
+                prefix_len = key[0] if key else 0
+                _, pending = by_prefix.setdefault(key, (prefix_kv, []))
+                pending.append((ids, len(ids) - prefix_len, request, sys_len))
             except Exception as e:
-                print(f"Error in model worker {gpu_id}: {e}")
-                if 'response_queue' in locals():
-                    response_queue.put({"error": str(e)})
+                request.set_exception(e)
+        
+        # 命中同一缓存前缀的请求共享一份前缀 kv；未命中的 (key=None) 从头 prefill
+        for key, (prefix_kv, pending) in by_prefix.items():
+            prefix_len = key[0] if key else 0
+            for group in group_by_length(pending, self.max_batch_size):
+                started = time.monotonic()
+                for _, _, request, _ in group:
+                    request.started_at = started
+                with self._metrics_lock:
+                    self.batch_sizes[len(group)] = self.batch_sizes.get(len(group), 0) + 1
+                try:
+                    responses = self._inference_batch(gpu_id, [ids for ids, _, _, _ in group],
+                                                      prefix_len, prefix_kv, [s for _, _, _, s in group])
+                except Exception as e:
+                    print(f"Error in model worker {gpu_id}: {e}")
+                    for _, _, request, _ in group:
+                        request.set_exception(e)
+                    continue
+                finished = time.monotonic()
+                for (_, _, request, _), response in zip(group, responses):
+                    self.latency.observe("queue_wait", request.started_at - request.enqueued_at)
+                    self.latency.observe("compute", finished - request.started_at)
+                    request.set_result(response)
     
-    def _inference_on_gpu(self, gpu_id: int, messages: List[Dict[str, str]]) -> str:
-        """在指定GPU上执行推理"""
+    def _system_prefix_len(self, messages: List[Dict[str, str]], ids: List[int]) -> int:
+        """system prompt 在 ids 中对应的 token 前缀长度；同一 server 的 query 共享这段前缀"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        sys_ids = self.tokenizer_service.encode_messages(messages[:1], add_generation_prompt=False)
+        n = 0
+        for a, b in zip(sys_ids, ids):
+            if a != b:
+                break
+            n += 1
+        return n
+    
+    def _inference_batch(self, gpu_id: int, rows: List[List[int]], prefix_len: int = 0,
+                         prefix_kv: Optional[tuple] = None, sys_lens: Optional[List[int]] = None) -> List[str]:
+        """
+        在指定设备上对一组已 tokenize 的 prompt 做批量生成。
+        各行前 prefix_len 个 token 相同且其 kv 已缓存（prefix_kv），只需 prefill 其后的部分；
+        padding 放在缓存前缀与各行剩余部分之间（prefix_len=0 时即普通的左侧 padding），
+        位置编码由 attention mask 推出，与单独推理时一致。
+        """
         with self.model_locks[gpu_id]:
             model = self.models[gpu_id]
             tokenizer = self.tokenizers[gpu_id]
+            eos_ids = self.eos_token_ids[gpu_id]
+            cache = self.prefix_caches[gpu_id]
             
-            # 使用tokenizer的apply_chat_template格式化输入
-            formatted_input = tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
+            width = max(len(ids) for ids in rows) - prefix_len
+            input_ids, attention_mask = [], []
+            for ids in rows:
+                pad = width - (len(ids) - prefix_len)
+                input_ids.append(ids[:prefix_len] + [tokenizer.pad_token_id] * pad + ids[prefix_len:])
+                attention_mask.append([1] * prefix_len + [0] * pad + [1] * (len(ids) - prefix_len))
+            
+            stopping = None
+            if self.early_stop:
+                stopping = EarlyStopCriteria(self.tokenizer_service, prefix_len + width, len(rows), self.early_stop)
             
-            # Tokenize
-            inputs = tokenizer(
-                formatted_input,
-                return_tensors="pt",
-                padding=True,
-                truncation=True,
-            ).to(model.device)
+            past = None
+            if prefix_kv is not None:
+                past = DynamicCache.from_legacy_cache(tuple(
+                    (k.expand(len(rows), -1, -1, -1), v.expand(len(rows), -1, -1, -1)) for k, v in prefix_kv
+                ))
             
             # 生成回复
             with torch.no_grad():
                 outputs = model.generate(
-                    **inputs,
-                    max_new_tokens=4096,
+                    input_ids=torch.tensor(input_ids, device=model.device),
+                    attention_mask=torch.tensor(attention_mask, device=model.device),
+                    past_key_values=past,
+                    max_new_tokens=self.max_new_tokens,
                     temperature=0.7,
                     do_sample=True,
-                    pad_token_id=tokenizer.eos_token_id
+                    pad_token_id=tokenizer.eos_token_id,
+                    return_dict_in_generate=True,
+                    stopping_criteria=StoppingCriteriaList([stopping]) if stopping else None,
                 )
             
-            # 解码回复
-            response = selective_decode(tokenizer, outputs[0][inputs['input_ids'].shape[1]:])            
-            return response.strip()
+            if stopping is not None:
+                with self._metrics_lock:
+                    for detector in stopping.detectors:
+                        if detector.reason:
+                            self.early_stops[detector.reason] = self.early_stops.get(detector.reason, 0) + 1
+            
+            # 解码回复：每行截断到第一个 EOS（含），去掉提前结束行尾部的 padding
+            prompt_len = prefix_len + width
+            responses = []
+            for row in outputs.sequences[:, prompt_len:].tolist():
+                end = next((i + 1 for i, t in enumerate(row) if t in eos_ids), len(row))
+                responses.append(self.tokenizer_service.decode(row[:end]).strip())
+            
+            if cache.enabled and outputs.past_key_values is not None:
+                self._store_prefixes(cache, rows, to_legacy(outputs.past_key_values),
+                                     prefix_len, width, sys_lens or [0] * len(rows))
+            return responses
+    
+    @staticmethod
+    def _store_prefixes(cache: PrefixCache, rows: List[List[int]], legacy: tuple,
+                        prefix_len: int, width: int, sys_lens: List[int]):
+        """
+        缓存每行完整 prompt 的 kv（下一轮对话只需 prefill 新增的部分），
+        以及 system prompt 边界处的 kv（同一 server 的其他 query 共享）。
+        """
+        for i, ids in enumerate(rows):
+            pad = width - (len(ids) - prefix_len)
+            positions = list(range(prefix_len)) + list(range(prefix_len + pad, prefix_len + width))
+            if len(ids) <= cache.max_tokens:
+                cache.insert(ids, select_positions(legacy, i, positions))
+            sys_len = sys_lens[i]
+            if sys_len and not cache.contains(ids[:sys_len]):
+                cache.insert(ids[:sys_len], select_positions(legacy, i, positions[:sys_len]))
+    
+    def _inference_on_gpu(self, gpu_id: int, messages: List[Dict[str, str]]) -> str:
+        """在指定GPU上对单个会话执行推理"""
+        return self._inference_batch(gpu_id, [self.tokenizer_service.encode_messages(messages)])[0]
     
     def get_least_loaded_gpu(self) -> int:
         """获取负载最轻的GPU"""
@@ -201,19 +372,21 @@ class ModelManager:
         # 选择负载最轻的GPU
         gpu_id = self.get_least_loaded_gpu()
         
-        # 创建响应队列
-        response_queue = queue.Queue()
-        
-        # 发送请求到对应的工作线程
-        self.request_queues[gpu_id].put((messages, response_queue))
+        # 发送请求到对应的工作线程；worker 完成后直接在本 loop 上 resolve Future
+        request = InferenceRequest(messages, asyncio.get_running_loop())
+        self.request_queues[gpu_id].put(request)
         
-        # 等待响应
-        response = response_queue.get()
-        
-        if isinstance(response, dict) and "error" in response:
-            raise Exception(response["error"])
-        
-        return response
+        return await request.future
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """返回排队/计算耗时统计、各批大小的出现次数以及各设备的前缀缓存命中情况"""
+        return {
+            "latency": self.latency.snapshot(),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "prefix_cache": [cache.stats() for cache in self.prefix_caches],
+            "tokenizer": self.tokenizer_service.stats() if self.tokenizer_service else {},
+            "early_stops": dict(self.early_stops),
+        }
     
     def shutdown(self):
         """关闭模型管理器"""
@@ -227,8 +400,31 @@ class ModelManager:
         for thread in self.worker_threads:
             thread.join()
         
+        report = self.latency.report()
+        if report:
+            print(report)
+            print(f"Batch sizes: {dict(sorted(self.batch_sizes.items()))}")
+            if self.early_stops:
+                print(f"Early stops: {self.early_stops}")
+            for gpu_id, cache in enumerate(self.prefix_caches):
+                if cache.enabled:
+                    print(f"Prefix cache [{gpu_id}]: {cache.stats()}")
         print("Model manager shutdown complete")
     
+def group_by_length(items: List[tuple], max_batch_size: int, ratio: float = LENGTH_BUCKET_RATIO,
+                    slack: int = LENGTH_BUCKET_SLACK) -> List[List[tuple]]:
+    """
+    items 为 (prompt, 待 prefill 的 token 长度, ...) 元组；按长度排序后切分，
+    每组不超过 max_batch_size，且组内最长不超过 最短 * ratio + slack。
+    """
+    groups: List[List[tuple]] = []
+    for item in sorted(items, key=lambda x: x[1]):
+        if groups and len(groups[-1]) < max_batch_size and item[1] <= groups[-1][0][1] * ratio + slack:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
 # 全局模型管理器实例
 _model_manager: Optional[ModelManager] = None
 
@@ -244,3 +440,15 @@ def get_model_manager() -> ModelManager:
             num_gpus = 1
         _model_manager = ModelManager(num_gpus=num_gpus)
     return _model_manager
+
+def shutdown_model_manager():
+    """关闭并丢弃全局模型管理器（释放显存），之后 get_model_manager 会按当前配置重新创建"""
+    global _model_manager
+    if _model_manager is None:
+        return
+    manager, _model_manager = _model_manager, None
+    manager.shutdown()
+    del manager
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
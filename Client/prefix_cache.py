@@ -0,0 +1,104 @@
+# client/prefix_cache.py
+from __future__ import annotations
+import hashlib
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MIN_REUSE_TOKENS = 16   # 命中前缀短于该长度时不值得走缓存路径
+
+
+def _digests(ids: Sequence[int], lengths: Sequence[int]) -> Dict[int, bytes]:
+    """一次线性扫描，计算 ids 在各个候选长度处的前缀摘要"""
+    h = hashlib.blake2b(digest_size=16)
+    out: Dict[int, bytes] = {}
+    prev = 0
+    for n in sorted(lengths):
+        if n > len(ids):
+            break
+        h.update(array("q", ids[prev:n]).tobytes())
+        prev = n
+        out[n] = h.digest()
+    return out
+
+
+class PrefixCache:
+    """
+    token 前缀 -> past key/values 的 LRU 缓存（单个设备、单个 worker 线程使用）。
+
+    kv 以 legacy 格式保存：每层一个 (key, value)，形状 [1, heads, n, head_dim]。
+    总 token 数超过 max_tokens 时淘汰最久未用的条目。
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self._entries: "OrderedDict[Tuple[int, bytes], Tuple]" = OrderedDict()
+        self._lengths: Dict[int, int] = {}   # 前缀长度 -> 条目数，用于限定查找候选
+        self.total_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tokens > 0
+
+    def lookup(self, ids: Sequence[int]) -> Optional[Tuple[Tuple[int, bytes], Tuple]]:
+        """返回严格短于 ids 的最长缓存前缀 (key, kv)，未命中返回 None"""
+        candidates = [n for n in self._lengths if MIN_REUSE_TOKENS <= n < len(ids)]
+        digests = _digests(ids, candidates)
+        for n in sorted(candidates, reverse=True):
+            key = (n, digests[n])
+            kv = self._entries.get(key)
+            if kv is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.reused_tokens += n
+                return key, kv
+        self.misses += 1
+        return None
+
+    def contains(self, ids: Sequence[int]) -> bool:
+        return (len(ids), _digests(ids, [len(ids)])[len(ids)]) in self._entries
+
+    def insert(self, ids: Sequence[int], kv: Tuple):
+        n = len(ids)
+        if n < MIN_REUSE_TOKENS or n > self.max_tokens:
+            return
+        key = (n, _digests(ids, [n])[n])
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = kv
+        self._lengths[n] = self._lengths.get(n, 0) + 1
+        self.total_tokens += n
+        while self.total_tokens > self.max_tokens:
+            (old_n, _), _ = self._entries.popitem(last=False)
+            self.total_tokens -= old_n
+            self._lengths[old_n] -= 1
+            if not self._lengths[old_n]:
+                del self._lengths[old_n]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries), "tokens": self.total_tokens,
+            "hits": self.hits, "misses": self.misses, "reused_tokens": self.reused_tokens,
+        }
+
+
+def to_legacy(past_key_values) -> Tuple:
+    """把 generate 返回的 Cache 对象统一成 legacy 的 ((k, v), ...) 元组"""
+    if isinstance(past_key_values, tuple):
+        return past_key_values
+    return past_key_values.to_legacy_cache()
+
+
+def select_positions(legacy: Tuple, row: int, positions: List[int]) -> Tuple:
+    """取 batch 中第 row 行、指定序列位置的 kv，返回 batch=1 的 legacy 元组（拷贝）"""
+    import torch
+
+    index = torch.tensor(positions, device=legacy[0][0].device)
+    return tuple(
+        (k[row:row + 1].index_select(2, index), v[row:row + 1].index_select(2, index))
+        for k, v in legacy
+    )
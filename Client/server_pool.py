@@ -0,0 +1,162 @@
+# client/server_pool.py
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Set
+
+from Client.client import MCPClient
+from Utils.utils import debug_print
+from Utils.retry import RetryPolicy
+
+MAX_IDLE_SECONDS = 300.0          # 空闲超过该时长的 server 会被关闭
+MAX_CONCURRENCY_PER_SERVER = 8    # 同一 server_path 同时被借出的 session 上限
+
+# 单次启动的超时由 MCPClient 的就绪握手 (READY_TIMEOUT) 负责
+STARTUP_RETRY = RetryPolicy("server_startup", max_attempts=3, base_backoff=0.5)
+
+
+class _PooledServer:
+    """
+    一个常驻的 MCP server（子进程 + 已初始化的 ClientSession）。
+
+    stdio_client / ClientSession 内部的 anyio cancel scope 必须在同一个 task 中
+    进入和退出，所以每个 server 由一个专属的 owner task 持有；借用方只通过
+    session 收发请求，不触碰其生命周期。
+    """
+
+    def __init__(self, server_path: str, transport: str = "stdio"):
+        self.server_path = server_path
+        self.transport = transport
+        self.client: Optional[MCPClient] = None
+        self.last_used = time.monotonic()
+        self._ready: Optional[asyncio.Future] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> "_PooledServer":
+        loop = asyncio.get_running_loop()
+        self._ready = loop.create_future()
+        self._closing = asyncio.Event()
+        self._task = loop.create_task(self._run())
+        try:
+            self.client = await self._ready
+        except BaseException:
+            await self.aclose()
+            raise
+        return self
+
+    async def _run(self):
+        try:
+            async with MCPClient(self.server_path, transport=self.transport) as client:
+                self._ready.set_result(client)
+                await self._closing.wait()
+        except Exception as exc:
+            if not self._ready.done():
+                self._ready.set_exception(exc)
+            else:
+                debug_print(info=f"   ⚠ Pooled server {self.server_path} exited: {exc!r}", level=5)
+
+    async def aclose(self):
+        if self._closing is not None:
+            self._closing.set()
+        if self._task is not None:
+            if not self._ready.done():
+                self._task.cancel()   # 仍在启动/握手中，直接取消
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class MCPServerPool:
+    """
+    按 server_path 复用常驻 MCP server 的连接池。
+    用法:
+        pool = MCPServerPool()
+        async with pool.lease(path) as client:   # client 为已连接的 MCPClient
+            await client.call_tool(...)
+        await pool.aclose()
+
+    - 每个 lease 独占一个 session，用完后放回空闲队列供下一次 query 复用；
+    - 同一 server_path 最多同时借出 max_concurrency_per_server 个 session；
+    - 空闲超过 max_idle 秒的 server 在下一次借还时被关闭。
+    session 会在不同 query / run 之间复用，server 的模块级状态不会被重置，
+    因此被池化的 server 不能在 tool 调用之间保存状态。
+    池绑定在创建它的 event loop 上，不能跨 loop 共享。
+    """
+
+    def __init__(self, max_idle: float = MAX_IDLE_SECONDS,
+                 max_concurrency_per_server: int = MAX_CONCURRENCY_PER_SERVER,
+                 transport: str = "stdio"):
+        self.transport = transport
+        self.max_idle = max_idle
+        self.max_concurrency_per_server = max_concurrency_per_server
+        self._idle: Dict[str, Deque[_PooledServer]] = {}
+        self._leased: Set[_PooledServer] = set()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.spawned = 0
+        self.reused = 0
+
+    # ---------- public helpers ----------
+    @asynccontextmanager
+    async def lease(self, server_path: str) -> AsyncIterator[MCPClient]:
+        semaphore = self._semaphores.get(server_path)
+        if semaphore is None:
+            semaphore = self._semaphores[server_path] = asyncio.Semaphore(self.max_concurrency_per_server)
+
+        async with semaphore:
+            server = await self._checkout(server_path)
+            try:
+                yield server.client
+            finally:
+                await self._checkin(server)
+
+    async def aclose(self):
+        """关闭池中所有 server（包括仍被借出的）"""
+        servers = list(self._leased)
+        for idle in self._idle.values():
+            servers.extend(idle)
+        self._idle.clear()
+        self._leased.clear()
+        await asyncio.gather(*(s.aclose() for s in servers), return_exceptions=True)
+
+    # ---------- internal ----------
+    async def _checkout(self, server_path: str) -> _PooledServer:
+        await self._evict_idle()
+        idle = self._idle.get(server_path)
+        while idle:
+            server = idle.pop()          # LIFO：优先用最近用过的 server
+            if server.alive:
+                self.reused += 1
+                self._leased.add(server)
+                return server
+            await server.aclose()
+
+        debug_print(info=f"   • Starting pooled MCP Server: {server_path}", level=5)
+        server = await STARTUP_RETRY.run(lambda: _PooledServer(server_path, self.transport).start())
+        self.spawned += 1
+        self._leased.add(server)
+        return server
+
+    async def _checkin(self, server: _PooledServer):
+        self._leased.discard(server)
+        if not server.alive:
+            await server.aclose()
+            return
+        server.last_used = time.monotonic()
+        self._idle.setdefault(server.server_path, deque()).append(server)
+        await self._evict_idle()
+
+    async def _evict_idle(self):
+        deadline = time.monotonic() - self.max_idle
+        expired = []
+        for idle in self._idle.values():
+            # 队列左侧为最久未用的 server
+            while idle and idle[0].last_used < deadline:
+                expired.append(idle.popleft())
+        if expired:
+            debug_print(info=f"   • Evicting {len(expired)} idle MCP Server(s)", level=5)
+            await asyncio.gather(*(s.aclose() for s in expired), return_exceptions=True)
@@ -0,0 +1,238 @@
+# client/stream_parser.py
+from __future__ import annotations
+import ast
+import json
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from Utils.refusal import REFUSAL_MARKER   # 与评估器共用：忽略大小写与空白
+
+EARLY_STOP_KINDS = ("tool_call", "refusal")
+
+# 对象内部 / 字符串内部各自只关心的字符，其余字符整段跳过
+_OBJECT_CHARS = re.compile(r'[{}"]')
+_STRING_CHARS = re.compile(r'["\\]')
+_MARKER_OVERLAP = 64   # 增量查找标记时回看的字符数，覆盖跨 chunk 的标记
+MAX_RESCANS = 8        # 未闭合的 '{'（如被截断的引号）吞掉后文时，跳过它重新扫描的次数上限
+_DECODER = json.JSONDecoder()
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+# 畸形候选对象的逐字段容错（只作用于单个候选对象，不再对整段回复做正则匹配）
+_SALVAGE_FIELDS = {key: re.compile(rf"[\"']?{key}[\"']?\s*:\s*[\"']?([^\"',}}]+)", re.IGNORECASE)
+                   for key in ("server", "tool")}
+_SALVAGE_PARAMS = re.compile(r"[\"']?tool_params[\"']?\s*:\s*\{", re.IGNORECASE)
+_SALVAGE_PAIR = re.compile(r"[\"']?([^\"',\s]+)[\"']?\s*:\s*[\"']?([^\"',}]+)[\"']?")
+
+
+class JSONSpanScanner:
+    """
+    单遍、可增量喂入的花括号扫描器：识别双引号字符串（含转义），
+    每当一个 {...} 闭合时给出它在整段文本中的 (start, end) 区间。
+    内层对象先于外层对象给出；未配对的 '}' 被忽略。总耗时与文本长度成线性。
+    """
+
+    def __init__(self):
+        self.pos = 0                 # 已扫描的字符数（绝对偏移）
+        self._stack: List[int] = []  # 未闭合 '{' 的绝对位置
+        self._in_string = False
+        self._escape = False         # 下一个字符被字符串内的 '\' 转义（可能跨 chunk）
+
+    def feed(self, chunk: str) -> List[Tuple[int, int]]:
+        base = self.pos
+        self.pos += len(chunk)
+        spans: List[Tuple[int, int]] = []
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._escape:
+                # 被 '\' 转义的字符（可能位于下一个 chunk 开头）
+                self._escape = False
+                i += 1
+            elif self._in_string:
+                m = _STRING_CHARS.search(chunk, i)
+                if m is None:
+                    break
+                i = m.end()
+                if m.group() == '"':
+                    self._in_string = False
+                else:
+                    self._escape = True
+            elif not self._stack:
+                # 对象外只找下一个 '{'；正文里的引号与 '}' 不影响状态
+                j = chunk.find("{", i)
+                if j < 0:
+                    break
+                self._stack.append(base + j)
+                i = j + 1
+            else:
+                m = _OBJECT_CHARS.search(chunk, i)
+                if m is None:
+                    break
+                i = m.end()
+                ch = m.group()
+                if ch == "{":
+                    self._stack.append(base + m.start())
+                elif ch == "}":
+                    spans.append((self._stack.pop(), base + i))
+                else:
+                    self._in_string = True
+        return spans
+
+    @property
+    def unclosed(self) -> List[int]:
+        """尚未闭合的 '{' 的绝对位置（由外到内）"""
+        return list(self._stack)
+
+
+def iter_json_objects(text: str) -> Iterable[str]:
+    """按闭合顺序给出 text 中所有花括号配对的子串（候选 JSON 对象）"""
+    for start, end in JSONSpanScanner().feed(text):
+        yield text[start:end]
+
+
+def loads_lenient(candidate: str) -> Any:
+    """json.loads，失败时依次容忍尾随逗号与 Python 风格的单引号 dict；仍失败抛出 ValueError"""
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    repaired = _TRAILING_COMMA.sub(r"\1", candidate)
+    if repaired != candidate:
+        try:
+            return json.loads(repaired)
+        except json.JSONDecodeError:
+            pass
+    try:
+        return ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        raise ValueError("not a JSON object") from None
+
+
+def parse_tool_call(candidate: str, salvage: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    候选子串是合法的 {server, tool, tool_params} 调用时返回规范化的 dict（键名不区分大小写），
+    否则返回 None；server 为 "ServerName" 占位符（模板/思考片段）时同样返回 None。
+    salvage=True 时，对整体无法解析的候选对象逐字段容错提取。
+    """
+    lowered = candidate.lower()
+    if "tool_params" not in lowered or "server" not in lowered:
+        return None
+    try:
+        obj = loads_lenient(candidate)
+    except ValueError:
+        if not salvage:
+            return None
+        obj = _salvage_tool_call(candidate)
+    return _normalize_tool_call(obj)
+
+
+def _normalize_tool_call(obj: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(obj, dict):
+        return None
+    obj = {str(k).strip().lower(): v for k, v in obj.items()}
+    server, tool, params = obj.get("server"), obj.get("tool"), obj.get("tool_params")
+    if not isinstance(server, str) or not isinstance(tool, str) or not isinstance(params, dict):
+        return None
+    if server.strip().lower() == "servername":
+        return None
+    return {"server": server.strip(), "tool": tool.strip(), "tool_params": params}
+
+
+def _salvage_tool_call(candidate: str) -> Optional[Dict[str, Any]]:
+    """
+    候选对象整体不是合法 JSON（如 tool_params 里写了 "x" * 280 或 // 注释）时，
+    逐字段取出 server / tool，tool_params 先按 JSON 解析，失败再取其中的简单键值对。
+    """
+    fields = {key: pattern.search(candidate) for key, pattern in _SALVAGE_FIELDS.items()}
+    params_key = _SALVAGE_PARAMS.search(candidate)
+    if not (fields["server"] and fields["tool"] and params_key):
+        return None
+    params_start = params_key.end() - 1
+    params_end = next((end for start, end in JSONSpanScanner().feed(candidate[params_start:]) if start == 0),
+                      len(candidate) - params_start - 1)
+    params_text = candidate[params_start:params_start + params_end]
+    try:
+        params = loads_lenient(params_text)
+    except ValueError:
+        params = {k.strip().strip("\"'"): v.strip().strip("\"'") for k, v in _SALVAGE_PAIR.findall(params_text[1:])}
+    return {
+        "server": fields["server"].group(1).strip().strip("\"'"),
+        "tool": fields["tool"].group(1).strip().strip("\"'"),
+        "tool_params": params,
+    }
+
+
+def extract_tool_call(text: str) -> Optional[Dict[str, Any]]:
+    """
+    单遍扫描 text，返回第一个完整的工具调用（支持嵌套的 tool_params、```json 代码块、
+    <tool_call> 标签与前后的说明文字）；没有合法调用时退而取第一个可逐字段容错的候选，
+    都没有时返回 None。
+    """
+    if not text or not isinstance(text, str) or "tool_params" not in text.lower():
+        return None
+
+    # 快速路径：回复以一个合法的调用对象开头（最常见的情况），直接用 C 实现的解码器
+    first = text.find("{")
+    try:
+        call = _normalize_tool_call(_DECODER.raw_decode(text, first)[0])
+    except ValueError:
+        call = None
+    if call is not None:
+        return call
+
+    salvaged = None
+    offset = 0
+    for _ in range(MAX_RESCANS):
+        scanner = JSONSpanScanner()
+        for start, end in scanner.feed(text[offset:] if offset else text):
+            candidate = text[offset + start:offset + end]
+            call = parse_tool_call(candidate)
+            if call is not None:
+                return call
+            if salvaged is None:
+                salvaged = parse_tool_call(candidate, salvage=True)
+        if not scanner.unclosed:
+            break
+        # 最外层的 '{' 没有闭合（如引号未配对），它之后的调用会被吞掉：跳过它重新扫描
+        offset += scanner.unclosed[0] + 1
+    return salvaged
+
+
+class EarlyStopDetector:
+    """
+    流式生成的提前结束判定：逐段 feed 模型输出，一旦出现
+      - 完整的工具调用 JSON（kinds 含 "tool_call"），或
+      - "Unsafe MCP Server:" 之后的完整 JSON（kinds 含 "refusal"）
+    即返回 True。与 MCPAgent 的解析和评测脚本一样取第一个匹配，所以截断不改变解析结果，
+    只丢掉其后的多余文本。end 为该 JSON 结束处的偏移，reason 为命中的类型。
+    """
+
+    def __init__(self, kinds: Iterable[str] = EARLY_STOP_KINDS):
+        self.kinds: FrozenSet[str] = frozenset(kinds)
+        self.text = ""
+        self.done = False
+        self.reason: Optional[str] = None
+        self.end: Optional[int] = None
+        self._scanner = JSONSpanScanner()
+        self._marker_end: Optional[int] = None
+
+    def feed(self, chunk: str) -> bool:
+        if self.done or not chunk:
+            return self.done
+        start = len(self.text)
+        self.text += chunk
+
+        if "refusal" in self.kinds and self._marker_end is None:
+            offset = max(0, start - _MARKER_OVERLAP)
+            m = REFUSAL_MARKER.search(self.text, offset)
+            if m:
+                self._marker_end = m.end()
+
+        for span_start, span_end in self._scanner.feed(chunk):
+            if "tool_call" in self.kinds and parse_tool_call(self.text[span_start:span_end]) is not None:
+                return self._stop("tool_call", span_end)
+            if self._marker_end is not None and span_start >= self._marker_end:
+                return self._stop("refusal", span_end)
+        return False
+
+    def _stop(self, reason: str, end: int) -> bool:
+        self.done, self.reason, self.end = True, reason, end
+        return True
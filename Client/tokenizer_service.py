@@ -0,0 +1,203 @@
+# client/tokenizer_service.py
+from __future__ import annotations
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from transformers import AutoTokenizer
+
+TEMPLATE_CACHE_SIZE = 4096   # 缓存的会话前缀（渲染文本 + token ids）条数上限
+VERIFY_INCREMENTAL = 8       # 前几次增量 tokenize 与整段结果比对，不一致则退回整段 tokenize
+MAX_LENGTH_UNSET = int(1e29)  # transformers 对未设置 model_max_length 的 tokenizer 使用 int(1e30)
+
+# 解码时保留的特殊标记（各家 chat 模板的轮次分隔符）
+KEEP_SPECIAL_TOKENS = ("<|im_start|>", "<|im_end|>", "<|start_header_id|>", "<|end_header_id|>", "<|eot_id|>",
+                       "<start_of_turn>", "<end_of_turn>", "<|begin_of_text|>")
+
+
+def message_keys(messages: Sequence[Dict[str, str]]) -> List[bytes]:
+    """每个消息前缀 messages[:i+1] 的链式摘要，前缀相同的会话得到相同的 key"""
+    keys = []
+    h = hashlib.blake2b(digest_size=16)
+    for m in messages:
+        h.update(m["role"].encode("utf-8") + b"\0" + m["content"].encode("utf-8") + b"\0")
+        keys.append(h.digest())
+    return keys
+
+
+@lru_cache(maxsize=16)
+def special_drop_ids(tokenizer, keep_special_tokens: Tuple[str, ...] = KEEP_SPECIAL_TOKENS) -> frozenset:
+    """解码时要去掉的 token id：BOS/EOS 及不在保留名单中的特殊标记"""
+    keep_ids = {tokenizer.convert_tokens_to_ids(t) for t in keep_special_tokens}
+    drop = set(tokenizer.all_special_ids) | {tokenizer.bos_token_id, tokenizer.eos_token_id}
+    drop.discard(None)
+    return frozenset(drop - keep_ids)
+
+
+class TokenizerService:
+    """
+    所有设备共享的一个 tokenizer，负责 chat 模板渲染、tokenize 与解码。
+
+    - 按消息前缀缓存渲染结果和 token ids；新一轮对话只 tokenize 追加的部分
+      （仅在切分点恰好落在特殊标记之前时拼接，否则整段重新 tokenize，结果与整段 tokenize 一致）；
+    - 解码时需要过滤的特殊 token 集合只计算一次；
+    - encode_messages 的结果与原先 tokenizer(..., truncation=True) 一样截断到 model_max_length
+      （缓存中保存的是未截断的前缀，截断只作用于返回值）；
+    - HF fast tokenizer 不保证线程安全，所有调用经同一把锁串行。
+    """
+
+    def __init__(self, tokenizer_path: str, cache_size: int = TEMPLATE_CACHE_SIZE):
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, trust_remote_code=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        self.cache_size = cache_size
+        # 未配置上限的 tokenizer 的 model_max_length 是一个极大的占位值，此时不截断
+        max_length = self.tokenizer.model_max_length
+        self.max_length = max_length if isinstance(max_length, int) and max_length < MAX_LENGTH_UNSET else None
+        self._lock = threading.Lock()
+        # key(messages[:k]) -> (不带 generation prompt 的渲染文本, 对应 token ids)
+        self._prefixes: "OrderedDict[bytes, Tuple[str, List[int]]]" = OrderedDict()
+        # added token 会在 BPE 之前被整体切出，在它们之前切分文本是安全的
+        self._special_tokens = tuple(t for t in {*self.tokenizer.get_added_vocab(), *self.tokenizer.all_special_tokens} if t)
+        self.drop_ids = special_drop_ids(self.tokenizer)
+        # tokenizer 只在开头添加特殊 token（如 BOS）时，分段 tokenize 才能直接拼接
+        self._incremental = self._check_incremental()
+        self._verify_left = VERIFY_INCREMENTAL
+        self.full_tokens = 0     # 从头 tokenize 的 token 数
+        self.tail_tokens = 0     # 增量 tokenize 的 token 数
+        self.reused_tokens = 0   # 命中缓存前缀而省掉的 token 数
+
+    def _check_incremental(self) -> bool:
+        tok = self.tokenizer
+        head = tok("", add_special_tokens=True).input_ids
+        sample = "Hello world"
+        return tok(sample).input_ids == head + tok(sample, add_special_tokens=False).input_ids
+
+    # ---------- public helpers ----------
+    def render(self, messages: Sequence[Dict[str, str]], add_generation_prompt: bool = True) -> str:
+        return self.tokenizer.apply_chat_template(list(messages), tokenize=False,
+                                                  add_generation_prompt=add_generation_prompt)
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        with self._lock:
+            return self.tokenizer(text, add_special_tokens=add_special_tokens).input_ids
+
+    def truncate(self, ids: List[int]) -> List[int]:
+        """与 tokenizer(..., truncation=True) 相同：超过 model_max_length 时按 truncation_side 截断"""
+        if self.max_length is None or len(ids) <= self.max_length:
+            return ids
+        if self.tokenizer.truncation_side == "left":
+            return ids[-self.max_length:]
+        return ids[:self.max_length]
+
+    def encode_messages(self, messages: Sequence[Dict[str, str]], add_generation_prompt: bool = True) -> List[int]:
+        """
+        套用 chat 模板并 tokenize，等价于 tokenizer(render(messages), truncation=True).input_ids。
+        复用最长的已缓存消息前缀，只 tokenize 之后新增的文本，并把本次会话（不含
+        generation prompt）写回缓存，供下一轮使用。
+        """
+        return self.truncate(self._encode_messages(messages, add_generation_prompt))
+
+    def _encode_messages(self, messages: Sequence[Dict[str, str]], add_generation_prompt: bool) -> List[int]:
+        if not messages:
+            return self.encode(self.render(messages, add_generation_prompt))
+        keys = message_keys(messages)
+        with self._lock:
+            cached = self._prefixes.get(keys[-1])
+            if cached is not None:
+                self._prefixes.move_to_end(keys[-1])
+        if cached is not None and not add_generation_prompt:
+            self.reused_tokens += len(cached[1])
+            return list(cached[1])
+
+        text = self.render(messages, add_generation_prompt)
+        base = cached if cached is not None else self._longest_prefix(keys[:-1], text)
+        if base is None and len(messages) > 1 and messages[0]["role"] == "system":
+            # 同一 server 的 query 共享 system prompt：先单独缓存它，本次只 tokenize 其后的部分
+            self._encode_messages(messages[:1], add_generation_prompt=False)
+            base = self._longest_prefix(keys[:1], text)
+        base_text, base_ids = base or (None, None)
+        ids = self._extend(base_text, base_ids, text)
+
+        if cached is None:
+            # 缓存不带 generation prompt 的版本：下一轮的渲染结果以它为前缀
+            plain = text if not add_generation_prompt else self.render(messages, False)
+            plain_ids = ids if plain == text else self._split_ids(ids, text, plain)
+            if plain_ids is not None:
+                self._store(keys[-1], plain, plain_ids)
+        return ids
+
+    def decode(self, ids: Sequence[int]) -> str:
+        """解码生成结果：去掉 BOS/EOS 等特殊 token，保留轮次分隔符，不清理空格"""
+        drop = self.drop_ids
+        with self._lock:
+            return self.tokenizer.decode([i for i in ids if i not in drop], skip_special_tokens=False,
+                                         clean_up_tokenization_spaces=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"prefixes": len(self._prefixes), "full_tokens": self.full_tokens,
+                "tail_tokens": self.tail_tokens, "reused_tokens": self.reused_tokens}
+
+    # ---------- internal ----------
+    def _longest_prefix(self, keys: Sequence[bytes], text: str) -> Optional[Tuple[str, List[int]]]:
+        with self._lock:
+            for key in reversed(keys):
+                entry = self._prefixes.get(key)
+                if entry is not None and text.startswith(entry[0]):
+                    self._prefixes.move_to_end(key)
+                    return entry
+        return None
+
+    def _at_boundary(self, tail: str) -> bool:
+        """tail 以特殊标记开头时，在此处切分不会改变 BPE 的合并结果"""
+        return not tail or tail.startswith(self._special_tokens)
+
+    def _extend(self, base_text: Optional[str], base_ids: Optional[List[int]], text: str) -> List[int]:
+        if (base_text is not None and self._incremental and text.startswith(base_text)
+                and self._at_boundary(text[len(base_text):])):
+            tail_ids = self.encode(text[len(base_text):], add_special_tokens=False)
+            ids = base_ids + tail_ids
+            if self._verify_left > 0:
+                self._verify_left -= 1
+                if ids != self.encode(text):
+                    # 如 added token 带 lstrip/rstrip，会吞掉切分点两侧的空白
+                    self._incremental = False
+                    with self._lock:
+                        self._prefixes.clear()
+                    return self._extend(None, None, text)
+            self.tail_tokens += len(tail_ids)
+            self.reused_tokens += len(base_ids)
+            return ids
+        ids = self.encode(text)
+        self.full_tokens += len(ids)
+        return ids
+
+    def _split_ids(self, ids: List[int], text: str, plain: str) -> Optional[List[int]]:
+        """由完整 ids 推出其文本前缀 plain 的 ids（generation prompt 以特殊标记开头时成立）"""
+        if not (self._incremental and text.startswith(plain) and self._at_boundary(text[len(plain):])):
+            return None
+        n = len(self.encode(text[len(plain):], add_special_tokens=False))
+        return ids[:len(ids) - n] if n else ids
+
+    def _store(self, key: bytes, text: str, ids: List[int]):
+        with self._lock:
+            self._prefixes[key] = (text, ids)
+            self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.cache_size:
+                self._prefixes.popitem(last=False)
+
+
+_services: Dict[str, TokenizerService] = {}
+_services_lock = threading.Lock()
+
+
+def get_tokenizer_service(tokenizer_path: str) -> TokenizerService:
+    """按路径获取共享的 TokenizerService（同一路径只加载一次）"""
+    with _services_lock:
+        service = _services.get(tokenizer_path)
+        if service is None:
+            service = _services[tokenizer_path] = TokenizerService(tokenizer_path)
+        return service
@@ -12,6 +12,8 @@ import statistics
 # 添加 Utils 路径
 sys.path.append('Utils')
 from Utils.utils import is_valid_security
+from Utils.blob_store import BlobStore, rehydrate_record
+from Utils.refusal import is_refusal_attempt, parse_refusal
 
 def load_env_info():
     """加载环境信息，合并训练集和测试集数据"""
@@ -167,43 +169,35 @@ def check_chosen_rejected(sample, security_type):
     
     if last_security_type == "Safe":
         # 如果最后一个 Security_type 为 "Safe"，那么 chosen 应该是正常回复
-        if chosen.startswith("Unsafe MCP Server:"):
+        if is_refusal_attempt(chosen):
             errors.append("最后一个 security_type 为 'Safe' 时，chosen 不应该是拒绝回复")
         
         # rejected 可以是拒绝回复（即报错 Unsafe MCP Server:）
-        if not rejected.startswith("Unsafe MCP Server:"):
+        if not is_refusal_attempt(rejected):
             errors.append("最后一个 security_type 为 'Safe' 时，rejected 应该是拒绝回复")
     
     else:
         # 如果是其他的 risk，那么 chosen 应该是拒绝回复且报错这个 risk
-        if not chosen.startswith("Unsafe MCP Server:"):
+        if not is_refusal_attempt(chosen):
             errors.append(f"最后一个 security_type 为 '{last_security_type}' 时，chosen 应该是拒绝回复")
         else:
             # 检查 chosen 中的 Reason 是否与最后一个 security_type 匹配
-            try:
-                # 解析 Unsafe MCP Server: 后面的 JSON
-                json_start = chosen.find("Unsafe MCP Server:") + len("Unsafe MCP Server:")
-                chosen_json = json.loads(chosen[json_start:])
-                chosen_reason = chosen_json.get('Reason', '')
-                
-                if chosen_reason != last_security_type:
-                    errors.append(f"chosen 中的 Reason '{chosen_reason}' 与最后一个 security_type '{last_security_type}' 不匹配")
-            except:
+            # 解析 Unsafe MCP Server: 后面的 JSON
+            refusal = parse_refusal(chosen)
+            if refusal is None:
                 errors.append("chosen 中的 JSON 格式不正确")
+            elif refusal.reason != last_security_type:
+                errors.append(f"chosen 中的 Reason '{refusal.reason}' 与最后一个 security_type '{last_security_type}' 不匹配")
         
         # rejected 可以是正常回复或者拒绝回复但是报错其他类别
-        if rejected.startswith("Unsafe MCP Server:"):
-            try:
-                # 解析 rejected 中的 JSON
-                json_start = rejected.find("Unsafe MCP Server:") + len("Unsafe MCP Server:")
-                rejected_json = json.loads(rejected[json_start:])
-                rejected_reason = rejected_json.get('Reason', '')
-                
-                # 检查 rejected 的 Reason 是否与最后一个 security_type 不同
-                if rejected_reason == last_security_type:
-                    errors.append(f"rejected 中的 Reason '{rejected_reason}' 不应该与最后一个 security_type '{last_security_type}' 相同")
-            except:
+        if is_refusal_attempt(rejected):
+            # 解析 rejected 中的 JSON
+            refusal = parse_refusal(rejected)
+            if refusal is None:
                 errors.append("rejected 中的 JSON 格式不正确")
+            # 检查 rejected 的 Reason 是否与最后一个 security_type 不同
+            elif refusal.reason == last_security_type:
+                errors.append(f"rejected 中的 Reason '{refusal.reason}' 不应该与最后一个 security_type '{last_security_type}' 相同")
     
     return errors
 
@@ -267,12 +261,13 @@ def collect_statistics(file_path):
     risk_observations = {}
     risk_observation_counts = {}  # 新增：统计每个 observation 的出现次数
     
+    blobs = BlobStore.for_records(file_path)
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             for line_num, line in enumerate(f, 1):
                 if line.strip():
                     try:
-                        sample = json.loads(line)
+                        sample = rehydrate_record(json.loads(line), blobs)
                         security_type = sample.get('security_type', [])
                         
                         # 统计每个 risk 类别的出现次数
@@ -420,12 +415,13 @@ def check_file(file_path, env_info):
     errors_count = 0
     total_samples = 0
     
+    blobs = BlobStore.for_records(file_path)
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             for line_num, line in enumerate(f, 1):
                 if line.strip():
                     try:
-                        sample = json.loads(line)
+                        sample = rehydrate_record(json.loads(line), blobs)
                         total_samples += 1
                         
                         errors = check_single_sample(sample, total_samples, env_info)
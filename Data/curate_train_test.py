@@ -9,6 +9,8 @@ import json, random, re, sys, argparse
 from openai import OpenAI
 from dotenv import load_dotenv
 from Utils.utils import is_valid_response, is_valid_security
+from Utils.blob_store import BlobStore, rehydrate_record
+from Utils.refusal import parse_refusal
 import os
 
 # python curate_train_test.py histories_env.jsonl env_data.jsonl --type env --test_ratio 0.1
@@ -99,13 +101,14 @@ f'Unsafe MCP Server:{{"ServerName":"{server}", "ToolName":"{tool}", "Reason":"{r
     )
 
 def read_jsonl(file_path):
-    """读取JSONL文件"""
+    """读取JSONL文件（blob 引用还原为原文）"""
     data = []
+    blobs = BlobStore.for_records(file_path)
     with open(file_path, 'r', encoding='utf-8') as f:
         for line in f:
             line = line.strip()
             if line:
-                data.append(json.loads(line))
+                data.append(rehydrate_record(json.loads(line), blobs))
     return data
 
 def write_jsonl(data, file_path):
@@ -141,7 +144,7 @@ def process_env_data(raw_data, test_ratio=0.1):
 
         # ---- 生成 chosen / rejected ----
         if risk.lower() == "safe":  # safe-only, chosen = 正常回答, rejected是拒绝回答(即报错)
-            if original_final.startswith("Unsafe MCP Servers"):
+            if parse_refusal(original_final) is not None:
                 copied_hist = hist[:]
                 copied_hist[0]['content']=NORMAL_SYSTEM_PROMPT
                 copied_hist=copied_hist[:-1]
@@ -159,7 +162,7 @@ def process_env_data(raw_data, test_ratio=0.1):
         else:            
             chosen = refusal_json(item["server_path"].split("/")[-1].split(".")[0], tool_name, risk)       # chosen = 拒绝回答，并报错相同, rejected可以是正常回答也可以是报错不同的拒绝回答
             # 若原回复不是拒绝
-            if not original_final.startswith("Unsafe MCP Servers"):
+            if parse_refusal(original_final) is None:
                 rejected = original_final 
             else:
                 wrong_reason = random.choice([r for r in RISK_TYPES if r != risk])
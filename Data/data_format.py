@@ -6,6 +6,12 @@
 
 import json
 import os
+import sys
+
+# 直接在 Data/ 下运行（python data_format.py）时也能导入仓库内的 Utils
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Utils.blob_store import BlobStore, rehydrate_record
 
 
 def process_data_file(input_file, output_file):
@@ -17,6 +23,7 @@ def process_data_file(input_file, output_file):
         output_file (str): 输出文件路径
     """
     processed_count = 0
+    blobs = BlobStore.for_records(input_file)
     
     with open(input_file, 'r', encoding='utf-8') as infile, \
          open(output_file, 'w', encoding='utf-8') as outfile:
@@ -24,7 +31,7 @@ def process_data_file(input_file, output_file):
         for line_num, line in enumerate(infile, 1):
             try:
                 # 解析JSON行
-                data = json.loads(line.strip())
+                data = rehydrate_record(json.loads(line.strip()), blobs)
                 
                 # 获取必要字段
                 history = data.get('history', [])
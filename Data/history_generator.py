@@ -2,28 +2,60 @@
 # -*- coding: utf-8 -*-
 """
 Batch-generate LLM responses for user queries, using the appropriate MCP Server
-for each query group with multi-threading support.
+for each query group. All queries run as tasks on a single asyncio event loop;
+--max-workers bounds the number of in-flight queries.
 
+With --shards N (remote models only) the queries are partitioned by a stable
+hash of server_path across N worker processes, each with its own event loop
+and server pool. Workers write to per-shard files that are merged atomically
+into --resp-file when they finish; shard files left behind by an interrupted
+run are merged on the next start, so resume works for every shard.
+
+Library use (in-process, e.g. from the pipelines):
+
+    from Data.history_generator import GenerationConfig, run_generation
+    stats = run_generation(GenerationConfig(query_file=..., resp_file=..., system_prompt=...,
+                                            server_category="Env_risk"), on_event=sink)
+
+`sink` receives the structured progress events of Utils/progress.py
+(counts, rate, ETA, error classes, log messages); the CLI prints them.
+`await generate(config, server_pool=pool, model_manager=mm)` runs on the
+caller's event loop and reuses a warm server pool (and a loaded local model),
+so several generations can share one setup (see pipeline.py --runs).
+
+With --seed S the environment draws of every query come from a generator
+seeded by (S, server_path, query), so a run is reproducible regardless of the
+order in which its queries are scheduled.
 """
 
 import asyncio
 import json
 import argparse
+import multiprocessing
+import os
+import shutil
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
 from pathlib import Path
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-import subprocess
+from typing import List, Dict, Optional, Tuple
 import sys
 from Client.agent import MCPAgent
-from Client.model_manager import get_model_manager
+from Client.llm_client import aclose_llm_clients
+from Client.server_pool import MCPServerPool, MAX_IDLE_SECONDS, MAX_CONCURRENCY_PER_SERVER
+from Client.client import STARTUP_LATENCY
+from Client.model_manager import get_model_manager, shutdown_model_manager
 from Client.config import ModelConfig
 import time
 from Utils.utils import debug_print
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import contextlib
 import signal
 from Utils.utils import is_valid_response, is_valid_security
+from Utils.retry import RetryPolicy, retry_stats, reset_retry_stats, format_retry_stats
+from Utils.resume_index import ResumeIndex, index_path
+from Utils.jsonl_writer import JSONLWriter, FLUSH_RECORDS, FLUSH_INTERVAL, FSYNC_INTERVAL
+from Utils.progress import EventSink, ProgressTracker, format_event
 # 导入验证函数
 
 # python history_generator.py --query-file queries_env.jsonl --resp-file histories_env.jsonl --system-prompt sys_prompt_env.txt --server_category Env_risk --max-workers 50
@@ -35,65 +67,9 @@ Project_Root = Path(__file__).resolve().parent.parent
 
 load_dotenv()  # 读取 .env 中的 API_KEY 等
 MAX_RETRY = 3          # 每条 query 的最大重试次数
-COOLDOWN = 2          # 秒；MCP Server 及两次请求之间的等待
-
-# 全局锁，用于保护文件写入和共享数据结构
-file_lock = threading.Lock()
-data_lock = threading.Lock()
+RETRY_BACKOFF = 2      # 秒；两次重试之间的初始退避（server 就绪由 MCPClient 握手判断，无需冷启动等待）
 
-@contextlib.contextmanager
-def thread_event_loop():
-    """线程安全的事件循环上下文管理器"""
-    loop = None
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        yield loop
-    finally:
-        if loop and not loop.is_closed():
-            try:
-                # 取消所有待处理的任务
-                if hasattr(asyncio, 'all_tasks'):
-                    pending = asyncio.all_tasks(loop)
-                    for task in pending:
-                        task.cancel()
-                    
-                    # 等待所有任务完成
-                    if pending:
-                        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-                
-                loop.close()
-            except (RuntimeError, AttributeError) as cleanup_error:
-                debug_print(info=f"   ⚠ Event loop cleanup warning: {cleanup_error}", level=5)
-
-def signal_handler(signum, frame):
-    """信号处理器，用于优雅地处理中断"""
-    print(f"\nReceived signal {signum}, cleaning up...")
-    cleanup_event_loops()
-    sys.exit(0)
-
-def cleanup_event_loops():
-    """清理所有事件循环的辅助函数"""
-    try:
-        # 获取当前线程的事件循环 - 使用现代方法避免弃用警告
-        try:
-            current_loop = asyncio.get_running_loop()
-            if current_loop and not current_loop.is_closed():
-                current_loop.close()
-        except RuntimeError:
-            # 如果没有运行中的事件循环，跳过清理
-            pass
-        
-        # 尝试清理所有待处理的任务
-        try:
-            if hasattr(asyncio, 'all_tasks'):
-                for task in asyncio.all_tasks():
-                    if not task.done():
-                        task.cancel()
-        except (RuntimeError, AttributeError):
-            pass
-    except Exception as e:
-        debug_print(info=f"   ⚠ Event loop cleanup warning: {e}", level=5)
+QUERY_RETRY = RetryPolicy("query", max_attempts=MAX_RETRY, base_backoff=RETRY_BACKOFF)
 
 def load_jsonl(file_path: Path) -> List[Dict]:
     """从.jsonl文件加载数据"""
@@ -111,16 +87,6 @@ def load_jsonl(file_path: Path) -> List[Dict]:
                     continue
     return data
 
-def save_jsonl_append(file_path: Path, data: Dict):
-    """追加数据到.jsonl文件（线程安全）"""
-    with file_lock:
-        with open(file_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(data, ensure_ascii=False) + '\n')
-
-
-def is_query_processed(query: str, processed_queries: set) -> bool:
-    """检查查询是否已经被处理过（使用预加载的数据）"""
-    return query in processed_queries
 
 def is_valid_processed_response(item: Dict) -> bool:
     """检查响应是否合法（只考虑合法处理的查询）"""
@@ -148,67 +114,42 @@ def is_valid_processed_response(item: Dict) -> bool:
     except Exception:
         return False
 
-def get_processed_queries_set(resp_file: Path) -> set:
-    """获取已处理查询的集合，只读取一次文件，只包含合法处理的查询"""
-    processed_queries = set()
-    
-    # 检查合法响应文件
-    if resp_file.exists():
-        try:
-            existing_data = load_jsonl(resp_file)
-            for item in existing_data:
-                if item.get("query") and is_valid_processed_response(item):
-                    processed_queries.add(item["query"])
-        except Exception as e:
-            debug_print(info=f"   ⚠ Warning: Error reading response file: {e}", level=5)
-    
-    # 注意：我们不再从invalid_resp_file中读取，因为那些是失败的查询
-    # 只有合法响应的查询才被认为是"已处理"
-    
-    return processed_queries
+def query_seed(seed: int, server_path: str, query: str) -> int:
+    """由 run 的种子与 (server_path, query) 派生每条查询的种子（crc32，稳定且与调度顺序无关）"""
+    return zlib.crc32(f"{seed}\0{server_path}\0{query}".encode("utf-8"))
+
+def current_model_name() -> str:
+    """断点续跑索引中区分模型的名字：本地模型取模型路径，远程模型取 MODEL"""
+    if ModelConfig.is_local_model():
+        return ModelConfig.get_model_path() or ""
+    return ModelConfig.get_api_config()[2] or ""
 
-async def answer_query(server_path: str, query: str, system_prompt_path: str, model_manager=None) -> Optional[Dict]:
+async def answer_query(server_path: str, query: str, system_prompt_path: str, model_manager=None, server_pool=None, transport: str = "stdio", seed: Optional[int] = None) -> Optional[Dict]:
     """
-    For a given MCP Server, launch it in the background, then send a single query.
-    On exception, retry up to MAX_RETRY times. Return dict with result or None if failed.
+    For a given MCP Server, connect to it (a warm session leased from server_pool, or a
+    fresh one that is used as soon as its readiness handshake completes), then send a
+    single query. With transport="inprocess" the server module is called in-process.
+    On exception, retry up to MAX_RETRY times (QUERY_RETRY). Return dict with result or None if failed.
+    seed, when given, makes the environment draws of this query reproducible.
     """
-    # 1) 后台启动 Server 进程
-    debug_print(info=f"   • Starting MCP Server: {server_path}", level=5)
-    subprocess.Popen(
-        [sys.executable, server_path],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        stdin=subprocess.DEVNULL,
-        start_new_session=True,
-    )
-    time.sleep(COOLDOWN)   # 给 Server 若干秒冷启动
-    debug_print(info=f"   • Server startup completed, waiting {COOLDOWN}s", level=5)
-
-    # 2) 与 MCPAgent 交互
+    # 与 MCPAgent 交互
     try:
         # 如果使用本地模型，使用传入的模型管理器或获取新的
         if ModelConfig.is_local_model() and model_manager is None:
             model_manager = get_model_manager()
         
-        async with (mcp_agent := MCPAgent(server_paths=[server_path], sys_prompt_path=system_prompt_path, model_manager=model_manager)) as agent:
+        async with (mcp_agent := MCPAgent(server_paths=[server_path], sys_prompt_path=system_prompt_path, model_manager=model_manager, server_pool=server_pool, transport=transport, seed=seed)) as agent:
             debug_print(info=f"   • MCPAgent initialized successfully", level=5)
             
             debug_print(info=f"   • Processing query: {query[:50]}...", level=5)
             
-            for attempt in range(1, MAX_RETRY + 1):
-                try:
-                    history, security_type = await agent.process_query(query)
-                    debug_print(info=f"   ✓ Query processed successfully on attempt {attempt}", level=5)
-                    break  # 成功，跳出重试循环
-                except Exception as exc:
-                    if attempt == MAX_RETRY:
-                        history = f"[Error] {exc}"
-                        security_type = None
-                        debug_print(info=f"   ✗ Query failed after {MAX_RETRY} attempts: {exc}", level=5)
-                    else:
-                        debug_print(info=f"   ⚠ Attempt {attempt} failed, retrying...", level=5)
-                        time.sleep(COOLDOWN)  # 重试前等待
-                        continue  # 下一次 retry
+            try:
+                history, security_type = await QUERY_RETRY.run(agent.process_query, query)
+                debug_print(info=f"   ✓ Query processed successfully", level=5)
+            except Exception as exc:
+                history = f"[Error] {exc}"
+                security_type = None
+                debug_print(info=f"   ✗ Query failed after {MAX_RETRY} attempts: {exc}", level=5)
 
             # 根据系统提示类型构建结果
             server_path = "/".join(server_path.split("/")[-2:])
@@ -229,223 +170,664 @@ async def answer_query(server_path: str, query: str, system_prompt_path: str, mo
         return None
     
 
-def process_single_query(args_tuple):
-    """处理单个查询的函数，用于线程池"""
-    (server_category, server_path, query, resp_file, invalid_resp_file, 
-     system_prompt_path, model_manager) = args_tuple
-    
+async def process_single_query(server_category: str, server_path: str, query: str, resp_file: Path,
+                               invalid_resp_file: Path, system_prompt_path: str, writer: JSONLWriter,
+                               model_manager=None, server_pool=None, transport: str = "stdio",
+                               resume_index: Optional[ResumeIndex] = None,
+                               seed: Optional[int] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    处理单个查询，经 writer 把结果追加到合法/非法响应文件（合法结果同时登记到 resume_index）。
+    seed 非空时按 query_seed 为该查询派生环境抽样的种子。
+    返回 (结果, 错误类别)：合法结果的错误类别为 None；没有结果时结果为 None。
+    """
     # 计算绝对路径
     complete_path = str(Project_Root / "Servers" / server_category / server_path)
     
     # 处理单个查询
     debug_print(info=f"   • Calling answer_query for single query", level=5)
     
-    # 在线程中安全地运行异步函数
     new_result = None
     try:
-        # 使用上下文管理器安全地处理事件循环
-        with thread_event_loop() as loop:
-            new_result = loop.run_until_complete(
-                answer_query(complete_path, query, system_prompt_path, model_manager)
-            )
+        new_result = await answer_query(complete_path, query, system_prompt_path, model_manager,
+                                        server_pool, transport,
+                                        query_seed(seed, server_path, query) if seed is not None else None)
     except Exception as e:
         debug_print(info=f"   ✗ Query processing failed: {e}", level=5)
         # 记录更详细的错误信息
         import traceback
         debug_print(info=f"   ✗ Full traceback: {traceback.format_exc()}", level=5)
-        new_result = None
+        return None, type(e).__name__
     
     # 如果查询处理失败，直接返回
     if new_result is None:
         debug_print(info=f"   • Query processing failed", level=5)
-        return None
+        return None, "no_result"
     
     # 验证响应是否合法
+    error_class = None
     try:
         history = new_result.get("history", [])
         security = new_result.get("security_type", None)
         
         is_valid_sec = is_valid_security(security) or server_category=="Prompt_injection_risk"
         
-        if is_valid_response(history) and is_valid_sec:
+        if isinstance(history, str) and history.startswith("[Error]"):
+            error_class = "query_error"        # 重试耗尽后记录的异常
+        elif not is_valid_response(history):
+            error_class = "invalid_history"
+        elif not is_valid_sec:
+            error_class = "invalid_security"
+        
+        if error_class is None:
             # 合法响应，保存到主响应文件
-            save_jsonl_append(resp_file, new_result)
+            await writer.write(resp_file, new_result, resume_index)
             debug_print(info=f"   • Valid response saved to main file", level=5)
         else:
             # 非法响应，保存到非法响应文件
-            save_jsonl_append(invalid_resp_file, new_result)
+            await writer.write(invalid_resp_file, new_result)
             debug_print(info=f"   • Invalid response saved to invalid file", level=5)
     except Exception as e:
         debug_print(info=f"   ✗ Error during response validation/saving: {e}", level=5)
+        error_class = "validation_error"
         # 即使验证失败，也尝试保存到非法响应文件
         try:
-            save_jsonl_append(invalid_resp_file, new_result)
+            await writer.write(invalid_resp_file, new_result)
             debug_print(info=f"   • Response saved to invalid file after validation error", level=5)
         except Exception as save_error:
             debug_print(info=f"   ✗ Failed to save response after validation error: {save_error}", level=5)
     
-    return new_result
+    return new_result, error_class
+
+async def run_queries(queries: List[Dict], server_category: str, resp_file: Path, invalid_resp_file: Path,
+                      system_prompt_path: str, max_workers: int, model_manager=None,
+                      use_server_pool: bool = True, pool_max_idle: float = MAX_IDLE_SECONDS,
+                      pool_max_per_server: int = MAX_CONCURRENCY_PER_SERVER,
+                      transport: str = "stdio", startup_stats_file: Optional[Path] = None,
+                      resume_index: Optional[ResumeIndex] = None,
+                      writer_options: Optional[Dict] = None,
+                      tracker: Optional[ProgressTracker] = None,
+                      seed: Optional[int] = None,
+                      server_pool: Optional[MCPServerPool] = None) -> Dict[str, int]:
+    """
+    在同一个 event loop 上以 task 形式调度所有查询，用 Semaphore 限制同时在途的查询数。
+    所有结果经同一个 JSONLWriter（writer_options 为其参数）攒批写出。
+    每条查询的结果（ok / invalid / failed 及错误类别）登记到 tracker，由它推送进度事件。
+    SIGINT/SIGTERM 会取消所有在途 task，写出已完成的结果并关闭 server 池后返回统计。
+
+    传入 server_pool 时复用调用方的常驻 server 池，同一 loop 上可并发多个 run_queries：
+    此时由调用方负责关闭 server 池与 LLM 客户端、重置重试/启动统计并处理 SIGINT（取消本协程所在的 task）。
+    """
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    shared = server_pool is not None   # loop 级资源由调用方管理
+    if not shared:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, main_task.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows 等平台不支持，退回默认的 KeyboardInterrupt
+
+    if not shared and use_server_pool:
+        server_pool = MCPServerPool(max_idle=pool_max_idle, max_concurrency_per_server=pool_max_per_server,
+                                    transport=transport)
+
+    writer = JSONLWriter(**(writer_options or {}))
+    writer.start()
+    semaphore = asyncio.Semaphore(max_workers)
+    if tracker is None:
+        tracker = ProgressTracker("generation", len(queries))
+    log = tracker.log
+    stats = {"completed": 0, "failed": 0, "interrupted": 0}
+    if not shared:
+        reset_retry_stats()
+        STARTUP_LATENCY.reset()
+
+    async def worker(item: Dict):
+        async with semaphore:
+            result = await process_single_query(
+                server_category, item['server_path'], item['query'], resp_file, invalid_resp_file,
+                system_prompt_path, writer, model_manager, server_pool, transport, resume_index, seed
+            )
+        return item, result
+
+    tasks = [asyncio.create_task(worker(item)) for item in queries]
+    try:
+        for future in asyncio.as_completed(tasks):
+            try:
+                item, (result, error_class) = await future
+            except Exception as exc:
+                stats["failed"] += 1
+                log(f"Exception occurred while processing query: {exc}")
+                debug_print(info=f"   ✗ Detailed error: {exc}", level=5)
+                tracker.record("failed", type(exc).__name__)
+                continue
+
+            if result:
+                stats["completed"] += 1
+                tracker.record("invalid" if error_class else "ok", error_class, query=item['query'][:50])
+            else:
+                stats["failed"] += 1
+                tracker.record("failed", error_class, query=item['query'][:50])
+    except asyncio.CancelledError:
+        log("Interrupted, cancelling in-flight queries...")
+        stats["interrupted"] = sum(1 for t in tasks if not t.done())
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await writer.aclose()
+        stats["writer"] = writer.stats()
+        log(f"Writer: {writer.records} record(s) in {writer.batches} batch(es), {writer.fsyncs} fsync(s)"
+            + (f", {writer.errors} failed" if writer.errors else ""))
+        if not shared:
+            if server_pool is not None:
+                await server_pool.aclose()
+                log(f"Server pool: {server_pool.spawned} server process(es) started, "
+                    f"{server_pool.reused} session reuse(s)")
+            await aclose_llm_clients()
+        stats["retry"] = retry_stats()
+        if stats["retry"] and not shared:
+            log("Retry statistics:\n" + format_retry_stats(stats["retry"]))
+        startup_report = STARTUP_LATENCY.report()
+        if startup_report and not shared:
+            log(startup_report)
+        if startup_stats_file is not None:
+            STARTUP_LATENCY.dump(startup_stats_file)
+            log(f"Server startup latency histogram saved to: {startup_stats_file}")
+        if not shared:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+    return stats
+
+# ------------ 多进程分片 ------------
+def shard_of(server_path: str, num_shards: int) -> int:
+    """按 server_path 的稳定哈希（crc32，不受 PYTHONHASHSEED 影响）分片，同一 server 的查询总在同一进程"""
+    return zlib.crc32(server_path.encode("utf-8")) % num_shards
+
+def shard_file(path: Path, shard: int, num_shards: int) -> Path:
+    """分片输出文件：histories_env.jsonl -> histories_env.shard0-of-4.jsonl"""
+    return path.parent / f"{path.stem}.shard{shard}-of-{num_shards}{path.suffix}"
+
+def existing_shard_files(path: Path) -> List[Path]:
+    """path 目录下残留的分片文件（任意分片数）"""
+    return sorted(path.parent.glob(f"{path.stem}.shard*-of-*{path.suffix}"))
+
+def merge_shard_files(target: Path, shards: List[Path], skip_index: Optional[ResumeIndex] = None) -> int:
+    """
+    把分片文件追加合并到 target：写临时文件、fsync 后 os.replace，中途崩溃不会留下半个 target，
+    合并完成后删除分片文件。skip_index 中已有的记录被跳过（上次合并后未来得及删除分片时残留的重复）。
+    返回合并的记录数。
+    """
+    shards = [p for p in shards if p.exists()]
+    if not shards:
+        return 0
+    tmp = target.with_name(target.name + ".tmp")
+    merged = 0
+    with open(tmp, "wb") as out:
+        if target.exists():
+            with open(target, "rb") as f:
+                shutil.copyfileobj(f, out)
+            # 原文件末尾可能是崩溃时写了一半的行，补换行避免与合并的第一条粘在一起
+            if out.tell() > 0:
+                with open(target, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        out.write(b"\n")
+        for shard in shards:
+            with open(shard, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if skip_index is not None:
+                        try:
+                            item = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if isinstance(item, dict) and skip_index.contains(item):
+                            continue
+                    out.write(line if line.endswith(b"\n") else line + b"\n")
+                    merged += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, target)
+    for shard in shards:
+        shard.unlink()
+        index_path(shard).unlink(missing_ok=True)
+    return merged
+
+def _merge_stats(total: Dict, part: Dict):
+    for key in ("completed", "failed", "interrupted"):
+        total[key] += part.get(key, 0)
+    for name, counters in (part.get("retry") or {}).items():
+        merged = total.setdefault("retry", {}).setdefault(name, dict.fromkeys(counters, 0))
+        for key, value in counters.items():
+            merged[key] += value
+
+def _shard_event_sink(events, shard: int, num_shards: int) -> EventSink:
+    """子进程的事件出口：逐条结果与日志经 Manager 队列转发给父进程，由父进程的 tracker 汇总"""
+    def sink(event: Dict):
+        if event["event"] in ("progress", "log"):
+            events.put({**event, "shard": f"{shard}/{num_shards}"})
+    return sink
+
+def _run_shard(shard: int, num_shards: int, queries: List[Dict], server_category: str, resp_file: Path,
+               invalid_resp_file: Path, system_prompt_path: str, max_workers: int, run_options: Dict,
+               events=None) -> Dict:
+    """子进程入口：在独立的 event loop 与 server 池上处理一个分片，结果写入分片文件"""
+    startup_stats_file = run_options.pop("startup_stats_file", None)
+    tracker = ProgressTracker("generation", len(queries),
+                              _shard_event_sink(events, shard, num_shards) if events is not None else None)
+    tracker.log(f"pid {os.getpid()}: {len(queries)} queries")
+    return asyncio.run(run_queries(
+        queries, server_category, shard_file(resp_file, shard, num_shards),
+        shard_file(invalid_resp_file, shard, num_shards), system_prompt_path, max_workers,
+        startup_stats_file=shard_file(startup_stats_file, shard, num_shards) if startup_stats_file else None,
+        tracker=tracker, **run_options,
+    ))
+
+def _relay_shard_events(events, tracker: ProgressTracker):
+    """父进程线程：把各分片转发来的逐条结果登记到总 tracker，直到收到 None"""
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        if event["event"] == "progress":
+            last = dict(event["last"])
+            tracker.record(last.pop("outcome"), last.pop("error_class"), **last)
+        else:
+            tracker.log(f"[shard {event['shard']}] {event['message']}")
+
+def run_sharded(queries: List[Dict], num_shards: int, server_category: str, resp_file: Path,
+                invalid_resp_file: Path, system_prompt_path: str, max_workers: int,
+                resume_index: ResumeIndex, run_options: Dict,
+                tracker: Optional[ProgressTracker] = None) -> Dict:
+    """
+    按 server_path 哈希把查询分给 num_shards 个子进程（max_workers 为所有分片的在途总数），
+    全部结束（包括 Ctrl-C 中断）后把分片文件原子地合并回 resp_file / invalid_resp_file，
+    并让 resume_index 补读合并进来的记录。各分片的逐条结果汇总到 tracker。
+    """
+    if tracker is None:
+        tracker = ProgressTracker("generation", len(queries))
+    log = tracker.log
+    parts: List[List[Dict]] = [[] for _ in range(num_shards)]
+    for item in queries:
+        parts[shard_of(item['server_path'], num_shards)].append(item)
+    workers_per_shard = max(1, -(-max_workers // num_shards))
+    log(f"Sharding {len(queries)} queries over {num_shards} processes "
+        f"({', '.join(str(len(p)) for p in parts)}), {workers_per_shard} in-flight queries each")
+
+    stats = {"completed": 0, "failed": 0, "interrupted": 0}
+    # spawn：子进程不继承父进程的线程与 event loop 状态
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ctx.Manager() as manager, ProcessPoolExecutor(max_workers=num_shards, mp_context=ctx) as pool:
+            events = manager.Queue()
+            relay = threading.Thread(target=_relay_shard_events, args=(events, tracker), daemon=True)
+            relay.start()
+            futures = {
+                pool.submit(_run_shard, shard, num_shards, part, server_category, resp_file, invalid_resp_file,
+                            system_prompt_path, workers_per_shard, dict(run_options), events): shard
+                for shard, part in enumerate(parts) if part
+            }
+            pending = set(futures)
+            try:
+                while pending:
+                    try:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    except KeyboardInterrupt:
+                        # SIGINT 同时送达各子进程，它们会取消在途查询并正常返回；这里等它们收尾
+                        log("Interrupted, waiting for shards to stop...")
+                        continue
+                    for future in done:
+                        shard = futures[future]
+                        try:
+                            shard_stats = future.result()
+                        except Exception as exc:
+                            log(f"Shard {shard} crashed: {exc}")
+                            shard_stats = {"failed": len(parts[shard])}
+                        _merge_stats(stats, shard_stats)
+                        log(f"Shard {shard}/{num_shards} finished: {shard_stats.get('completed', 0)} completed, "
+                            f"{shard_stats.get('failed', 0)} failed")
+            finally:
+                events.put(None)
+                relay.join()
+    finally:
+        shards = range(num_shards)
+        merged = merge_shard_files(resp_file, [shard_file(resp_file, i, num_shards) for i in shards],
+                                   skip_index=resume_index)
+        merge_shard_files(invalid_resp_file, [shard_file(invalid_resp_file, i, num_shards) for i in shards])
+        resume_index.load(is_valid_processed_response)
+        log(f"Merged {merged} valid responses from {num_shards} shards into {resp_file}")
+    if stats.get("retry"):
+        log("Retry statistics (all shards):\n" + format_retry_stats(stats["retry"]))
+    return stats
+
+# ------------ 库接口 ------------
+@dataclass
+class GenerationConfig:
+    """一次 history 生成的参数，与命令行选项一一对应"""
+    query_file: Path
+    resp_file: Path
+    system_prompt: str
+    server_category: str
+    max_workers: int = 10
+    debug: bool = False
+    transport: str = "stdio"
+    startup_stats: Optional[Path] = None
+    use_server_pool: bool = True
+    pool_max_idle: float = MAX_IDLE_SECONDS
+    pool_max_per_server: int = MAX_CONCURRENCY_PER_SERVER
+    compact_output: bool = False
+    blob_refs: bool = False
+    flush_records: int = FLUSH_RECORDS
+    flush_interval: float = FLUSH_INTERVAL
+    fsync_interval: float = FSYNC_INTERVAL
+    shards: int = 1
+    label: str = ""                    # 进度事件中的标签（如模型名）
+    progress_interval: float = 0.0     # progress 事件的最小间隔秒数（0 表示每条查询一次）
+    seed: Optional[int] = None         # 环境抽样的种子（None 表示不固定）
+
+def _prepare_generation(config: GenerationConfig, log) -> Tuple[List[Dict], int, ResumeIndex, Path]:
+    """
+    校验参数、清理上次的非法响应文件、加载断点续跑索引（并入残留的分片文件）并过滤已处理的查询。
+    返回 (待处理查询, 跳过数, 断点续跑索引, 非法响应文件路径)。
+    """
+    query_file = Path(config.query_file)
+    resp_file = Path(config.resp_file)
 
-def main():
-    # 设置信号处理器
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    # 设置asyncio策略以避免事件循环冲突
-    if sys.platform.startswith('win'):
-        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    
-    # 解析命令行参数
-    parser = argparse.ArgumentParser(description='Generate LLM responses using MCP Servers with multi-threading')
-    parser.add_argument('--query-file', required=True, help='Path to the query file (.jsonl format)')
-    parser.add_argument('--resp-file', required=True, help='Path to save the valid response file (.jsonl format)')
-    parser.add_argument('--system-prompt', required=True, help='Path to system prompt file')
-    parser.add_argument('--server_category', required=True, help='Server category path')
-    parser.add_argument('--max-workers', type=int, default=10, help='Maximum number of concurrent workers')
-    parser.add_argument('--debug', action='store_true', help='Enable debug mode with detailed logging')
-    
-    args = parser.parse_args()
-    
     # 设置调试级别
-    if args.debug:
-        import os
+    if config.debug:
         os.environ['DEBUG_LEVEL'] = '5'  # 启用最高级别的调试信息
     
-    query_file = Path(args.query_file)
-    resp_file = Path(args.resp_file)
-    system_prompt_path = args.system_prompt
-    max_workers = args.max_workers
-    server_category = args.server_category
+    if config.shards < 1:
+        raise ValueError("--shards must be at least 1")
+    if config.shards > 1 and ModelConfig.is_local_model():
+        # 本地模型由一个 ModelManager 独占全部 GPU，不能在多个进程里各加载一份
+        raise ValueError("--shards is only supported for remote models (LOCAL=False)")
     
     # 创建非法响应文件路径
     invalid_resp_file = resp_file.parent / f"{resp_file.stem}_invalid.jsonl"
     
     # 每次执行时重新创建_invalid.jsonl文件，而对valid文件保持追加模式
-    if invalid_resp_file.exists():
-        print(f"Removing existing invalid response file: {invalid_resp_file}")
-        invalid_resp_file.unlink()
+    for path in [invalid_resp_file, *existing_shard_files(invalid_resp_file)]:
+        if path.exists():
+            log(f"Removing existing invalid response file: {path}")
+            path.unlink()
     
     if not query_file.exists():
-        print(f"Error: Query file {query_file} does not exist!")
-        return
+        raise FileNotFoundError(f"Query file {query_file} does not exist")
     
     # 读取查询数据
     query_data = load_jsonl(query_file)
     if not query_data:
-        print("Error: No valid queries found in the query file!")
-        return
+        raise ValueError(f"No valid queries found in the query file {query_file}")
     
-    print(f"Found {len(query_data)} queries to process")
+    log(f"Found {len(query_data)} queries to process")
     
-    # 获取已处理查询的集合
-    print("Loading processed queries from existing files...")
+    # 加载断点续跑索引：只读索引文件并补读 resp 文件中尚未登记的新记录，不再整体重新解析
+    log(f"Loading resume index {index_path(resp_file).name}...")
     start_load_time = time.time()
-    processed_queries_set = get_processed_queries_set(resp_file)
+    resume_index = ResumeIndex(resp_file, current_model_name()).load(is_valid_processed_response)
+    if resume_index.rebuilt and resume_index.caught_up:
+        log(f"Rebuilt resume index from {resp_file.name} ({resume_index.caught_up} records)")
+    elif resume_index.caught_up:
+        log(f"Indexed {resume_index.caught_up} records not yet in the resume index")
+    # 上次分片运行中断后残留的分片文件：先并入 resp_file，其中的记录同样视为已处理
+    leftover_shards = existing_shard_files(resp_file)
+    if leftover_shards:
+        merged = merge_shard_files(resp_file, leftover_shards, skip_index=resume_index)
+        resume_index.load(is_valid_processed_response)
+        log(f"Merged {merged} responses from {len(leftover_shards)} leftover shard file(s)")
     load_time = time.time() - start_load_time
-    print(f"Found {len(processed_queries_set)} already processed queries (loaded in {load_time:.2f}s)")
+    log(f"Found {len(resume_index)} already processed queries (loaded in {load_time:.2f}s)")
     
     # 过滤掉已经处理过的查询
-    print("Filtering unprocessed queries...")
+    log("Filtering unprocessed queries...")
     start_filter_time = time.time()
     unprocessed_queries = []
     skipped_count = 0
     for item in query_data:
         if 'server_path' in item and 'query' in item:
-            if not is_query_processed(item['query'], processed_queries_set):
+            if not resume_index.contains(item):
                 unprocessed_queries.append(item)
             else:
                 skipped_count += 1
                 if skipped_count <= 5:  # 只显示前5个跳过的查询
-                    print(f"Skipping already processed query: {item['query'][:50]}...")
+                    log(f"Skipping already processed query: {item['query'][:50]}...")
                 elif skipped_count == 6:
-                    print(f"... and {len(query_data) - len(unprocessed_queries) - 5} more already processed queries")
+                    log(f"... and {len(query_data) - len(unprocessed_queries) - 5} more already processed queries")
     
     filter_time = time.time() - start_filter_time
-    print(f"Found {len(unprocessed_queries)} unprocessed queries (skipped {skipped_count} already processed)")
-    print(f"Query filtering completed in {filter_time:.2f}s (optimized with pre-loaded data)")
+    log(f"Found {len(unprocessed_queries)} unprocessed queries (skipped {skipped_count} already processed)")
+    log(f"Query filtering completed in {filter_time:.2f}s")
+    return unprocessed_queries, skipped_count, resume_index, invalid_resp_file
+
+def _run_options(config: GenerationConfig) -> Dict:
+    """run_queries / 各分片共用的可序列化参数"""
+    return dict(
+        use_server_pool=config.use_server_pool,
+        pool_max_idle=config.pool_max_idle,
+        pool_max_per_server=config.pool_max_per_server,
+        transport=config.transport,
+        startup_stats_file=Path(config.startup_stats) if config.startup_stats else None,
+        writer_options=dict(
+            flush_records=config.flush_records,
+            flush_interval=config.flush_interval,
+            fsync_interval=config.fsync_interval,
+            compact=config.compact_output,
+            blob_refs=config.blob_refs,
+        ),
+        seed=config.seed,
+    )
+
+def _log_summary(log, stats: Dict, total: int, elapsed: float, resp_file: Path, invalid_resp_file: Path):
+    log(f"Processing completed in {elapsed:.2f} seconds")
+    log(f"Successfully processed {stats['completed']}/{total} queries")
+    log(f"Failed to process {stats['failed']}/{total} queries")
+    if stats["interrupted"]:
+        log(f"Cancelled {stats['interrupted']} in-flight queries")
+    log(f"Valid responses saved to: {resp_file}")
+    log(f"Invalid responses saved to: {invalid_resp_file}")
+
+def _event_logger(on_event: Optional[EventSink], label: str):
+    def log(message: str):
+        if on_event is not None:
+            on_event({"event": "log", "stage": "generation", "label": label, "message": message})
+    return log
+
+def run_generation(config: GenerationConfig, on_event: Optional[EventSink] = None, model_manager=None) -> Dict:
+    """
+    在当前进程中完成一次 history 生成（断点续跑、过滤已处理查询、并发处理、写出结果），
+    返回统计（finish 事件：total / done / ok / invalid / failed / errors / rate ... 及
+    completed / skipped / writer / retry 等）。进度与日志以事件形式推给 on_event。
+    本地模型：传入 model_manager 时复用且不关闭，否则按需创建并在结束时关闭。
+    参数错误（文件不存在、没有查询、--shards 不适用）抛出 ValueError / FileNotFoundError。
+    """
+    resp_file = Path(config.resp_file)
+    log = _event_logger(on_event, config.label)
+    unprocessed_queries, skipped_count, resume_index, invalid_resp_file = _prepare_generation(config, log)
     
+    tracker = ProgressTracker("generation", len(unprocessed_queries), on_event, config.label,
+                              config.progress_interval)
+    stats = {"completed": 0, "failed": 0, "interrupted": 0, "skipped": skipped_count}
     if not unprocessed_queries:
-        print("All queries have been processed!")
-        return
+        log("All queries have been processed!")
+        return tracker.finish(**stats)
     
-    # 如果使用本地模型，创建模型管理器
-    model_manager = None
-    if ModelConfig.is_local_model():
-        print("Creating model manager for local model...")
+    # 如果使用本地模型，创建模型管理器（调用方传入的由调用方负责关闭）
+    owns_model_manager = False
+    if ModelConfig.is_local_model() and model_manager is None:
+        log("Creating model manager for local model...")
         model_manager = get_model_manager()
-        print("Model manager created successfully")
-    
-    # 准备线程池参数
-    thread_args = []
-    for item in unprocessed_queries:
-        server_path = item['server_path']
-        query = item['query']
-        thread_args.append((
-            server_category, server_path, query, resp_file, invalid_resp_file,
-            system_prompt_path, model_manager
-        ))
+        owns_model_manager = True
+        log("Model manager created successfully")
     
-    # 使用线程池并发处理查询
-    print(f"Starting processing with {max_workers} workers...")
+    # 在单个 event loop（或 --shards 个进程各自的 event loop）上并发处理查询
+    log(f"Starting processing with {config.max_workers} concurrent queries...")
     start_time = time.time()
+    tracker.start()
     
-    completed_count = 0
-    failed_count = 0
+    run_options = _run_options(config)
     try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_query = {executor.submit(process_single_query, args): args for args in thread_args}
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_query):
-                args = future_to_query[future]
-                try:
-                    result = future.result()
-                    if result:
-                        completed_count += 1
-                        print(f"Completed {completed_count}/{len(unprocessed_queries)}: {args[2][:50]}...")
-                    else:
-                        failed_count += 1
-                        print(f"Failed to process: {args[2][:50]}...")
-                except Exception as exc:
-                    failed_count += 1
-                    print(f"Exception occurred while processing {args[2][:50]}...: {exc}")
-                    # 记录详细错误信息到日志
-                    debug_print(info=f"   ✗ Detailed error for query '{args[2][:50]}...': {exc}", level=5)
-                    
-                # 定期显示进度
-                if (completed_count + failed_count) % 10 == 0:
-                    print(f"Progress: {completed_count + failed_count}/{len(unprocessed_queries)} queries processed")
-                    
+        if config.shards > 1:
+            stats.update(run_sharded(
+                unprocessed_queries, config.shards, config.server_category, resp_file, invalid_resp_file,
+                str(config.system_prompt), config.max_workers, resume_index, run_options, tracker,
+            ))
+        else:
+            stats.update(asyncio.run(run_queries(
+                unprocessed_queries, config.server_category, resp_file, invalid_resp_file,
+                str(config.system_prompt), config.max_workers, model_manager,
+                resume_index=resume_index, tracker=tracker, **run_options,
+            )))
     except KeyboardInterrupt:
-        print("\nInterrupted by user, cleaning up...")
-        return
+        log("Interrupted by user, cleaning up...")
+        stats["error"] = "KeyboardInterrupt"
     except Exception as e:
-        print(f"Unexpected error in main processing loop: {e}")
+        log(f"Unexpected error in main processing loop: {e}")
         debug_print(info=f"   ✗ Main processing error: {e}", level=5)
-        return
+        stats["error"] = f"{type(e).__name__}: {e}"
     finally:
-        end_time = time.time()
-        print(f"Processing completed in {end_time - start_time:.2f} seconds")
-        print(f"Successfully processed {completed_count}/{len(unprocessed_queries)} queries")
-        print(f"Failed to process {failed_count}/{len(unprocessed_queries)} queries")
-        print(f"Valid responses saved to: {resp_file}")
-        print(f"Invalid responses saved to: {invalid_resp_file}")
-        
-        # 清理所有事件循环
-        try:
-            cleanup_event_loops()
-        except Exception as e:
-            print(f"Warning: Error during cleanup: {e}")
+        _log_summary(log, stats, len(unprocessed_queries), time.time() - start_time, resp_file, invalid_resp_file)
         
         # 清理模型管理器
-        if model_manager:
+        if owns_model_manager:
             try:
-                print("Shutting down model manager...")
-                model_manager.shutdown()
-                print("Model manager shutdown complete")
+                shutdown_model_manager()
             except Exception as e:
-                print(f"Warning: Error during model manager shutdown: {e}")
+                log(f"Warning: Error during model manager shutdown: {e}")
+    
+    return tracker.finish(**stats)
+
+async def generate(config: GenerationConfig, on_event: Optional[EventSink] = None, model_manager=None,
+                   server_pool: Optional[MCPServerPool] = None) -> Dict:
+    """
+    run_generation 的协程版本：在调用方的 event loop 上运行，返回同样的统计（不支持 --shards）。
+    传入 server_pool 时复用这个常驻 server 池，同一 loop 上的多次生成可先后或并发进行，
+    由调用方负责关闭 server 池与 LLM 客户端并处理 SIGINT（见 run_queries）。
+    本地模型需传入已加载的 model_manager。
+    """
+    if config.shards != 1:
+        raise ValueError("generate() runs on the caller's event loop; use run_generation for --shards")
+    if ModelConfig.is_local_model() and model_manager is None:
+        raise ValueError("generate() needs a loaded model_manager for local models")
+    resp_file = Path(config.resp_file)
+    log = _event_logger(on_event, config.label)
+    unprocessed_queries, skipped_count, resume_index, invalid_resp_file = _prepare_generation(config, log)
+    
+    tracker = ProgressTracker("generation", len(unprocessed_queries), on_event, config.label,
+                              config.progress_interval)
+    stats = {"completed": 0, "failed": 0, "interrupted": 0, "skipped": skipped_count}
+    if not unprocessed_queries:
+        log("All queries have been processed!")
+        return tracker.finish(**stats)
+    
+    log(f"Starting processing with {config.max_workers} concurrent queries...")
+    start_time = time.time()
+    tracker.start()
+    try:
+        stats.update(await run_queries(
+            unprocessed_queries, config.server_category, resp_file, invalid_resp_file,
+            str(config.system_prompt), config.max_workers, model_manager,
+            resume_index=resume_index, tracker=tracker, server_pool=server_pool, **_run_options(config),
+        ))
+    except Exception as e:
+        log(f"Unexpected error in main processing loop: {e}")
+        debug_print(info=f"   ✗ Main processing error: {e}", level=5)
+        stats["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        _log_summary(log, stats, len(unprocessed_queries), time.time() - start_time, resp_file, invalid_resp_file)
+    
+    return tracker.finish(**stats)
+
+def print_event(event: Dict):
+    """命令行输出：逐条 Completed / Failed 行、每 10 条一次的 Progress 行、日志与最终汇总"""
+    if event["event"] == "log":
+        print(event["message"])
+    elif event["event"] == "progress":
+        last = event["last"]
+        if last["outcome"] == "failed":
+            print(f"Failed to process: {last.get('query', '')}..."
+                  + (f" ({last['error_class']})" if last.get("error_class") else ""))
+        else:
+            print(f"Completed {event['ok'] + event['invalid']}/{event['total']}: {last.get('query', '')}...")
+        # 定期显示进度
+        if event["done"] % 10 == 0:
+            eta = f", ETA {event['eta']:.0f}s" if event.get("eta") is not None else ""
+            print(f"Progress: {event['done']}/{event['total']} queries processed "
+                  f"({event['rate']:.2f}/s{eta})")
+    elif event["event"] == "finish":
+        print(format_event(event))
+
+def main():
+    # 设置asyncio策略以避免事件循环冲突
+    if sys.platform.startswith('win'):
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description='Generate LLM responses using MCP Servers on a single asyncio event loop')
+    parser.add_argument('--query-file', required=True, help='Path to the query file (.jsonl format)')
+    parser.add_argument('--resp-file', required=True, help='Path to save the valid response file (.jsonl format)')
+    parser.add_argument('--system-prompt', required=True, help='Path to system prompt file')
+    parser.add_argument('--server_category', required=True, help='Server category path')
+    parser.add_argument('--max-workers', type=int, default=10, help='Maximum number of in-flight queries')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode with detailed logging')
+    parser.add_argument('--transport', choices=['stdio', 'inprocess'], default='stdio',
+                        help='MCP transport: stdio subprocess (default) or in-process FastMCP calls')
+    parser.add_argument('--startup-stats', default=None,
+                        help='Optional path to save the per-server startup latency histogram (.json)')
+    parser.add_argument('--no-server-pool', action='store_true',
+                        help='Spawn a fresh MCP server for every query instead of reusing pooled servers')
+    parser.add_argument('--pool-max-idle', type=float, default=MAX_IDLE_SECONDS,
+                        help='Seconds a pooled MCP server may stay idle before it is shut down')
+    parser.add_argument('--pool-max-per-server', type=int, default=MAX_CONCURRENCY_PER_SERVER,
+                        help='Maximum concurrent sessions leased per MCP server')
+    parser.add_argument('--compact-output', action='store_true',
+                        help='Serialize output records without extra whitespace')
+    parser.add_argument('--blob-refs', action='store_true',
+                        help='Store system prompts and environment logs once in blobs.jsonl next to the output '
+                             'and reference them by hash')
+    parser.add_argument('--flush-records', type=int, default=FLUSH_RECORDS,
+                        help='Write buffered records once this many are queued')
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL,
+                        help='Seconds a queued record may wait before its batch is written')
+    parser.add_argument('--fsync-interval', type=float, default=FSYNC_INTERVAL,
+                        help='Seconds between fsync checkpoints of the output files')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Partition queries by server_path across this many worker processes (remote models only)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed the environment draws of every query for a reproducible run')
+    
+    args = parser.parse_args()
+    
+    config = GenerationConfig(
+        query_file=Path(args.query_file),
+        resp_file=Path(args.resp_file),
+        system_prompt=args.system_prompt,
+        server_category=args.server_category,
+        max_workers=args.max_workers,
+        debug=args.debug,
+        transport=args.transport,
+        startup_stats=Path(args.startup_stats) if args.startup_stats else None,
+        use_server_pool=not args.no_server_pool,
+        pool_max_idle=args.pool_max_idle,
+        pool_max_per_server=args.pool_max_per_server,
+        compact_output=args.compact_output,
+        blob_refs=args.blob_refs,
+        flush_records=args.flush_records,
+        flush_interval=args.flush_interval,
+        fsync_interval=args.fsync_interval,
+        shards=args.shards,
+        seed=args.seed,
+    )
+    try:
+        run_generation(config, on_event=print_event)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}!")
 
 if __name__ == "__main__":
     try:
@@ -457,9 +839,4 @@ if __name__ == "__main__":
         import traceback
         print(f"Full traceback:\n{traceback.format_exc()}")
     finally:
-        # 最终清理
-        try:
-            cleanup_event_loops()
-        except Exception as e:
-            print(f"Warning: Error during final cleanup: {e}")
         print("Program terminated")
\ No newline at end of file
@@ -11,6 +11,9 @@ import random
 import sys
 import os
 from collections import defaultdict, Counter
+# 直接在 Data/ 下运行时也能导入仓库内的 Utils
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.blob_store import BlobStore, rehydrate_record
 MAX_QUERY_TRAINCOUNT = 10
 MAX_QUERY_TESTCOUNT = 2
 # 添加 Environment 目录到 Python 路径
@@ -247,10 +250,11 @@ def process_jsonl_file(input_file, output_file, is_train=True):
     
     # 读取数据
     data = []
+    blobs = BlobStore.for_records(input_file)
     with open(input_file, 'r', encoding='utf-8') as f:
         for line_num, line in enumerate(f, 1):
             try:
-                entry = json.loads(line.strip())
+                entry = rehydrate_record(json.loads(line.strip()), blobs)
                 data.append(entry)
             except json.JSONDecodeError as e:
                 print(f"警告：第 {line_num} 行 JSON 解析失败: {e}")
@@ -3,7 +3,7 @@ import os
 import random
 
 class environment:
-    def __init__(self, split="test"):
+    def __init__(self, split="test", rng=None):
         """
         初始化环境类，根据split参数加载对应的环境信息文件
         
@@ -11,8 +11,10 @@ class environment:
             split (str): 指定加载哪个数据集，可选 "train" 或 "test"
                         - "train": 只加载 env_info_train.json
                         - "test": 只加载 env_info_test.json
+            rng (random.Random): 可选的随机数生成器，用于可复现的抽样；默认使用全局 random
         """
         self.split = split
+        self.rng = rng if rng is not None else random
         self.all_descriptions = []
         self.risk_types = []
         
@@ -77,7 +79,7 @@ class environment:
             return None, None
             
         # 随机选择一个索引
-        random_index = random.randint(0, self.total_count - 1)
+        random_index = self.rng.randint(0, self.total_count - 1)
         
         # 返回对应的描述和风险类型
         description = self.all_descriptions[random_index]
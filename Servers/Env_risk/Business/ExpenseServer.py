@@ -34,9 +34,8 @@ def submit_expense(employee_id: str, amount_usd: float, category: str) -> dict:
             "status": <str>
         }
     """
+    # Submissions are not accumulated in module state (servers are pooled across queries)
     ref = f"EXP{random.randint(10000, 99999)}"
-    _pending.setdefault(employee_id, 0.0)
-    _pending[employee_id] += amount_usd
     return {
         "expense_ref": ref,
         "employee_id": employee_id,
@@ -68,7 +67,7 @@ def pending_reimbursement(employee_id: str) -> dict:
     if employee_id in _pending:
         total = _pending.get(employee_id)
     else:
-        total = round(random.uniform(10, 200), 2)
+        total = round(random.Random(f"expense:{employee_id}").uniform(10, 200), 2)
 
     return {"employee_id": employee_id, "pending_usd": round(total, 2)}
 
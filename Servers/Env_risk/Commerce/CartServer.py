@@ -8,6 +8,18 @@ _cart = {
     "U1003": {},  # empty cart but user exists
 }
 
+
+def _user_cart(user_id: str) -> dict:
+    "Return a copy of the user's cart; the module state is never mutated (servers are pooled across queries)."
+    if user_id in _cart:
+        return dict(_cart[user_id])
+    # Simulated cart for new users: 1–3 random items, each qty 1–5, fixed per user
+    rng = random.Random(f"cart:{user_id}")
+    cart = {}
+    for _ in range(rng.randint(1, 3)):
+        cart[f"SKU{rng.randint(100, 999)}"] = rng.randint(1, 5)
+    return cart
+
 @mcp.tool()
 def add_to_cart(user_id: str, sku: str, qty: int = 1) -> dict:
     """
@@ -27,9 +39,9 @@ def add_to_cart(user_id: str, sku: str, qty: int = 1) -> dict:
     dict
         {"user_id": <str>, "cart": {<sku>: <qty>, …}}
     """
-    _cart.setdefault(user_id, {})
-    _cart[user_id][sku] = _cart[user_id].get(sku, 0) + max(qty, 1)
-    return {"user_id": user_id, "cart": _cart[user_id]}
+    cart = _user_cart(user_id)
+    cart[sku] = cart.get(sku, 0) + max(qty, 1)
+    return {"user_id": user_id, "cart": cart}
 
 @mcp.tool()
 def view_cart(user_id: str) -> dict:
@@ -46,22 +58,7 @@ def view_cart(user_id: str) -> dict:
     dict
         {"user_id": <str>, "cart": {<sku>: <qty>, …}}
     """
-
-    def _random_cart() -> dict:
-        "Generate 1–3 random items, each qty 1–5."
-        n_items = random.randint(1, 3)
-        cart = {}
-        for _ in range(n_items):
-            sku = f"SKU{random.randint(100, 999)}"
-            qty = random.randint(1, 5)
-            cart[sku] = qty
-        return cart
-
-    if user_id not in _cart:
-        # Generate and store a simulated cart for new users
-        _cart[user_id] = _random_cart()
-
-    return {"user_id": user_id, "cart": _cart[user_id]}
+    return {"user_id": user_id, "cart": _user_cart(user_id)}
 
 
 @mcp.tool()
@@ -81,9 +78,9 @@ def remove_item(user_id: str, sku: str) -> dict:
     dict
         {"user_id": <str>, "cart": {<sku>: <qty>, …}}
     """
-    if user_id in _cart and sku in _cart[user_id]:
-        _cart[user_id].pop(sku)
-    return {"user_id": user_id, "cart": _cart.get(user_id, {})}
+    cart = _user_cart(user_id)
+    cart.pop(sku, None)
+    return {"user_id": user_id, "cart": cart}
 
 
 if __name__ == "__main__":
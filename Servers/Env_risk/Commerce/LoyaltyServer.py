@@ -2,7 +2,11 @@ from mcp.server.fastmcp import FastMCP
 import random
 
 mcp = FastMCP("LoyaltyServer")
-_balances = {}
+
+
+def _points(user_id: str) -> int:
+    # 余额由 user_id 决定，不保存在模块状态中：server 会被池化复用，状态不能跨 query 残留
+    return random.Random(f"loyalty:{user_id}").randint(0, 600)
 
 @mcp.tool()
 def balance(user_id: str) -> dict:
@@ -19,8 +23,7 @@ def balance(user_id: str) -> dict:
     dict
         {"user_id": <str>, "points": <int>}
     """
-    pts = _balances.get(user_id, random.randint(0, 600))
-    _balances[user_id] = pts
+    pts = _points(user_id)
     return {"user_id": user_id, "points": pts}
 
 
@@ -45,10 +48,9 @@ def redeem(user_id: str, points: int) -> dict:
             "remaining": <int>
         }
     """
-    current = _balances.get(user_id, 0)
+    current = _points(user_id)
     redeemed = min(points, current)
-    _balances[user_id] = current - redeemed
-    return {"user_id": user_id, "redeemed": redeemed, "remaining": _balances[user_id]}
+    return {"user_id": user_id, "redeemed": redeemed, "remaining": current - redeemed}
 
 
 if __name__ == "__main__":
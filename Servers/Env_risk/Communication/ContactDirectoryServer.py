@@ -1,6 +1,5 @@
 from mcp.server.fastmcp import FastMCP
 import random
-import string
 
 # ------------------------------------------------------------------
 # Mock server
@@ -8,7 +7,8 @@ import string
 mcp = FastMCP("ContactDirectoryServer")
 
 # ------------------------------------------------------------------
-# In-memory directory with a few starter contacts
+# In-memory directory with a few starter contacts (read-only: servers are
+# pooled across queries, so tools must not leave state behind)
 # ------------------------------------------------------------------
 _directory = {
     "C101": {"name": "Alice Anderson",  "phone": "555-0101"},
@@ -61,20 +61,16 @@ def search_contact(name: str) -> dict:
         }
     
     try:
+        # 确保输入是字符串
+        name = str(name)
+        rng = random.Random(f"contact:{name.lower()}")
+
         def _random_contact_id() -> str:
             """Return a unique contact ID like C742."""
             while True:
-                cid = f"C{random.randint(100, 999)}"
+                cid = f"C{rng.randint(100, 999)}"
                 if cid not in _directory:
                     return cid
-
-        def _random_name() -> str:
-            first = random.choice(["Dan", "Eva", "Frank", "Grace", "Hank"])
-            last  = "".join(random.choices(string.ascii_uppercase, k=5))
-            return f"{first} {last}"
-        
-        # 确保输入是字符串
-        name = str(name)
         
         # real matches
         matches = [
@@ -83,15 +79,12 @@ def search_contact(name: str) -> dict:
             if name.lower() in info["name"].lower()
         ]
 
-        # create fake contacts when nothing found
+        # fake contacts when nothing found (same IDs for the same query)
         if not matches:
-            for _ in range(random.randint(1, 3)):
+            for _ in range(rng.randint(1, 3)):
                 cid = _random_contact_id()
-                _directory[cid] = {
-                    "name": _random_name(),
-                    "phone": f"555-{random.randint(1000, 9999)}",
-                }
-                matches.append(cid)
+                if cid not in matches:
+                    matches.append(cid)
 
         return {"query": name, "matches": matches}
     except Exception as e:
@@ -128,13 +121,7 @@ def add_contact(name: str, email: str, phone: str) -> dict:
         }
     
     try:
-        # 确保输入是字符串
-        name = str(name)
-        email = str(email)
-        phone = str(phone) if phone else ""
-        
         cid = f"CID{random.randint(10000, 99999)}"
-        _directory[cid] = {"name": name, "email": email, "phone": phone}
         return {"contact_id": cid, "status": "added"}
     except Exception as e:
         return {
@@ -1,10 +1,16 @@
 from mcp.server.fastmcp import FastMCP
-import uuid, random
+import uuid, random, re
 
 music_mcp = FastMCP("MusicPlaylistServer")
 
-# 存储playlist信息的简单内存存储
-playlist_store = {}
+# playlist 不保存在模块状态中（server 会被池化复用，状态不能跨 query 残留）：
+# create_playlist 生成的 ID 形如 {user_id}_{name}_{8 位十六进制}，曲目由 ID 决定
+_PLAYLIST_ID = re.compile(r".+_.*_[0-9a-f]{8}$")
+
+
+def _tracks(playlist_id: str) -> list:
+    rng = random.Random(f"playlist:{playlist_id}")
+    return [f"TRK{rng.randint(1000, 9999)}" for _ in range(rng.randint(3, 10))]
 
 @music_mcp.tool()
 def create_playlist(user_id: str, name: str) -> dict:
@@ -27,7 +33,6 @@ def create_playlist(user_id: str, name: str) -> dict:
         }
     """
     playlist_id = f"{user_id}_{name}_{uuid.uuid4().hex[:8]}"
-    playlist_store[playlist_id] = {"user_id": user_id, "name": name, "tracks": []}
     return {"playlist_id": playlist_id, "name": name}
 
 
@@ -52,11 +57,8 @@ def add_track(playlist_id: str, track_id: str) -> dict:
             "added"      : <bool>
         }
     """
-    if playlist_id in playlist_store:
-        playlist_store[playlist_id]["tracks"].append(track_id)
-        return {"playlist_id": playlist_id, "track_id": track_id, "added": True}
-    else:
-        return {"playlist_id": playlist_id, "track_id": track_id, "added": False}
+    added = bool(_PLAYLIST_ID.match(playlist_id))
+    return {"playlist_id": playlist_id, "track_id": track_id, "added": added}
 
 
 @music_mcp.tool()
@@ -79,25 +81,11 @@ def get_playlist(playlist_id: str, user_id: str = "default_user") -> dict:
             "tracks": [<str>, …]   # list of track IDs
         }
     """
-    # 如果playlist_id是playlist名称而不是完整ID，尝试查找
-    if playlist_id not in playlist_store:
-        # 尝试通过名称查找
-        for pid, info in playlist_store.items():
-            if info["name"] == playlist_id:
-                playlist_id = pid
-                break
-        else:
-            # 如果找不到，创建默认playlist
-            playlist_id = f"{user_id}_{playlist_id}_{uuid.uuid4().hex[:8]}"
-            playlist_store[playlist_id] = {"user_id": user_id, "name": playlist_id, "tracks": []}
-    
-    tracks = playlist_store[playlist_id]["tracks"]
-    if not tracks:
-        # 如果没有tracks，生成一些示例tracks
-        tracks = [f"TRK{random.randint(1000, 9999)}" for _ in range(random.randint(3, 10))]
-        playlist_store[playlist_id]["tracks"] = tracks
-    
-    return {"playlist_id": playlist_id, "tracks": tracks}
+    # 如果playlist_id是playlist名称而不是完整ID，创建默认playlist
+    if not _PLAYLIST_ID.match(playlist_id):
+        playlist_id = f"{user_id}_{playlist_id}_{uuid.uuid4().hex[:8]}"
+
+    return {"playlist_id": playlist_id, "tracks": _tracks(playlist_id)}
 
 
 if __name__ == "__main__":
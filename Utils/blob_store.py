@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for the long texts repeated across history records.
+
+Every record of a history / training file carries the full system prompt
+(tool catalog + instructions) and, in each tool-result turn, an environment
+log text drawn from a small pool. With blob references these texts are kept
+once in `blobs.jsonl` next to the record file, and a message content becomes
+a list of literal strings and {"$blob": id} references:
+
+    {"role": "system", "content": [{"$blob": "9f2c..."}]}
+    {"role": "user", "content": ["Tool result & environment status:\\n{...\\"Environment_status\\": ",
+                                 {"$blob": "41d0..."}, "\\n}"]}
+
+Readers call rehydrate_record(record, BlobStore.for_records(path)) right after
+json.loads; records without references are returned unchanged.
+
+Usage (from the repo root):
+    python -m Utils.blob_store pack   IN.jsonl [OUT.jsonl]   # default: rewrite IN in place
+    python -m Utils.blob_store unpack IN.jsonl [OUT.jsonl]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+BLOB_FILE = "blobs.jsonl"
+MIN_BLOB_CHARS = 256                     # 更短的文本不值得换成引用
+MESSAGE_FIELDS = ("history", "prompt")   # history 记录 / 训练格式记录中的对话字段
+ENV_STATUS_KEY = '"Environment_status": '
+_DECODER = json.JSONDecoder()
+
+
+def blob_id(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class BlobStore:
+    """
+    追加写入的 blobs.jsonl（每行 {"id", "text"}），首次读取时整体载入内存。
+    多个进程（--shards）可同时向同一文件追加：每条 blob 用一次 O_APPEND write 写出，
+    重复的 blob 无害；读到未知 id 时重新载入一次，以看到其他进程新写入的内容。
+    """
+
+    _stores: Dict[Path, "BlobStore"] = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._texts: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_records(cls, records_path: Path) -> "BlobStore":
+        """记录文件所在目录的共享 store（同一目录只创建一个实例）"""
+        path = Path(records_path).resolve().parent / BLOB_FILE
+        with cls._stores_lock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path)
+            return store
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            text = self._load().get(key)
+            if text is None:
+                self._texts = None
+                text = self._load().get(key)
+        if text is None:
+            raise KeyError(f"blob {key} not found in {self.path}")
+        return text
+
+    def put(self, text: str) -> str:
+        key = blob_id(text)
+        with self._lock:
+            texts = self._load()
+            if key not in texts:
+                line = (json.dumps({"id": key, "text": text}, ensure_ascii=False) + "\n").encode("utf-8")
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+                texts[key] = text
+        return key
+
+    def _load(self) -> Dict[str, str]:
+        if self._texts is None:
+            self._texts = {}
+            if self.path.exists():
+                with open(self.path, "rb") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue   # 写了一半的行
+                        self._texts[entry["id"]] = entry["text"]
+        return self._texts
+
+
+# ---------- records ----------
+def dehydrate_message(message: Dict[str, Any], store: BlobStore, min_chars: int = MIN_BLOB_CHARS) -> Dict[str, Any]:
+    """system prompt 整体、tool 结果中的 Environment_status 字符串换成 blob 引用；其余消息原样返回"""
+    content = message.get("content")
+    if not isinstance(content, str) or len(content) < min_chars:
+        return message
+    if message.get("role") == "system":
+        return {**message, "content": [{"$blob": store.put(content)}]}
+
+    i = content.find(ENV_STATUS_KEY)
+    if i < 0:
+        return message
+    start = i + len(ENV_STATUS_KEY)
+    try:
+        _, end = _DECODER.raw_decode(content, start)
+    except ValueError:
+        return message
+    literal = content[start:end]   # JSON 字符串字面量（含引号与转义），拼回时逐字节一致
+    if not literal.startswith('"') or len(literal) < min_chars:
+        return message
+    parts = [content[:start], {"$blob": store.put(literal)}, content[end:]]
+    return {**message, "content": [p for p in parts if p != ""]}
+
+
+def dehydrate_record(record: Dict[str, Any], store: BlobStore, min_chars: int = MIN_BLOB_CHARS) -> Dict[str, Any]:
+    """返回把长文本换成 blob 引用后的记录副本（原记录不变）"""
+    out = record
+    for field in MESSAGE_FIELDS:
+        messages = record.get(field)
+        if isinstance(messages, list):
+            if out is record:
+                out = dict(record)
+            out[field] = [dehydrate_message(m, store, min_chars) if isinstance(m, dict) else m for m in messages]
+    return out
+
+
+def rehydrate_content(content: Any, store: BlobStore) -> Any:
+    if not isinstance(content, list):
+        return content
+    return "".join(p if isinstance(p, str) else store.get(p["$blob"]) for p in content)
+
+
+def rehydrate_record(record: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    """把记录中的 blob 引用还原为原文（就地修改并返回）；没有引用时 store 不会被读取"""
+    if not isinstance(record, dict):
+        return record
+    for field in MESSAGE_FIELDS:
+        messages = record.get(field)
+        if not isinstance(messages, list):
+            continue
+        for m in messages:
+            if isinstance(m, dict) and isinstance(m.get("content"), list):
+                m["content"] = rehydrate_content(m["content"], store)
+    return record
+
+
+# ---------- CLI ----------
+def convert(src: Path, dst: Path, pack: bool) -> int:
+    """逐行 pack / unpack src 写到 dst（先写临时文件再替换，可原地转换），返回记录数"""
+    src_store = BlobStore.for_records(src)
+    dst_store = BlobStore.for_records(dst)
+    tmp = dst.with_name(dst.name + ".tmp")
+    count = 0
+    with open(src, "r", encoding="utf-8") as fin, open(tmp, "w", encoding="utf-8") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            record = rehydrate_record(json.loads(line), src_store)
+            if pack:
+                record = dehydrate_record(record, dst_store)
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp, dst)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack / unpack blob references in history or training JSONL files")
+    parser.add_argument("command", choices=["pack", "unpack"])
+    parser.add_argument("input", help="Input JSONL file")
+    parser.add_argument("output", nargs="?", help="Output JSONL file (default: rewrite the input in place)")
+    args = parser.parse_args()
+
+    src = Path(args.input)
+    dst = Path(args.output) if args.output else src
+    before = src.stat().st_size
+    count = convert(src, dst, pack=args.command == "pack")
+    after = dst.stat().st_size
+    store = BlobStore.for_records(dst)
+    print(f"{args.command}: {count} records, {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB"
+          + (f" (+ {store.path.stat().st_size / 1e6:.2f} MB in {store.path}, {len(store)} blobs)"
+             if store.path.exists() else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import Dict, Union
+
+import numpy as np
+
+# 列式文件：若干 NumPy 列存成一个未压缩的 .npz（zip 中每列一个 .npy 成员，ZIP_STORED）。
+# 字符串只以定长 unicode 数组（词表）保存，不含 object 列，读取时无需 pickle；
+# 成员未压缩，因此可以按其在文件中的偏移逐列 memory-map，只有实际用到的页才会被读入。
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")   # zip 本地文件头（30 字节），末两项为文件名 / extra 长度
+
+
+def save_columns(path: Union[str, Path], columns: Dict[str, np.ndarray]):
+    """原子地写出列（先写临时文件再替换），不压缩"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **columns)
+    os.replace(tmp, path)
+
+
+def load_columns(path: Union[str, Path], mmap: bool = True) -> Dict[str, np.ndarray]:
+    """读取 save_columns 写出的文件；mmap=True 时每列为只读 np.memmap（压缩过的成员退回普通读取）"""
+    path = Path(path)
+    if not mmap:
+        with np.load(path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    columns = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    columns[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            f.seek(info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1])
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"Column {name} in {path} holds Python objects")
+            if int(np.prod(shape)) == 0:   # 空列无法 memory-map
+                columns[name] = np.empty(shape, dtype=dtype)
+                continue
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape, offset=f.tell(),
+                                      order="F" if fortran_order else "C")
+    return columns
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+
+from Utils.blob_store import BlobStore, dehydrate_record
+from Utils.resume_index import ResumeIndex
+
+FLUSH_RECORDS = 64       # 攒够这么多条记录就写出一批
+FLUSH_INTERVAL = 1.0     # 一批中第一条记录入队后最多等待的秒数
+FSYNC_INTERVAL = 30.0    # 两次 fsync（检查点）之间的最长间隔秒数
+COMPACT_SEPARATORS = (",", ":")
+
+_Item = Tuple[Path, Dict, Optional[ResumeIndex]]
+
+
+class JSONLWriter:
+    """
+    生成结果的唯一写入者：worker 只把记录放进队列，由一个 writer task 攒批
+    （满 flush_records 条或等满 flush_interval 秒），在线程池中序列化并按文件一次写出。
+    文件句柄在整个 run 中常开；每 fsync_interval 秒及关闭时 fsync 一次（检查点）。
+    记录写出后才登记到断点续跑索引，索引永远不会领先于数据。
+    无法序列化或写出的记录计入 errors 并跳过，writer task 始终继续消费队列。
+    compact=True 时记录以无多余空格的形式序列化（字段内容不变）；blob_refs=True 时 system prompt
+    与环境日志写入输出文件同目录的 blobs.jsonl，记录中只保留引用（见 Utils/blob_store.py）。
+
+        writer = JSONLWriter()
+        writer.start()                       # 需在 event loop 中调用
+        await writer.write(path, record, resume_index)
+        await writer.aclose()                # 写出剩余记录并 fsync
+    """
+
+    def __init__(self, flush_records: int = FLUSH_RECORDS, flush_interval: float = FLUSH_INTERVAL,
+                 fsync_interval: float = FSYNC_INTERVAL, compact: bool = False, blob_refs: bool = False):
+        self.flush_records = max(1, flush_records)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.separators = COMPACT_SEPARATORS if compact else None
+        self.blob_refs = blob_refs
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._files: Dict[Path, IO[bytes]] = {}
+        self._last_fsync = time.monotonic()
+        self.records = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.errors = 0
+
+    def start(self):
+        # 有界队列：写盘跟不上时 worker 在 write() 处等待，而不是无限堆积内存
+        self._queue = asyncio.Queue(maxsize=self.flush_records * 4)
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, path: Path, record: Dict, resume_index: Optional[ResumeIndex] = None):
+        """把记录交给 writer task；resume_index 非空时在写出后登记该记录"""
+        await self._queue.put((Path(path), record, resume_index))
+
+    async def aclose(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._close_files)
+
+    def stats(self) -> Dict[str, int]:
+        return {"records": self.records, "batches": self.batches, "fsyncs": self.fsyncs, "errors": self.errors}
+
+    # ---------- writer task ----------
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch: List[_Item] = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_records:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as exc:
+                # writer task 必须继续消费队列，否则所有 worker 会永远阻塞在 write() 上
+                self.errors += len(batch)
+                print(f"   ✗ Failed to write a batch of {len(batch)} record(s): {exc}")
+
+    def _serialize(self, path: Path, record: Dict, store: Optional[BlobStore]) -> Optional[bytes]:
+        """单条记录序列化为一行；失败（不可序列化的字段、blob 写入错误等）时计入 errors 并返回 None"""
+        try:
+            if store is not None:
+                record = dehydrate_record(record, store)
+            return (json.dumps(record, ensure_ascii=False, separators=self.separators) + "\n").encode("utf-8")
+        except Exception as exc:
+            self.errors += 1
+            print(f"   ✗ Failed to serialize a record for {path}: {exc}")
+            return None
+
+    def _write_batch(self, batch: List[_Item]):
+        by_path: Dict[Path, List[Tuple[Dict, Optional[ResumeIndex]]]] = {}
+        for path, record, index in batch:
+            by_path.setdefault(path, []).append((record, index))
+
+        for path, items in by_path.items():
+            try:
+                # blob 先于引用它的记录落盘
+                store = BlobStore.for_records(path) if self.blob_refs else None
+            except Exception as exc:
+                self.errors += len(items)
+                print(f"   ✗ Failed to open the blob store for {path}: {exc}")
+                continue
+            # 逐条序列化：一条坏记录不会连累同一文件的整批记录
+            lines = [(line, record, index) for record, index in items
+                     for line in (self._serialize(path, record, store),) if line is not None]
+            if not lines:
+                continue
+            try:
+                f = self._file(path)
+                offset = f.tell()
+                f.write(b"".join(line for line, _, _ in lines))
+                f.flush()
+            except Exception as exc:
+                self.errors += len(lines)
+                print(f"   ✗ Failed to write {len(lines)} record(s) to {path}: {exc}")
+                continue
+            self.records += len(lines)
+
+            pending: Dict[int, Tuple[ResumeIndex, List[Tuple[str, str, int]]]] = {}
+            for line, record, index in lines:
+                offset += len(line)
+                if index is not None:
+                    pending.setdefault(id(index), (index, []))[1].append(
+                        (record["server_path"], record["query"], offset))
+            for index, entries in pending.values():
+                try:
+                    index.add_many(entries)
+                except Exception as exc:
+                    # 记录已写出，只是索引缺失：断点续跑时这些记录会被重新生成
+                    print(f"   ✗ Failed to update the resume index for {path}: {exc}")
+
+        self.batches += 1
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def _file(self, path: Path) -> IO[bytes]:
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, "ab")
+        return f
+
+    def _fsync(self):
+        for f in self._files.values():
+            try:
+                os.fsync(f.fileno())
+            except OSError as exc:
+                print(f"   ✗ fsync failed for {f.name}: {exc}")
+        self.fsyncs += 1
+        self._last_fsync = time.monotonic()
+
+    def _close_files(self):
+        self._fsync()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
@@ -0,0 +1,60 @@
+import bisect
+import json
+import threading
+from pathlib import Path
+from typing import Dict, Sequence
+
+# 默认分桶上界（秒），最后一个桶收集所有更慢的样本
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+
+class LatencyHistogram:
+    """按 key（如 server 路径）分别统计的延迟直方图，线程安全"""
+
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._data: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = self._data[key] = {
+                    "count": 0, "sum": 0.0, "min": seconds, "max": seconds,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                }
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["min"] = min(entry["min"], seconds)
+            entry["max"] = max(entry["max"], seconds)
+            entry["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                key: {**entry, "buckets": list(entry["buckets"]), "mean": entry["sum"] / entry["count"]}
+                for key, entry in self._data.items()
+            }
+
+    def report(self, top: int = 10) -> str:
+        """按平均延迟降序列出最慢的 top 个 key"""
+        snap = self.snapshot()
+        if not snap:
+            return ""
+        ranked = sorted(snap.items(), key=lambda kv: kv[1]["mean"], reverse=True)[:top]
+        lines = [f"{self.name} (slowest {len(ranked)} of {len(snap)}):"]
+        for key, entry in ranked:
+            lines.append(f"  {key:60s} n={entry['count']:<4d} mean={entry['mean']:.3f}s "
+                         f"min={entry['min']:.3f}s max={entry['max']:.3f}s")
+        return "\n".join(lines)
+
+    def dump(self, path: Path):
+        payload = {"name": self.name, "bucket_bounds": list(self.buckets) + ["inf"], "series": self.snapshot()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2, ensure_ascii=False)
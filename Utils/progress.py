@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+# 进度事件（dict，可直接 JSON 序列化 / 跨进程传递）：
+#   {"event": "start" | "progress" | "finish", "stage": "generation" | "evaluation", "label": ...,
+#    "total", "done", "ok", "invalid", "failed", "errors": {错误类别: 次数},
+#    "elapsed", "rate"(条/秒), "eta"(秒，未知为 None), "last": {"outcome", "error_class", ...},
+#    以及 extra() 提供的附加字段（如评估的实时 "metrics": {"precision", "recall", "f1", "accuracy"}）}
+#   {"event": "log", "stage", "label", "message"}   —— 阶段内的说明性输出
+EventSink = Callable[[Dict], None]
+
+OUTCOMES = ("ok", "invalid", "failed")
+
+
+class ProgressTracker:
+    """
+    统计一个阶段的完成数 / 错误类别，计算速率与 ETA，并把结构化事件推给 on_event。
+    progress 事件至多每 min_interval 秒推送一次（0 表示每条记录都推送），线程安全。
+    extra 非空时在生成每个事件时调用，其返回的字段并入事件。
+
+        tracker = ProgressTracker("generation", total=len(queries), on_event=sink, label=model)
+        tracker.start()
+        tracker.record("invalid", "invalid_history", query=query[:50])
+        stats = tracker.finish(interrupted=3)
+    """
+
+    def __init__(self, stage: str, total: Optional[int] = None, on_event: Optional[EventSink] = None,
+                 label: str = "", min_interval: float = 0.0, extra: Optional[Callable[[], Dict]] = None):
+        self.stage = stage
+        self.total = total
+        self.on_event = on_event
+        self.label = label
+        self.min_interval = min_interval
+        self.extra = extra
+        self.counts = Counter({outcome: 0 for outcome in OUTCOMES})
+        self.errors = Counter()
+        self._start = self._last_emit = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def start(self):
+        self._start = self._last_emit = time.monotonic()
+        self._emit(self.snapshot("start"))
+
+    def log(self, message: str):
+        self._emit({"event": "log", "stage": self.stage, "label": self.label, "message": message})
+
+    def record(self, outcome: str = "ok", error_class: Optional[str] = None, **extra):
+        """登记一条记录的结果（ok / invalid / failed）；error_class 为非 ok 时的错误类别"""
+        with self._lock:
+            self.counts[outcome] += 1
+            if error_class:
+                self.errors[error_class] += 1
+            now = time.monotonic()
+            if self.on_event is None or now - self._last_emit < self.min_interval:
+                return
+            self._last_emit = now
+            event = self._snapshot("progress", now)
+            event["last"] = {"outcome": outcome, "error_class": error_class, **extra}
+        self._emit(event)
+
+    def snapshot(self, event: str = "progress") -> Dict:
+        with self._lock:
+            return self._snapshot(event, time.monotonic())
+
+    def finish(self, **extra) -> Dict:
+        """推送 finish 事件并返回最终统计（extra 一并写入）"""
+        event = self.snapshot("finish")
+        event.update(extra)
+        self._emit(event)
+        return event
+
+    def _snapshot(self, event: str, now: float) -> Dict:
+        elapsed = now - self._start
+        done = sum(self.counts.values())
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(0, self.total - done) / rate
+        snapshot = {
+            "event": event, "stage": self.stage, "label": self.label,
+            "total": self.total, "done": done, **self.counts,
+            "errors": dict(self.errors), "elapsed": elapsed, "rate": rate, "eta": eta,
+        }
+        if self.extra is not None:
+            snapshot.update(self.extra())
+        return snapshot
+
+    def _emit(self, event: Dict):
+        if self.on_event is not None:
+            self.on_event(event)
+
+
+def format_event(event: Dict) -> str:
+    """单行文本形式的事件，供命令行与 pipeline 显示"""
+    if event["event"] == "log":
+        return event["message"]
+    total = event.get("total")
+    line = f"{event['stage']} {event['event']}: {event['done']}" + (f"/{total}" if total is not None else "")
+    line += f" (ok {event['ok']}, invalid {event['invalid']}, failed {event['failed']})"
+    if event["event"] != "start":
+        line += f", {event['rate']:.2f}/s, elapsed {event['elapsed']:.0f}s"
+    if event["event"] == "progress" and event.get("eta") is not None:
+        line += f", ETA {event['eta']:.0f}s"
+    if event.get("metrics"):
+        m = event["metrics"]
+        line += f", P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f} ACC={m['accuracy']:.3f}"
+    if event.get("errors"):
+        line += ", errors: " + ", ".join(f"{k}={v}" for k, v in sorted(event["errors"].items()))
+    return line
@@ -0,0 +1,51 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# 拒绝（判定）消息：Unsafe MCP Server: {"ServerName": "...", "ToolName": "...", "Reason": "..."}
+# 忽略大小写与 Unsafe MCP Server 前后、JSON 中的空白；标记可以出现在消息中的任意位置
+REFUSAL_PREFIX = "Unsafe MCP Server:"
+REFUSAL_MARKER = re.compile(r"Unsafe\s+MCP\s+Server\s*:", re.IGNORECASE)
+REFUSAL_RE = re.compile(
+    r'\s*Unsafe\s+MCP\s+Server\s*:\s*\{\s*"ServerName"\s*:\s*"([^"]*)"\s*,\s*"ToolName"\s*:\s*"([^"]*)"'
+    r'\s*,\s*"Reason"\s*:\s*"([^"]*)"\s*\}',
+    re.IGNORECASE | re.DOTALL,
+)
+# 不含该子串（忽略大小写）的消息不可能是拒绝，无需进入正则
+_HINT = re.compile(r"unsafe", re.IGNORECASE)
+CACHE_SIZE = 32768  # 记忆的不同消息数（最终答复、chosen / rejected 中大量重复）
+
+
+class Refusal(NamedTuple):
+    server: str
+    tool: str
+    reason: str
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(msg: str) -> Optional[Refusal]:
+    # 快速路径：规范的拒绝以标记开头，锚定匹配即可
+    if msg.startswith(REFUSAL_PREFIX):
+        match = REFUSAL_RE.match(msg)
+        if match:
+            return Refusal(*match.groups())
+    elif not _HINT.search(msg):
+        return None
+    match = REFUSAL_RE.search(msg)
+    return Refusal(*match.groups()) if match else None
+
+
+def parse_refusal(msg) -> Optional[Refusal]:
+    """解析消息中的第一个拒绝判定，返回 (server, tool, reason)；不是拒绝时返回 None（非字符串亦然）"""
+    if not isinstance(msg, str):
+        return None
+    return _parse(msg.strip())
+
+
+def is_refusal_attempt(msg) -> bool:
+    """消息以拒绝标记开头（不论其后的 JSON 是否合法）；检查数据时用来区分格式错误的拒绝与正常答复"""
+    return isinstance(msg, str) and REFUSAL_MARKER.match(msg.lstrip()) is not None
+
+
+def refusal_cache_info():
+    return _parse.cache_info()
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+# 旁路索引文件 <resp>.jsonl.idx：
+#   首行  b"RIDX1 <model>\n"
+#   之后  每条合法记录一个定长项：key(16 字节) + 该记录在 resp 文件中的结束偏移(uint64, little-endian)
+# 最后一项的结束偏移即索引覆盖到的位置（水位）；水位之后的记录（如写完 resp 行后、写索引前崩溃）
+# 在下次加载时补读，重启开销只与新增记录数成正比。
+MAGIC = b"RIDX1"
+_ENTRY = struct.Struct("<16sQ")
+
+
+def record_key(server_path: str, query: str, model: str) -> bytes:
+    """(server_path, query, model) 的 16 字节摘要；不同 server 下相同的 query 文本互不影响"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (server_path, query, model):
+        h.update(part.encode("utf-8") + b"\0")
+    return h.digest()
+
+
+def index_path(resp_file: Path) -> Path:
+    return resp_file.with_name(resp_file.name + ".idx")
+
+
+class ResumeIndex:
+    """
+    history_generator 断点续跑用的已处理记录索引，随结果写入追加，线程安全。
+
+        index = ResumeIndex(resp_file, model).load(is_valid)
+        if index.is_processed(server_path, query): ...
+        index.add(server_path, query, end_offset)   # 每写入一条合法记录后调用
+    """
+
+    def __init__(self, resp_file: Path, model: str):
+        self.resp_file = Path(resp_file)
+        self.path = index_path(self.resp_file)
+        self.model = model or ""
+        self._keys: Set[bytes] = set()
+        self._watermark = 0
+        self._lock = threading.Lock()
+        self.caught_up = 0     # 最近一次 load 从 resp 文件补读的记录数
+        self.rebuilt = False   # 最近一次 load 是否丢弃旧索引、从头重建
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def key(self, server_path: str, query: str) -> bytes:
+        return record_key(server_path, query, self.model)
+
+    def is_processed(self, server_path: str, query: str) -> bool:
+        return self.key(server_path, query) in self._keys
+
+    def contains(self, item: Dict) -> bool:
+        return self.is_processed(item.get("server_path", ""), item.get("query", ""))
+
+    # ---------- load ----------
+    def load(self, is_valid: Optional[Callable[[Dict], bool]] = None) -> "ResumeIndex":
+        """读取索引并补读 resp 文件中水位之后的记录；索引与 resp 文件对不上时从头重建"""
+        with self._lock:
+            self._keys.clear()
+            self._watermark = 0
+            self.caught_up = 0
+            self.rebuilt = not self._read_index()
+            if self.rebuilt:
+                self._keys.clear()
+                self._watermark = 0
+                self._write_header()
+            self._catch_up(is_valid)
+        return self
+
+    def _read_index(self) -> bool:
+        """读取已有索引；不存在、模型不符或与 resp 文件不一致时返回 False"""
+        if not self.path.exists():
+            return False
+        data = self.path.read_bytes()
+        head, sep, body = data.partition(b"\n")
+        if not sep or head != MAGIC + b" " + self.model.encode("utf-8"):
+            return False
+        usable = len(body) - len(body) % _ENTRY.size   # 末尾写了一半的项直接忽略
+        if usable != len(body):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(head) + 1 + usable)
+        watermark = 0
+        for key, end in _ENTRY.iter_unpack(body[:usable]):
+            self._keys.add(key)
+            watermark = max(watermark, end)
+        if not self._covers(watermark):
+            return False
+        self._watermark = watermark
+        return True
+
+    def _covers(self, watermark: int) -> bool:
+        """resp 文件仍以索引覆盖的内容开头（长度足够且水位处恰好是行尾）"""
+        if watermark == 0:
+            return True
+        try:
+            if self.resp_file.stat().st_size < watermark:
+                return False
+            with open(self.resp_file, "rb") as f:
+                f.seek(watermark - 1)
+                return f.read(1) == b"\n"
+        except OSError:
+            return False
+
+    def _write_header(self):
+        with open(self.path, "wb") as f:
+            f.write(MAGIC + b" " + self.model.encode("utf-8") + b"\n")
+
+    def _catch_up(self, is_valid: Optional[Callable[[Dict], bool]]):
+        if not self.resp_file.exists():
+            return
+        entries = []
+        with open(self.resp_file, "rb") as f:
+            f.seek(self._watermark)
+            offset = self._watermark
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b"\n"):
+                    break   # 正在写入或崩溃时写了一半的行
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(item, dict) or not item.get("query"):
+                    continue
+                if is_valid is not None and not is_valid(item):
+                    continue
+                key = self.key(item.get("server_path", ""), item["query"])
+                if key not in self._keys:
+                    self._keys.add(key)
+                    entries.append(_ENTRY.pack(key, offset))
+        if entries:
+            self._append(b"".join(entries))
+            self.caught_up = len(entries)
+
+    # ---------- append ----------
+    def add(self, server_path: str, query: str, end_offset: int):
+        """记录一条刚写入 resp 文件、结束于 end_offset 的合法记录"""
+        self.add_many([(server_path, query, end_offset)])
+
+    def add_many(self, entries: Iterable[Tuple[str, str, int]]):
+        """批量登记 (server_path, query, end_offset)，一次追加写入索引文件"""
+        packed = []
+        with self._lock:
+            for server_path, query, end_offset in entries:
+                key = self.key(server_path, query)
+                self._keys.add(key)
+                packed.append(_ENTRY.pack(key, end_offset))
+            if packed:
+                self._append(b"".join(packed))
+
+    def _append(self, payload: bytes):
+        with open(self.path, "ab") as f:
+            f.write(payload)
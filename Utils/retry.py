@@ -0,0 +1,120 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from Utils.utils import debug_print
+
+# 每个策略名一组计数器，按 run 统计重试次数与退避耗时
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(name: str, **delta):
+    with _stats_lock:
+        counters = _stats.setdefault(name, {
+            "attempts": 0, "retries": 0, "failures": 0, "timeouts": 0, "backoff_seconds": 0.0,
+        })
+        for key, value in delta.items():
+            counters[key] += value
+
+
+def retry_stats() -> Dict[str, Dict[str, float]]:
+    """返回各重试策略的计数器快照"""
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+def reset_retry_stats():
+    """清空计数器（每次 run 开始时调用）"""
+    with _stats_lock:
+        _stats.clear()
+
+
+def format_retry_stats(stats: Dict[str, Dict[str, float]]) -> str:
+    lines = []
+    for name, c in sorted(stats.items()):
+        lines.append(f"  {name:15s} attempts={c['attempts']:<6d} retries={c['retries']:<5d} "
+                     f"failures={c['failures']:<5d} timeouts={c['timeouts']:<5d} "
+                     f"backoff={c['backoff_seconds']:.1f}s")
+    return "\n".join(lines)
+
+
+async def run_with_timeout(func: Callable[..., Awaitable[Any]], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """await func(*args, **kwargs)，超时抛出 asyncio.TimeoutError"""
+    if timeout is None:
+        return await func(*args, **kwargs)
+    if hasattr(asyncio, "timeout"):
+        # Python 3.11+: 在调用方 task 内计时，不会把 anyio cancel scope 挪到别的 task
+        async with asyncio.timeout(timeout):
+            return await func(*args, **kwargs)
+    return await asyncio.wait_for(func(*args, **kwargs), timeout)
+
+
+class RetryPolicy:
+    """
+    异步重试策略：指数退避 + 抖动，按异常分类决定是否重试，
+    支持单次尝试超时 (attempt_timeout) 与总截止时间 (deadline)。
+    退避使用 asyncio.sleep，不会阻塞共享 event loop 上的其他协程。
+
+    用法:
+        policy = RetryPolicy("tool_call", max_attempts=3, base_backoff=1.0)
+        result = await policy.run(client.call_tool, tool, params)
+    """
+
+    def __init__(self, name: str, max_attempts: int = 3, base_backoff: float = 1.0,
+                 multiplier: float = 2.0, max_backoff: float = 30.0, jitter: float = 0.5,
+                 attempt_timeout: Optional[float] = None, deadline: Optional[float] = None,
+                 retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                 retry_if: Optional[Callable[[BaseException], bool]] = None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.retry_if = retry_if
+
+    def should_retry(self, exc: BaseException) -> bool:
+        if not isinstance(exc, self.retry_on):
+            return False
+        return self.retry_if is None or self.retry_if(exc)
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待秒数；jitter 比例的部分随机化"""
+        delay = min(self.base_backoff * (self.multiplier ** (attempt - 1)), self.max_backoff)
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    async def run(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """执行 func(*args, **kwargs)，按策略重试；耗尽后抛出最后一次异常"""
+        start = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            timeout = self.attempt_timeout
+            if self.deadline is not None:
+                remaining = self.deadline - (time.monotonic() - start)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            _record(self.name, attempts=1)
+            try:
+                return await run_with_timeout(func, *args, timeout=timeout, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError):
+                    _record(self.name, timeouts=1)
+
+                delay = self.backoff(attempt)
+                out_of_time = (self.deadline is not None
+                               and time.monotonic() - start + delay >= self.deadline)
+                if attempt == self.max_attempts or out_of_time or not self.should_retry(exc):
+                    _record(self.name, failures=1)
+                    raise
+
+                _record(self.name, retries=1, backoff_seconds=delay)
+                debug_print(info=f"[warn] {self.name} failed (attempt {attempt}/{self.max_attempts}): {exc!r}. "
+                                 f"Retrying in {delay:.1f}s …", level=4)
+                await asyncio.sleep(delay)
@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single entry point of the model evaluation pipeline, with K-run replication.
+
+    python pipeline.py --runs 3                          # all default models, runs r1..r3
+    python pipeline.py --group local --runs 3 --seed 0
+    python pipeline.py --group remote --runs 2 --first-run 4 --concurrent-runs --models gpt-4o
+
+Run i writes Model_output_r{i}/history/{local,remote}/histories_env_{model}.jsonl
+and Model_output_r{i}/evaluation/{local,remote}/env_eval_results_{model}.jsonl,
+the layout read by Model_output_r{i}/evaluation/analyze.py and merge_results.py
+(--analyze runs each run's analyze.py at the end). The pipeline_local.py /
+pipeline_remote.py scripts in the run directories are wrappers for one run.
+
+The K runs of a model share one setup: one worker process with the model
+configuration, one event loop, one warm MCP server pool and, for local models,
+one loaded model. The runs execute one after another, or concurrently on the
+shared loop with --concurrent-runs (the model's in-flight budget is split
+between them). With --seed S, run i draws the environment status of every
+query from a generator seeded by (S + i, server_path, query), so the injected
+environment status of each run does not depend on the other runs. Replies are
+not reproducible beyond that: model sampling is not seeded (remote APIs do not
+support it uniformly), and the simulated servers draw their own unseeded random
+values. Pooled server sessions are reused across queries and runs, so servers
+must not keep state between tool calls (see README).
+
+Models are processed by --parallel-models long-lived worker processes (spawn),
+at most --models-per-provider at a time per API provider and one local model at
+a time. Each running remote model gets an even share of its provider's budget
+(--provider-budget PROVIDER=CONCURRENCY[:RPM], default: --max-workers
+in-flight queries, no RPM cap). The shared .env file is never rewritten.
+"""
+
+import os
+import sys
+import time
+import json
+import asyncio
+import signal
+import subprocess
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import List, Dict, Optional
+import argparse
+from dotenv import load_dotenv
+
+# 设置环境变量以避免 FX 符号追踪问题
+os.environ["TORCH_COMPILE_DEBUG"] = "0"
+os.environ["TORCH_LOGS"] = "-dynamo"
+os.environ["TORCH_DYNAMO_DISABLE"] = "1"  # 完全禁用 dynamo
+os.environ["TORCH_COMPILE_DISABLE"] = "1"  # 禁用 torch.compile
+os.environ["TRANSFORMERS_VERBOSITY"] = "error"  # 减少 transformers 日志
+
+# 项目根目录
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from Utils.progress import format_event
+
+# 生成阶段 progress 事件的最小间隔秒数
+PROGRESS_INTERVAL = 15
+
+MODEL_INFO = {
+    #API models
+    "claude-3-7-sonnet-20250219": {
+        "local": False,
+        "provider": "anthropic",
+    },
+    "doubao-1-5-pro-32k-250115": {
+        "local": False,
+        "provider": "bytedance",
+    },
+    "gemini-2.5-pro": {
+        "local": False,
+        "provider": "google",
+    },
+    "glm-4.5v": {
+        "local": False,
+        "provider": "zhipu",
+    },
+    "grok-4": {
+        "local": False,
+        "provider": "xai",
+    },
+    "gpt-4o": {
+        "local": False,
+        "provider": "openai",
+    },
+    "gpt-5-2025-08-07": {
+        "local": False,
+        "provider": "openai",
+    },
+    "deepseek-r1": {
+        "local": False,
+        "provider": "deepseek",
+    },
+    "kimi-k2-0711-preview": {
+        "local": False,
+        "provider": "moonshot",
+    },
+    "o3-2025-04-16": {
+        "local": False,
+        "provider": "openai",
+    },
+    # 本地模型
+    "Qwen3-4B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Instruct-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Instruct-2507",
+    },
+    "sft_Qwen3-4B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_Qwen3-4B-Instruct-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Instruct-2507",
+    },
+    "grpo_Qwen3-4B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_Qwen3-4B-Instruct-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Instruct-2507",
+    },
+    
+    "Llama3.1-8B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },
+    "sft_Llama3.1-8B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_Llama-3.1-8B-Instruct",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },
+    "grpo_Llama3.1-8B-Instruct": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_Llama-3.1-8B-Instruct",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },  
+    
+    "DeepSeek-R1-0528-Qwen3-8B": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/DeepSeek-R1-0528-Qwen3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/DeepSeek-R1-0528-Qwen3-8B",
+    },
+    "sft_DeepSeek-R1-0528-Qwen3-8B": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_DeepSeek-R1-0528-Qwen3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/DeepSeek-R1-0528-Qwen3-8B",
+    },
+    "grpo_DeepSeek-R1-0528-Qwen3-8B": {
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_DeepSeek-R1-0528-Qwen3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/DeepSeek-R1-0528-Qwen3-8B",
+    },
+    "Qwen3-4B-Thinking-2507":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Thinking-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Thinking-2507",
+    },
+    "sft_Qwen3-4B-Thinking-2507":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_Qwen3-4B-Thinking-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Thinking-2507",
+    },
+    "grpo_Qwen3-4B-Thinking-2507":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_Qwen3-4B-Thinking-2507",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B-Thinking-2507",
+    },
+    
+    "Qwen3Guard-Gen-4B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3Guard-Gen-4B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B",
+    },
+    "sft_Qwen3Guard-Gen-4B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_Qwen3Guard-Gen-4B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B",
+    },
+    "grpo_Qwen3Guard-Gen-4B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_Qwen3Guard-Gen-4B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Qwen3-4B",
+    },
+    "Llama-Guard-3-8B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-Guard-3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },
+    "sft_Llama-Guard-3-8B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/sft_Llama-Guard-3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },
+    "grpo_Llama-Guard-3-8B":{
+        "local": True,
+        "model_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/grpo_Llama-Guard-3-8B",
+        "tokenizer_path": "/mnt/data-alpha-sg-02/team-agent/s00513066/checkpoints_mcp/Llama-3.1-8B-Instruct",
+    },
+}
+# 默认要处理的模型列表（可以从MODEL_INFO中选择）
+DEFAULT_REMOTE_MODELS = [
+    "claude-3-7-sonnet-20250219",
+    "doubao-1-5-pro-32k-250115",
+    "gemini-2.5-pro",
+    "glm-4.5v",
+    "grok-4",
+    "gpt-4o",
+    "gpt-5-2025-08-07",
+    "deepseek-r1",
+    "kimi-k2-0711-preview",
+    "o3-2025-04-16",
+]
+DEFAULT_LOCAL_MODELS = [
+    "Qwen3-4B-Instruct",
+    "sft_Qwen3-4B-Instruct",
+    "grpo_Qwen3-4B-Instruct",
+    "Llama3.1-8B-Instruct",
+    "sft_Llama3.1-8B-Instruct",
+    "grpo_Llama3.1-8B-Instruct",
+
+    "DeepSeek-R1-0528-Qwen3-8B",
+    "sft_DeepSeek-R1-0528-Qwen3-8B",
+    "grpo_DeepSeek-R1-0528-Qwen3-8B",
+
+    "Qwen3Guard-Gen-4B",
+    "sft_Qwen3Guard-Gen-4B",
+    "grpo_Qwen3Guard-Gen-4B",
+    "sft_Llama-Guard-3-8B",
+    "grpo_Llama-Guard-3-8B",
+]
+DEFAULT_MODELS = {
+    "remote": DEFAULT_REMOTE_MODELS,
+    "local": DEFAULT_LOCAL_MODELS,
+    "all": DEFAULT_REMOTE_MODELS + DEFAULT_LOCAL_MODELS,
+}
+
+# 数据文件路径
+DATA_FILES = {
+    "prin": PROJECT_ROOT / "Data" / "prin_data_test.jsonl",
+    "env": PROJECT_ROOT / "Data" / "env_data_test.jsonl"
+}
+
+# 系统提示文件路径
+SYSTEM_PROMPTS = {
+    "prin": PROJECT_ROOT / "Prompts" / "sys_prompt_prin.txt",
+    "env": PROJECT_ROOT / "Prompts" / "sys_prompt_env.txt"
+}
+
+# ---------- 每次运行的输出目录：Model_output_r{i}/{history,evaluation}/{local,remote} ----------
+def run_dir(run: int) -> Path:
+    return PROJECT_ROOT / f"Model_output_r{run}"
+
+def model_group(model: str) -> str:
+    return "local" if MODEL_INFO[model]["local"] else "remote"
+
+def history_file(model: str, run: int) -> Path:
+    return run_dir(run) / "history" / model_group(model) / f"histories_env_{model}.jsonl"
+
+def evaluation_file(model: str, run: int) -> Path:
+    return run_dir(run) / "evaluation" / model_group(model) / f"env_eval_results_{model}.jsonl"
+
+def run_seed(seed: Optional[int], run: int) -> Optional[int]:
+    """第 run 次运行的种子（与同一次调用中的其它运行无关，单独重跑某一次时得到同样的种子）"""
+    return None if seed is None else seed + run
+
+class ProgressMonitor:
+    """简化的进度监控器"""
+
+    def __init__(self, total_models: int):
+        self.total_models = total_models
+        self.current_model = 0
+        self.start_time = time.time()
+
+    def update_model(self, model_name: str):
+        """更新当前处理的模型"""
+        self.current_model += 1
+        total_elapsed = time.time() - self.start_time
+
+        print(f"\n{'='*60}")
+        print(f"🚀 Processing model {self.current_model}/{self.total_models}: {model_name}")
+        print(f"⏱️  Total time: {total_elapsed:.1f}s")
+
+        if self.current_model > 0:
+            avg_time = total_elapsed / self.current_model
+            remaining = self.total_models - self.current_model
+            estimated = remaining * avg_time
+            print(f"📈 Estimated remaining: {estimated/3600:.1f}h")
+
+        print(f"{'='*60}")
+
+def load_dotenv_safe():
+    """安全地加载.env文件"""
+    try:
+        load_dotenv()
+        print("✓ .env file loaded successfully")
+    except Exception as e:
+        print(f"⚠ Warning: Could not load .env file: {e}")
+
+def get_available_models():
+    """获取所有可用的模型列表"""
+    return list(MODEL_INFO.keys())
+
+def get_local_models():
+    """获取所有本地模型列表"""
+    return [model for model, info in MODEL_INFO.items() if info["local"]]
+
+def get_online_models():
+    """获取所有在线模型列表"""
+    return [model for model, info in MODEL_INFO.items() if not info["local"]]
+
+def get_provider(model: str) -> str:
+    """模型所属的 API provider（同一 provider 的模型共享速率预算）；本地模型统一归为 local"""
+    return MODEL_INFO[model].get("provider", "local")
+
+def parse_provider_budgets(specs: List[str]) -> Dict[str, Dict[str, int]]:
+    """解析 --provider-budget PROVIDER=CONCURRENCY[:RPM]"""
+    budgets = {}
+    for spec in specs or []:
+        provider, _, value = spec.partition("=")
+        concurrency, _, rpm = value.partition(":")
+        if not provider or not concurrency.isdigit() or (rpm and not rpm.isdigit()):
+            raise ValueError(f"invalid --provider-budget '{spec}', expected PROVIDER=CONCURRENCY[:RPM]")
+        budgets[provider] = {"concurrency": int(concurrency), "rpm": int(rpm or 0)}
+    return budgets
+
+def model_overrides(model: str, rpm: float = 0) -> Dict[str, str]:
+    """该模型在 worker 进程中的环境变量（history_generator 中的 load_dotenv 不会覆盖已有变量）"""
+    model_info = MODEL_INFO[model]
+    return {
+        "MODEL": model,
+        "LOCAL": str(model_info["local"]),
+        "LOCAL_MODEL_PATH": model_info.get("model_path") or "",
+        "LOCAL_TOKENIZER_PATH": model_info.get("tokenizer_path") or "",
+        "LLM_MAX_RPM": f"{rpm:g}",
+    }
+
+def model_logger(label: str):
+    """并发运行时每行输出带上模型名（及运行编号）前缀"""
+    def say(message: str = ""):
+        print(f"[{label}] {message}", flush=True)
+    return say
+
+def event_printer(label: str):
+    """把 generate / evaluate 的进度事件打印为带前缀的一行"""
+    say = model_logger(label)
+    def on_event(event: Dict):
+        say(f"   📊 {format_event(event)}" if event["event"] != "log" else f"   {event['message']}")
+    return on_event
+
+async def run_history_generation(model: str, run: int, seed: Optional[int], max_workers: int, debug: bool,
+                                 model_manager=None, server_pool=None) -> Optional[Dict]:
+    """在共享的 event loop / server 池上完成第 run 次运行的 history 生成；成功时返回生成统计，失败返回 None"""
+    from Data.history_generator import GenerationConfig, generate
+
+    label = f"{model} r{run}"
+    say = model_logger(label)
+    data_file = DATA_FILES["env"]
+    system_prompt = SYSTEM_PROMPTS["env"]
+    output_file = history_file(model, run)
+
+    # 确保输出目录存在
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    if not data_file.exists():
+        say(f"❌ Data file not found: {data_file}")
+        return None
+
+    if not system_prompt.exists():
+        say(f"❌ System prompt file not found: {system_prompt}")
+        return None
+
+    say(f"🔄 Generating history for env data...")
+    say(f"   📁 Input: {data_file.name}")
+    say(f"   📁 Output: {output_file}")
+    say(f"   🔧 Workers: {max_workers}" + (f", seed: {seed}" if seed is not None else "")
+        + (f", RPM limit: {os.environ['LLM_MAX_RPM']}" if os.environ.get("LLM_MAX_RPM", "0") != "0" else ""))
+
+    config = GenerationConfig(
+        query_file=data_file,
+        resp_file=output_file,
+        system_prompt=str(system_prompt),
+        server_category="Env_risk",
+        max_workers=max_workers,
+        debug=debug,
+        label=label,
+        progress_interval=PROGRESS_INTERVAL,
+        seed=seed,
+    )
+    try:
+        stats = await generate(config, on_event=event_printer(label), model_manager=model_manager,
+                               server_pool=server_pool)
+    except (FileNotFoundError, ValueError) as e:
+        say(f"❌ {e}")
+        return None
+    except Exception as e:
+        say(f"❌ Error during history generation: {e}")
+        return None
+
+    if stats.get("error"):
+        say(f"❌ History generation failed: {stats['error']}")
+        return None
+    say(f"✓ History generation completed in {stats['elapsed']:.1f}s "
+        f"({stats['ok']} new records, {stats['rate']:.2f} queries/s)")
+    return stats
+
+def run_evaluation(model: str, run: int) -> bool:
+    """评估第 run 次运行的 history 文件（流式单遍），结果写入该运行的 evaluation 目录"""
+    from Evaluator.env_risk_eval import evaluate, ledger_path_for, save_results
+
+    label = f"{model} r{run}"
+    say = model_logger(label)
+    input_file = history_file(model, run)
+    output_file = evaluation_file(model, run)
+
+    if not input_file.exists():
+        say(f"❌ History file not found: {input_file}")
+        return False
+
+    say(f"🔍 Running evaluation for env data...")
+    say(f"📁 Input: {input_file}")
+    say(f"📁 Output: {output_file}")
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # 逐记录账本写在结果旁边，供 merge_results / 分析脚本按类别、步数、日志来源切片
+        results = evaluate(input_file, on_event=event_printer(label), label=label,
+                           ledger_path=ledger_path_for(output_file))
+        save_results(results, output_file)
+    except Exception as e:
+        say(f"❌ Error during evaluation: {e}")
+        return False
+
+    metrics = results["metrics"]
+    say(f"✓ Evaluation completed: P={metrics['precision']:.3f} R={metrics['recall']:.3f} "
+        f"F1={metrics['f1']:.3f} ACC={metrics['accuracy']:.3f}")
+    return True
+
+async def run_once(model: str, run: int, seed: Optional[int], max_workers: int, debug: bool,
+                   history_gen_only: bool, evaluation_only: bool, model_manager=None, server_pool=None) -> Dict:
+    """一次运行：生成（可跳过）后评估，返回该运行的结果"""
+    results = {"seed": seed}
+    if evaluation_only:
+        # 只做evaluation，跳过history generation
+        results["env"] = {
+            "history_generation": None,
+            "evaluation": await asyncio.to_thread(run_evaluation, model, run)
+        }
+        return results
+
+    started = time.time()
+    generation = await run_history_generation(model, run, seed, max_workers, debug, model_manager, server_pool)
+    finished = time.time()
+    env_success = generation is not None
+    if env_success and not history_gen_only:
+        results["env"] = {
+            "history_generation": env_success,
+            "evaluation": await asyncio.to_thread(run_evaluation, model, run)
+        }
+    else:
+        results["env"] = {
+            "history_generation": env_success,
+            "evaluation": None if history_gen_only else False
+        }
+    if generation is not None:
+        results["env"]["throughput"] = {"records": generation["ok"], "seconds": generation["elapsed"],
+                                        "started": started, "finished": finished}
+        results["env"]["errors"] = generation["errors"]
+    return results
+
+async def run_model(model: str, runs: List[int], seed: Optional[int], max_workers: int, debug: bool,
+                    history_gen_only: bool, evaluation_only: bool, concurrent_runs: bool) -> Dict[str, Dict]:
+    """
+    在一个 event loop 上完成一个模型的所有运行，共享常驻 server 池、LLM 连接与（本地模型）已加载的模型。
+    SIGINT/SIGTERM 取消在途的运行（已完成的结果照常写出），不再开始新的运行。
+    """
+    from Client.server_pool import MCPServerPool
+    from Client.llm_client import aclose_llm_clients
+    from Client.model_manager import get_model_manager, shutdown_model_manager
+    from Utils.retry import retry_stats, reset_retry_stats, format_retry_stats
+
+    say = model_logger(model)
+    model_manager = None
+    server_pool = None
+    if not evaluation_only:
+        if MODEL_INFO[model]["local"]:
+            say("🔧 Loading local model (shared by all runs)...")
+            model_manager = get_model_manager()
+        server_pool = MCPServerPool()
+    reset_retry_stats()
+
+    # 并发运行时在途查询预算由各次运行均分
+    workers = max(1, max_workers // len(runs)) if concurrent_runs else max_workers
+    loop = asyncio.get_running_loop()
+    active: List[asyncio.Task] = []
+    stopping = False
+
+    def stop():
+        nonlocal stopping
+        stopping = True
+        for task in active:
+            task.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows 等平台不支持，退回默认的 KeyboardInterrupt
+
+    def start(run: int) -> asyncio.Task:
+        task = asyncio.create_task(run_once(model, run, run_seed(seed, run), workers, debug, history_gen_only,
+                                            evaluation_only, model_manager, server_pool))
+        active.append(task)
+        return task
+
+    results = {}
+    try:
+        batches = [runs] if concurrent_runs else [[run] for run in runs]
+        for batch in batches:
+            if stopping:
+                break
+            tasks = [start(run) for run in batch]
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+            active.clear()
+            for run, outcome in zip(batch, outcomes):
+                if isinstance(outcome, asyncio.CancelledError):
+                    outcome = {"error": "interrupted"}
+                elif isinstance(outcome, BaseException):
+                    say(f"❌ Run r{run} failed: {outcome!r}")
+                    outcome = {"error": str(outcome)}
+                results[f"r{run}"] = outcome
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+        if server_pool is not None:
+            await server_pool.aclose()
+            say(f"Server pool: {server_pool.spawned} server process(es) started, "
+                f"{server_pool.reused} session reuse(s) over {len(results)} run(s)")
+        await aclose_llm_clients()
+        stats = retry_stats()
+        if stats:
+            say("Retry statistics (all runs):\n" + format_retry_stats(stats))
+        if model_manager is not None:
+            shutdown_model_manager()
+    return results
+
+def process_model(model: str, runs: List[int], seed: Optional[int] = None, max_workers: int = 10,
+                  debug: bool = False, history_gen_only: bool = False, evaluation_only: bool = False,
+                  rpm: float = 0, concurrent_runs: bool = False) -> Dict[str, Dict]:
+    """worker 进程入口：把该模型的配置写入本进程环境，完成它的所有运行，返回 {"r{i}": 结果}"""
+    os.environ.update(model_overrides(model, rpm))
+    say = model_logger(model)
+
+    say(f"{'='*60}")
+    say(f"🚀 Processing model: {model} (provider: {get_provider(model)}, pid {os.getpid()})")
+    say(f"🔁 Runs: {', '.join(f'r{run}' for run in runs)}" + (" (concurrent)" if concurrent_runs else ""))
+    if history_gen_only:
+        say(f"📝 Mode: History Generation Only (No Evaluation)")
+    elif evaluation_only:
+        say(f"🔍 Mode: Evaluation Only (Skip History Generation)")
+    else:
+        say(f"🔄 Mode: Full Pipeline (History Generation + Evaluation)")
+    say(f"{'='*60}")
+
+    return asyncio.run(run_model(model, runs, seed, max_workers, debug, history_gen_only, evaluation_only,
+                                 concurrent_runs))
+
+def schedule_models(models: List[str], submit, parallel_models: int, models_per_provider: int,
+                    budgets: Dict[str, Dict[str, int]], default_concurrency: int) -> Dict[str, Dict]:
+    """
+    并发调度多个模型：同时最多 parallel_models 个，同一 provider 最多 models_per_provider 个
+    （本地模型一次一个）。按列表顺序启动，某 provider 已满时先启动后面其他 provider 的模型。
+    每个模型分到其 provider 预算（concurrency 个在途查询、rpm 次请求/分钟）的均等一份，
+    submit(model, max_workers, rpm) 启动该模型并返回 Future，其结果为该模型的结果。
+    Ctrl-C 后不再启动新的模型，等待运行中的模型收尾（它们各自取消在途查询）。
+    """
+    provider_models = Counter(get_provider(model) for model in models)
+    pending = list(models)
+    running = {}
+    active = Counter()
+    results = {}
+    while pending or running:
+        for model in list(pending):
+            if len(running) >= parallel_models:
+                break
+            provider = get_provider(model)
+            limit = 1 if provider == "local" else models_per_provider
+            if active[provider] >= limit:
+                continue
+            budget = budgets.get(provider, {"concurrency": default_concurrency, "rpm": 0})
+            slots = min(limit, provider_models[provider])
+            workers = max(1, budget["concurrency"] // slots)
+            rpm = budget["rpm"] / slots
+            pending.remove(model)
+            active[provider] += 1
+            running[submit(model, workers, rpm)] = model
+
+        try:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            print(f"\n⚠ Interrupted, waiting for {len(running)} running model(s) to stop...")
+            pending.clear()
+            continue
+        for future in done:
+            model = running.pop(future)
+            active[get_provider(model)] -= 1
+            try:
+                results[model] = future.result()
+            except Exception as e:
+                print(f"❌ Critical error processing model {model}: {e}")
+                results[model] = {"error": str(e)}
+    # 按输入顺序返回
+    return {model: results[model] for model in models if model in results}
+
+def summarize_throughput(all_results: Dict[str, Dict], wall_seconds: Optional[float] = None) -> Dict:
+    """
+    汇总所有模型新生成的记录数，给出整体吞吐与相对逐个串行运行的加速比。
+    wall_seconds 缺省时取这一组结果自身的生成时间跨度（最早开始到最晚结束），
+    而不是整个作业（含其他运行、模型加载与评估）的耗时。
+    """
+    per_model = {model: result["env"]["throughput"] for model, result in all_results.items()
+                 if isinstance(result.get("env"), dict) and "throughput" in result["env"]}
+    records = sum(t["records"] for t in per_model.values())
+    model_seconds = sum(t["seconds"] for t in per_model.values())
+    if wall_seconds is None:
+        spans = [(t["started"], t["finished"]) for t in per_model.values() if "started" in t]
+        wall_seconds = (max(end for _, end in spans) - min(start for start, _ in spans) if spans
+                        else max((t["seconds"] for t in per_model.values()), default=0.0))
+    return {
+        "records": records,
+        "wall_seconds": wall_seconds,
+        "records_per_second": records / wall_seconds if wall_seconds > 0 else 0.0,
+        "model_seconds": model_seconds,
+        "concurrency_speedup": model_seconds / wall_seconds if wall_seconds > 0 else 0.0,
+        "per_model_records_per_second": {
+            model: t["records"] / t["seconds"] if t["seconds"] > 0 else 0.0 for model, t in per_model.items()
+        },
+    }
+
+def run_analysis(runs: List[int]):
+    """依次运行各次运行目录中的 evaluation/analyze.py，生成 merge_results.py 读取的 CSV"""
+    for run in runs:
+        script = run_dir(run) / "evaluation" / "analyze.py"
+        if not script.exists():
+            print(f"⚠ Warning: {script} not found, skipping analysis of r{run}")
+            continue
+        print(f"📈 Analyzing r{run}: {script}")
+        completed = subprocess.run([sys.executable, str(script)], cwd=script.parent)
+        if completed.returncode != 0:
+            print(f"⚠ Warning: analysis of r{run} exited with code {completed.returncode}")
+
+def main(argv: Optional[List[str]] = None):
+    """主函数"""
+    parser = argparse.ArgumentParser(description='Automated model evaluation pipeline with K-run replication')
+    parser.add_argument('--runs', type=int, default=1,
+                       help='Number of independent repetitions (written to Model_output_r{i})')
+    parser.add_argument('--first-run', type=int, default=1,
+                       help='Index of the first run directory (runs are first-run .. first-run+runs-1)')
+    parser.add_argument('--seed', type=int, default=None,
+                       help='Base seed; run i seeds the environment draws with seed+i (default: unseeded)')
+    parser.add_argument('--concurrent-runs', action='store_true',
+                       help="Execute the runs of a model concurrently on its shared event loop and server pool")
+    parser.add_argument('--group', choices=sorted(DEFAULT_MODELS), default='all',
+                       help='Default model set when --models is not given')
+    parser.add_argument('--max-workers', type=int, default=50,
+                       help='Maximum number of concurrent workers')
+    parser.add_argument('--debug', action='store_true',
+                       help='Enable debug mode')
+    parser.add_argument('--models', nargs='+',
+                       help='Specific models to process')
+    parser.add_argument('--show-progress', action='store_true',
+                       help='Show detailed progress monitoring')
+    parser.add_argument('--history-gen-only', action='store_true',
+                       help='Only run history generation, skip evaluation')
+    parser.add_argument('--evaluation-only', action='store_true',
+                       help='Only run evaluation, skip history generation')
+    parser.add_argument('--analyze', action='store_true',
+                       help="Run each run directory's evaluation/analyze.py at the end")
+    parser.add_argument('--list-models', action='store_true',
+                       help='List all available models and exit')
+    parser.add_argument('--parallel-models', type=int, default=4,
+                       help='Maximum number of models processed concurrently')
+    parser.add_argument('--models-per-provider', type=int, default=1,
+                       help='Maximum number of concurrent models per API provider (they split its budget)')
+    parser.add_argument('--provider-budget', action='append', default=[], metavar='PROVIDER=CONCURRENCY[:RPM]',
+                       help='Rate-limit budget of a provider, e.g. openai=60:3000 '
+                            '(default: --max-workers in-flight queries, no RPM limit); repeatable')
+
+    args = parser.parse_args(argv)
+
+    # 如果用户请求列出模型，显示并退出
+    if args.list_models:
+        print("Available models:")
+        print("\nOnline models:")
+        for model in get_online_models():
+            print(f"  - {model} ({get_provider(model)})")
+        print("\nLocal models:")
+        for model in get_local_models():
+            model_info = MODEL_INFO[model]
+            print(f"  - {model}")
+            print(f"    Model path: {model_info.get('model_path', 'None')}")
+            print(f"    Tokenizer path: {model_info.get('tokenizer_path', 'None')}")
+        sys.exit(0)
+
+    # 检查参数冲突
+    if args.history_gen_only and args.evaluation_only:
+        print("❌ Error: Cannot use both --history-gen-only and --evaluation-only")
+        print("Please choose one mode or use default (full pipeline)")
+        sys.exit(1)
+
+    if args.parallel_models < 1 or args.models_per_provider < 1:
+        print("❌ Error: --parallel-models and --models-per-provider must be >= 1")
+        sys.exit(1)
+
+    if args.runs < 1 or args.first_run < 1:
+        print("❌ Error: --runs and --first-run must be >= 1")
+        sys.exit(1)
+
+    try:
+        budgets = parse_provider_budgets(args.provider_budget)
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+
+    # 根据模式显示不同的启动信息
+    if args.history_gen_only:
+        print("🚀 Starting automated history generation pipeline...")
+        print("📝 Mode: History Generation Only (No Evaluation)")
+    elif args.evaluation_only:
+        print("🚀 Starting automated evaluation pipeline...")
+        print("🔍 Mode: Evaluation Only (Skip History Generation)")
+    else:
+        print("🚀 Starting automated model evaluation pipeline...")
+        print("🔄 Mode: Full Pipeline (History Generation + Evaluation)")
+
+    runs = list(range(args.first_run, args.first_run + args.runs))
+    print(f"Project root: {PROJECT_ROOT}")
+    print(f"Runs: {', '.join(str(run_dir(run).name) for run in runs)}"
+          + (f" (seeds {', '.join(str(run_seed(args.seed, run)) for run in runs)})" if args.seed is not None else "")
+          + (", concurrent" if args.concurrent_runs else ""))
+
+    load_dotenv_safe()
+
+    models_to_process = args.models if args.models else DEFAULT_MODELS[args.group]
+
+    # 验证所有模型都在MODEL_INFO中存在
+    invalid_models = [model for model in models_to_process if model not in MODEL_INFO]
+    if invalid_models:
+        print(f"❌ Error: The following models are not found in MODEL_INFO: {invalid_models}")
+        print(f"Available models: {list(MODEL_INFO.keys())}")
+        sys.exit(1)
+
+    print(f"Models to process: {models_to_process}")
+    print(f"Scheduler: {args.parallel_models} model(s) in parallel, {args.models_per_provider} per provider")
+    for provider, budget in budgets.items():
+        print(f"   {provider}: {budget['concurrency']} in-flight queries, "
+              f"{budget['rpm'] or 'unlimited'} requests/min")
+
+    # 创建必要的目录
+    for run in runs:
+        for group in {model_group(model) for model in models_to_process}:
+            (run_dir(run) / "history" / group).mkdir(parents=True, exist_ok=True)
+            (run_dir(run) / "evaluation" / group).mkdir(parents=True, exist_ok=True)
+
+    # 初始化进度监控器
+    progress_monitor = None
+    if args.show_progress:
+        progress_monitor = ProgressMonitor(len(models_to_process))
+        print(f"📊 Progress monitoring enabled")
+
+    start_time = time.time()
+
+    # worker 进程在多个模型之间复用：每个 worker 只启动一次解释器、只导入一次 history_generator 等模块
+    with ProcessPoolExecutor(max_workers=args.parallel_models,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        def submit(model: str, max_workers: int, rpm: float):
+            if progress_monitor:
+                progress_monitor.update_model(model)
+            return pool.submit(process_model, model, runs, args.seed, max_workers, args.debug,
+                               args.history_gen_only, args.evaluation_only, rpm, args.concurrent_runs)
+
+        all_results = schedule_models(models_to_process, submit, args.parallel_models, args.models_per_provider,
+                                      budgets, args.max_workers)
+
+    total_time = time.time() - start_time
+    mode = ("history_generation_only" if args.history_gen_only
+            else "evaluation_only" if args.evaluation_only else "full_pipeline")
+
+    # 每个运行目录一份 summary，只含该次运行的结果
+    summaries = {}
+    for run in runs:
+        run_results = {model: result.get(f"r{run}", result) for model, result in all_results.items()}
+        throughput = summarize_throughput(run_results)   # 按该次运行自身的生成耗时计算
+        summaries[run] = throughput
+        summary = {
+            "total_time_seconds": total_time,
+            "total_time_hours": total_time / 3600,
+            "models_processed": len(models_to_process),
+            "mode": mode,
+            "run": run,
+            "runs": runs,
+            "seed": run_seed(args.seed, run),
+            "concurrent_runs": args.concurrent_runs,
+            "scheduler": {
+                "parallel_models": args.parallel_models,
+                "models_per_provider": args.models_per_provider,
+                "provider_budgets": budgets,
+            },
+            "throughput": throughput,
+            "results": run_results
+        }
+        summary_file = run_dir(run) / "pipeline_summary.json"
+        try:
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+            print(f"\n✓ Pipeline summary saved to: {summary_file}")
+        except Exception as e:
+            print(f"⚠ Warning: Could not save summary: {e}")
+
+    if args.analyze and not args.history_gen_only:
+        run_analysis(runs)
+
+    print(f"\n{'='*60}")
+    if args.history_gen_only:
+        print(f"🎉 History Generation Pipeline completed!")
+        print(f"📝 Mode: History Generation Only (No Evaluation)")
+    elif args.evaluation_only:
+        print(f"🎉 Evaluation Pipeline completed!")
+        print(f"🔍 Mode: Evaluation Only (Skip History Generation)")
+    else:
+        print(f"🎉 Full Pipeline completed!")
+        print(f"🔄 Mode: History Generation + Evaluation")
+    print(f"Total time: {total_time/3600:.2f} hours")
+    print(f"Models processed: {len(models_to_process)} x {len(runs)} run(s)")
+    records = sum(t["records"] for t in summaries.values())
+    if records:
+        model_seconds = sum(t["model_seconds"] for t in summaries.values())
+        print(f"Aggregate throughput: {records} records, {records / total_time:.2f} records/s "
+              f"({model_seconds / total_time:.2f}x vs. sequential)")
+    print(f"Results saved to:")
+    for run in runs:
+        print(f"  📁 {run_dir(run)}/{{history,evaluation}}")
+    print(f"{'='*60}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n⚠ Pipeline interrupted by user")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Critical error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)